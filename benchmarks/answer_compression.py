@@ -0,0 +1,99 @@
+"""
+Measure the answer compression of the sql backend.
+
+Stores the same generated cards without compression, with zlib and with
+zlib plus a trained dictionary, then reports the database size, the
+compression ratio, the full-deck scan time and the time to remove 1000 cards
+of each. Prints the results as json.
+
+usage: python benchmarks/answer_compression.py --cards 20000 --answer-words 150
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from anki_scroll.services import Card
+from anki_scroll.sql_service import SqlConfig, SqlDeckService
+
+_WORDS = (
+    "the cell membrane protein energy transport gradient molecule enzyme "
+    "reaction substrate pathway signal receptor binding structure function "
+    "is a of in and to which that by with for during process called when"
+).split()
+
+
+def _answers(count: int, words: int, seed: int = 0) -> list[str]:
+    generator = random.Random(seed)
+    return [
+        " ".join(generator.choice(_WORDS) for _ in range(words)).capitalize() + "."
+        for _ in range(count)
+    ]
+
+
+def _best_of(repeat: int, fn) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(directory: Path, name: str, cards: list[Card], threshold: int | None, dictionary: bool, repeat: int) -> dict:
+    database = directory / f"{name}.sqlite3"
+    service = SqlDeckService(config=SqlConfig(database=str(database), compress_threshold=threshold))
+    deck = service.create_deck("bench")
+    if dictionary:
+        # train on a first sample, as a deployment would on its existing answers
+        sample = len(cards) // 10
+        deck.add_many(cards[:sample])
+        service.train_compression_dictionary()
+        for card in cards[:sample]:
+            deck.remove(card)
+        deck.add_many(cards[:sample])
+        deck.add_many(cards[sample:])
+    else:
+        deck.add_many(cards)
+    service.checkpoint("TRUNCATE")
+    report = service.compression_report()
+    results = {
+        "file_bytes": database.stat().st_size,
+        "ratio": report.ratio,
+        "compressed_answers": report.compressed_answers,
+        "scan_seconds": _best_of(repeat, lambda: list(deck)),
+    }
+    start = time.perf_counter()
+    deck.remove_many(cards[-1000:])
+    results["remove_1000_seconds"] = time.perf_counter() - start
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--cards", type=int, default=20_000)
+    parser.add_argument("--answer-words", type=int, default=150)
+    parser.add_argument("--threshold", type=int, default=256)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    cards = [
+        Card(f"question {i}", answer)
+        for i, answer in enumerate(_answers(args.cards, args.answer_words))
+    ]
+    with tempfile.TemporaryDirectory() as name:
+        directory = Path(name)
+        results = {
+            "plain": run(directory, "plain", cards, None, False, args.repeat),
+            "zlib": run(directory, "zlib", cards, args.threshold, False, args.repeat),
+            "zlib_dictionary": run(directory, "dictionary", cards, args.threshold, True, args.repeat),
+        }
+    print(json.dumps({"cards": args.cards, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
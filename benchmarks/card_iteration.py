@@ -0,0 +1,90 @@
+"""
+Benchmark of full-deck iteration.
+
+Compares building the slotted Card used by the storage layer with building
+a validated pydantic model (the previous Card), and times iterating
+SqlDeck and SimpleDeck. Prints the results as json.
+
+usage: python benchmarks/card_iteration.py --cards 100000
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+
+from pydantic import BaseModel
+
+from anki_scroll.services import Card
+from anki_scroll.simple_services import SimpleDeck
+from anki_scroll.sql_service import SqlConfig, SqlDeckService
+
+
+class PydanticCard(BaseModel):
+    """same fields as Card, validated on construction"""
+    question: str
+    answer: str
+
+
+def _best_of(repeat: int, fn) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--cards", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rows = [(f"question {i}", f"answer {i} " * 10) for i in range(args.cards)]
+    results: dict[str, float] = {}
+    results["build_pydantic_card"] = _best_of(
+        args.repeat, lambda: [PydanticCard(question=q, answer=a) for q, a in rows]
+    )
+    results["build_slotted_card"] = _best_of(
+        args.repeat, lambda: [Card(q, a) for q, a in rows]
+    )
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = str(Path(directory) / "bench.sqlite3")
+        service = SqlDeckService(config=SqlConfig(database=database))
+        deck = service.create_deck("bench")
+        deck.add_many(Card(q, a) for q, a in rows)
+
+        def iterate_rows_to_pydantic():
+            conn = sqlite3.connect(database)
+            conn.row_factory = sqlite3.Row
+            try:
+                cursor = conn.execute(
+                    "SELECT question, answer FROM cards WHERE deck_id = ? ORDER BY id",
+                    (deck.id(),),
+                )
+                for row in cursor:
+                    PydanticCard(question=row["question"], answer=row["answer"])
+            finally:
+                conn.close()
+
+        results["sql_iterate_pydantic"] = _best_of(args.repeat, iterate_rows_to_pydantic)
+        results["sql_iterate"] = _best_of(args.repeat, lambda: list(deck))
+
+    simple = SimpleDeck("bench")
+    simple.add_many(Card(q, a) for q, a in rows)
+    results["simple_iterate"] = _best_of(args.repeat, lambda: list(simple))
+
+    speedup = {
+        "build": results["build_pydantic_card"] / results["build_slotted_card"],
+        "sql_iterate": results["sql_iterate_pydantic"] / results["sql_iterate"],
+    }
+    print(json.dumps({"cards": args.cards, "seconds": results, "speedup": speedup}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
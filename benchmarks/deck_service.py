@@ -0,0 +1,222 @@
+"""
+Micro-benchmarks of the DeckService and Deck operations at scale.
+
+For each backend and deck size, pre-populates a deck (next to a few other
+decks) and times create_deck, add, remove, iteration, decks(), get_deck and
+add_deck of a populated deck. Single-card operations remove cards from the
+middle of the deck and add them back, so linear scans show up as times
+growing with the size. Prints microseconds per operation as json.
+
+Two checks make slowdowns fail the run:
+- --baseline compares with a previous output and flags operations slower
+  than --threshold times the baseline,
+- --max-growth flags single-card operations whose time grows more than that
+  factor between the smallest and the largest size.
+
+Other backends are benchmarked with --backend name=module:factory, the
+factory receiving a temporary directory and returning a DeckService.
+
+usage: python benchmarks/deck_service.py --sizes 10 1000 100000 1000000 --output base.json
+       python benchmarks/deck_service.py --baseline base.json --threshold 2
+"""
+from __future__ import annotations
+
+import argparse
+import importlib
+import json
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable
+
+from anki_scroll.caching_service import CachingDeckService
+from anki_scroll.log_service import LogConfig, LogDeckService
+from anki_scroll.services import Card, Deck, DeckService
+from anki_scroll.simple_services import SimpleDeck, SimpleDeckService
+from anki_scroll.sql_service import SqlConfig, SqlDeckService
+
+Factory = Callable[[str], DeckService]
+
+BACKENDS: dict[str, Factory] = {
+    "simple": lambda directory: SimpleDeckService(),
+    "sqlite": lambda directory: SqlDeckService(
+        config=SqlConfig(database=str(Path(directory) / "bench.sqlite3"))
+    ),
+    "cached_sqlite": lambda directory: CachingDeckService(
+        SqlDeckService(config=SqlConfig(database=str(Path(directory) / "bench.sqlite3")))
+    ),
+    "log": lambda directory: LogDeckService(
+        config=LogConfig(path=str(Path(directory) / "bench.log"))
+    ),
+}
+
+# operations that should not depend on the size of the deck
+CONSTANT_OPERATIONS = ("create_deck", "add", "remove", "get_deck")
+
+
+def _card(i: int) -> Card:
+    return Card(f"synthetic question {i}", f"synthetic answer {i}")
+
+
+def _per_operation(operation: Callable[[], object], count: int) -> float:
+    start = time.perf_counter()
+    for _ in range(count):
+        operation()
+    return (time.perf_counter() - start) / count * 1e6
+
+
+def _best(operation: Callable[[], object], repeat: int) -> float:
+    """Fastest of a few runs, for slow read-only operations."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        operation()
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1e6
+
+
+def _bench_size(factory: Factory, size: int, operations: int, other_decks: int) -> dict[str, float]:
+    with tempfile.TemporaryDirectory() as directory:
+        service = factory(directory)
+        for i in range(other_decks):
+            service.create_deck(f"other {i}").add_many(_card(j) for j in range(10))
+        deck: Deck = service.create_deck("bench")
+        deck.add_many(_card(i) for i in range(size))
+        deck_id = deck.id()
+
+        names = iter(range(operations))
+        create_deck = _per_operation(lambda: service.create_deck(f"new {next(names)}"), operations)
+
+        # cards from the middle of the deck, removed then added back
+        middle = [_card(size // 2 + i) for i in range(min(operations, size))]
+        removing = iter(middle)
+        remove = _per_operation(lambda: deck.remove(next(removing)), len(middle))
+        adding = iter(middle)
+        add = _per_operation(lambda: deck.add(next(adding)), len(middle))
+
+        iterate = _best(lambda: sum(1 for _ in deck), 5)
+        decks = _best(lambda: list(service.decks()), 10)
+        get_deck = _per_operation(lambda: service.get_deck(deck_id), operations)
+
+        copy = SimpleDeck(f"copy {size}")
+        copy.add_many(_card(i) for i in range(size))
+        add_deck = _per_operation(lambda: service.add_deck(copy), 1)
+
+        close = getattr(service, "close", None)
+        if close is not None:
+            close()
+    return {
+        "create_deck": create_deck,
+        "add": add,
+        "remove": remove,
+        "iterate": iterate,
+        "decks": decks,
+        "get_deck": get_deck,
+        "add_deck": add_deck,
+    }
+
+
+def _load_factory(spec: str) -> tuple[str, Factory]:
+    name, _, target = spec.partition("=")
+    module, _, attribute = target.partition(":")
+    if not (name and module and attribute):
+        raise argparse.ArgumentTypeError(f"expected name=module:factory, got {spec!r}")
+    return name, getattr(importlib.import_module(module), attribute)
+
+
+def _regressions(
+    results: dict[str, dict[str, dict[str, float]]],
+    baseline: dict[str, dict[str, dict[str, float]]],
+    threshold: float,
+    min_delta_us: float,
+) -> list[str]:
+    found = []
+    for backend, sizes in results.items():
+        for size, timings in sizes.items():
+            previous = baseline.get(backend, {}).get(size, {})
+            for operation, microseconds in timings.items():
+                before = previous.get(operation)
+                if before is None:
+                    continue
+                if microseconds > before * threshold and microseconds - before > min_delta_us:
+                    found.append(
+                        f"{backend} {size} {operation}: {before:.1f}us -> {microseconds:.1f}us"
+                    )
+    return found
+
+
+def _growth(results: dict[str, dict[str, dict[str, float]]], max_growth: float) -> list[str]:
+    found = []
+    for backend, sizes in results.items():
+        ordered = sorted(sizes, key=int)
+        if len(ordered) < 2:
+            continue
+        smallest, largest = sizes[ordered[0]], sizes[ordered[-1]]
+        for operation in CONSTANT_OPERATIONS:
+            growth = largest[operation] / max(smallest[operation], 1e-3)
+            if growth > max_growth:
+                found.append(
+                    f"{backend} {operation}: x{growth:.1f} from {ordered[0]} to {ordered[-1]} cards"
+                )
+    return found
+
+
+def _commit() -> str | None:
+    try:
+        completed = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return completed.stdout.strip()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--backends", nargs="+", choices=sorted(BACKENDS), default=sorted(BACKENDS))
+    parser.add_argument(
+        "--backend", action="append", default=[], type=_load_factory,
+        help="extra backend as name=module:factory",
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1_000, 100_000])
+    parser.add_argument("--operations", type=int, default=200, help="single-card operations timed")
+    parser.add_argument("--other-decks", type=int, default=20)
+    parser.add_argument("--output", type=Path, help="also write the json to this file")
+    parser.add_argument("--baseline", type=Path, help="previous output to compare with")
+    parser.add_argument("--threshold", type=float, default=2.0)
+    parser.add_argument("--min-delta-us", type=float, default=50.0, help="ignore smaller slowdowns")
+    parser.add_argument("--max-growth", type=float, default=5.0)
+    args = parser.parse_args()
+
+    factories = {name: BACKENDS[name] for name in args.backends}
+    factories.update(args.backend)
+    # sizes are strings so that the output and a loaded baseline compare alike
+    results = {
+        name: {
+            str(size): _bench_size(factory, size, args.operations, args.other_decks)
+            for size in args.sizes
+        }
+        for name, factory in factories.items()
+    }
+    failures = _growth(results, args.max_growth)
+    if args.baseline is not None:
+        baseline = json.loads(args.baseline.read_text())["microseconds_per_operation"]
+        failures += _regressions(results, baseline, args.threshold, args.min_delta_us)
+    report = {
+        "benchmark": "deck_service",
+        "commit": _commit(),
+        "microseconds_per_operation": results,
+        "failures": failures,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output is not None:
+        args.output.write_text(text + "\n")
+    print(text)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
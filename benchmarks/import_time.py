@@ -0,0 +1,69 @@
+"""
+Import time of the web application, checked against a budget.
+
+Imports the module in fresh interpreters with -X importtime, keeps the best
+run and fails when it exceeds the budget or when a module that must be
+loaded lazily (anki_scroll.LAZY_MODULES) was imported.
+Prints the results as json.
+
+usage: python benchmarks/import_time.py --budget-ms 1000
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import subprocess
+import sys
+
+from anki_scroll import LAZY_MODULES
+
+
+def _import_once(module: str) -> tuple[float, list[str]]:
+    code = (
+        f"import {module}; import sys; "
+        f"print(','.join(name for name in {LAZY_MODULES!r} if name in sys.modules))"
+    )
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    total = 0
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line.split("|")
+        if name.strip() == module:
+            total = max(total, int(cumulative))
+    loaded = [name for name in completed.stdout.strip().split(",") if name]
+    return total / 1000, loaded
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--module", default="anki_scroll.webapp.app")
+    parser.add_argument("--budget-ms", type=float, default=1000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    runs = [_import_once(args.module) for _ in range(args.repeat)]
+    best = min(milliseconds for milliseconds, _ in runs)
+    loaded = sorted({name for _, names in runs for name in names})
+    print(
+        json.dumps(
+            {
+                "module": args.module,
+                "best_ms": best,
+                "budget_ms": args.budget_ms,
+                "eager_modules": loaded,
+            },
+            indent=2,
+        )
+    )
+    if best > args.budget_ms or loaded:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Compare LogDeckService with SqlDeckService on bulk append and full-deck scan,
+plus the time needed to reopen the store.
+
+The log reopens from the index saved by close, reopen_without_index is the
+replay of the whole log needed after a crash.
+
+usage: python benchmarks/log_vs_sqlite.py --cards 100000
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable
+
+from anki_scroll.log_service import LogConfig, LogDeckService
+from anki_scroll.services import Card, DeckService
+from anki_scroll.sql_service import SqlConfig, SqlDeckService
+
+
+def _timed(fn: Callable[[], object]) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def _close(service: DeckService) -> None:
+    close = getattr(service, "close", None)
+    if close is not None:
+        close()
+
+
+def run(open_service: Callable[[], DeckService], cards: list[Card]) -> dict[str, float]:
+    service = open_service()
+    deck = service.create_deck("bench")
+    results = {
+        "bulk_append": _timed(lambda: deck.add_many(cards)),
+        "single_append_1000": _timed(lambda: [deck.add(card) for card in cards[:1000]]),
+        "scan": _timed(lambda: list(deck)),
+    }
+    _close(service)
+    reopened = []
+    results["reopen"] = _timed(lambda: reopened.append(open_service()))
+    _close(reopened[0])
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--cards", type=int, default=100_000)
+    args = parser.parse_args()
+
+    cards = [Card(f"question {i}", f"answer {i} " * 10) for i in range(args.cards)]
+    with tempfile.TemporaryDirectory() as directory:
+        log_config = LogConfig(path=str(Path(directory) / "bench.log"))
+        sql_config = SqlConfig(database=str(Path(directory) / "bench.sqlite3"))
+        results = {
+            "cards": args.cards,
+            "log": run(lambda: LogDeckService(config=log_config), cards),
+            "sqlite": run(lambda: SqlDeckService(config=sql_config), cards),
+        }
+        Path(log_config.path + ".index").unlink()
+        reopened = []
+        results["log"]["reopen_without_index"] = _timed(
+            lambda: reopened.append(LogDeckService(config=log_config))
+        )
+        reopened[0].close()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
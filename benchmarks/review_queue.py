@@ -0,0 +1,55 @@
+"""
+Latency of the review queue as decks grow.
+
+For each deck size, times next_due followed by grade on the in-memory and
+the sqlite review services. Prints the mean microseconds per review as json.
+
+usage: python benchmarks/review_queue.py --sizes 1000 10000 100000
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+
+from anki_scroll.scheduling import GOOD
+from anki_scroll.services import Card, DeckService, ReviewService
+from anki_scroll.simple_services import SimpleDeckService, SimpleReviewService
+from anki_scroll.sql_service import SqlConfig, SqlDeckService
+
+
+def _review_latency(deck_service: DeckService, review_service: ReviewService, size: int, reviews: int) -> float:
+    deck = deck_service.create_deck(f"bench {size}")
+    deck.add_many(Card(f"question {i}", f"answer {i}") for i in range(size))
+    now = time.time() + 60
+    # the first call lets the in-memory service index the deck
+    review_service.next_due(deck.id(), now)
+    start = time.perf_counter()
+    for _ in range(reviews):
+        state = review_service.next_due(deck.id(), now)
+        review_service.grade(deck.id(), state.card_id, GOOD, now)
+    return (time.perf_counter() - start) / reviews * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--reviews", type=int, default=500)
+    args = parser.parse_args()
+
+    results: dict[str, dict[int, float]] = {"simple": {}, "sqlite": {}}
+    simple = SimpleDeckService()
+    simple_reviews = SimpleReviewService(simple)
+    with tempfile.TemporaryDirectory() as directory:
+        sql = SqlDeckService(config=SqlConfig(database=str(Path(directory) / "bench.sqlite3")))
+        sql_reviews = sql.review_service()
+        for size in args.sizes:
+            results["simple"][size] = _review_latency(simple, simple_reviews, size, args.reviews)
+            results["sqlite"][size] = _review_latency(sql, sql_reviews, size, args.reviews)
+    print(json.dumps({"microseconds_per_review": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Stress test of SqlDeckService shared by several worker processes.
+
+Each worker process reads the same database for a fixed duration while one
+extra process keeps adding cards, like several uvicorn workers would.
+Prints the read throughput for every worker count as json, it should grow
+with the number of workers and no worker should fail with ``database is locked``.
+
+usage: python benchmarks/sqlite_workers.py --workers 1 2 4 8 --duration 3
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing
+import tempfile
+import time
+from pathlib import Path
+
+from anki_scroll.services import Card
+from anki_scroll.sql_service import SqlConfig, SqlDeckService
+
+
+def _reader(database: str, deck_id: str, duration: float, results) -> None:
+    service = SqlDeckService(config=SqlConfig(database=database))
+    deck = service.get_deck(deck_id)
+    reads = 0
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        deck.stats()
+        for _ in deck:
+            pass
+        reads += 1
+    results.put(reads)
+
+
+def _writer(database: str, deck_id: str, stop, results) -> None:
+    service = SqlDeckService(config=SqlConfig(database=database))
+    deck = service.get_deck(deck_id)
+    writes = 0
+    while not stop.is_set():
+        deck.add(Card(question=f"write {writes}", answer="answer"))
+        writes += 1
+    results.put(writes)
+
+
+def run(workers: int, duration: float, cards: int, directory: Path) -> dict:
+    database = str(directory / f"workers-{workers}.sqlite3")
+    service = SqlDeckService(config=SqlConfig(database=database))
+    deck = service.create_deck("stress")
+    for i in range(cards):
+        deck.add(Card(question=f"question {i}", answer=f"answer {i}"))
+
+    read_results = multiprocessing.Queue()
+    write_results = multiprocessing.Queue()
+    stop = multiprocessing.Event()
+    writer = multiprocessing.Process(
+        target=_writer, args=(database, deck.id(), stop, write_results)
+    )
+    readers = [
+        multiprocessing.Process(
+            target=_reader, args=(database, deck.id(), duration, read_results)
+        )
+        for _ in range(workers)
+    ]
+    writer.start()
+    for reader in readers:
+        reader.start()
+    reads = sum(read_results.get() for _ in readers)
+    for reader in readers:
+        reader.join()
+    stop.set()
+    writes = write_results.get()
+    writer.join()
+
+    failures = sum(1 for process in [writer, *readers] if process.exitcode != 0)
+    return {
+        "workers": workers,
+        "reads_per_second": reads / duration,
+        "writes_per_second": writes / duration,
+        "failed_processes": failures,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--duration", type=float, default=3.0)
+    parser.add_argument("--cards", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = [
+            run(workers, args.duration, args.cards, Path(directory))
+            for workers in args.workers
+        ]
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""
+End-to-end throughput and latency of the web application.
+
+Drives the whole FastAPI app in process through the user flow
+home -> deck -> new spec -> N x (select page, select) -> delete the selected
+cards, with concurrent users, on decks pre-populated with synthetic cards.
+Cards are generated by a stub with a configurable latency so no llm is
+called. Each backend and deck size runs in a fresh process so the memory
+figures do not leak from one case to the next.
+
+Prints json with the throughput, the p50/p99 latency of each step, the hit
+rate of the deck cache and the peak memory, written with the commit so runs can be compared. The deck page
+renders every card, it dominates the flow on large decks.
+
+usage: python benchmarks/webapp_flows.py --sizes 1000 100000 1000000 --users 8
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import html
+import itertools
+import json
+import multiprocessing
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import httpx
+
+from anki_scroll.caching_service import CachingDeckService
+from anki_scroll.services import Card, CardGenerator, DeckService
+from anki_scroll.simple_services import SimpleDeckService
+from anki_scroll.sql_service import SqlConfig, SqlDeckService
+from anki_scroll.webapp import WebState, build_app
+from anki_scroll.webapp.app import SHARED_CACHE_MAX_STALENESS
+from anki_scroll.webapp.profiling import ProfilingConfig
+
+BACKENDS = ("simple", "sqlite", "cached_sqlite")
+_HIDDEN = re.compile(r'<input type="hidden" name="(question|answer)" value="([^"]*)">')
+_WORDS = ("river", "planet", "theorem", "enzyme", "sonnet", "glacier", "market", "neuron")
+
+
+class StubCardGenerator(CardGenerator):
+    """Unique cards after a fixed delay, standing in for the llm."""
+
+    def __init__(self, latency: float) -> None:
+        self._latency = latency
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def create_card(self, theme: str, instructions: str) -> Card:
+        time.sleep(self._latency)
+        with self._lock:
+            n = next(self._counter)
+        words = " ".join(_WORDS[(n >> shift) % len(_WORDS)] for shift in range(0, 24, 3))
+        return Card(question=f"{theme} {words} {n}?", answer=f"{instructions} {n}")
+
+
+def _deck_service(backend: str, directory: str) -> DeckService:
+    if backend == "simple":
+        return SimpleDeckService()
+    sql = SqlDeckService(config=SqlConfig(database=str(Path(directory) / "bench.sqlite3")))
+    if backend == "cached_sqlite":
+        # configured like the web application
+        return CachingDeckService(sql, shared=True, max_staleness=SHARED_CACHE_MAX_STALENESS)
+    return sql
+
+
+def _populate(deck_service: DeckService, size: int) -> str:
+    deck = deck_service.create_deck(f"bench {size}")
+    deck.add_many(Card(f"synthetic question {i}", f"synthetic answer {i}") for i in range(size))
+    return deck.id()
+
+
+def _percentile(values: list[float], percentile: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(percentile / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def _timed(timings: dict[str, list[float]], step: str, request) -> httpx.Response:
+    start = time.perf_counter()
+    response = await request
+    timings[step].append(time.perf_counter() - start)
+    if response.status_code >= 400:
+        raise RuntimeError(f"{step} failed with {response.status_code}: {response.text[:200]}")
+    return response
+
+
+async def _user_flow(
+    client: httpx.AsyncClient,
+    deck_id: str,
+    user: int,
+    selects: int,
+    timings: dict[str, list[float]],
+) -> None:
+    await _timed(timings, "home", client.get("/home/"))
+    await _timed(timings, "deck", client.get(f"/deck/{deck_id}"))
+    response = await _timed(
+        timings,
+        "new_spec",
+        client.post(
+            f"/create_card/{deck_id}/",
+            data={"theme": f"user {user}", "instructions": "benchmark"},
+        ),
+    )
+    spec_path = response.headers["location"]
+    selected = []
+    for _ in range(selects):
+        page = await _timed(timings, "select_page", client.get(spec_path))
+        fields = {name: html.unescape(value) for name, value in _HIDDEN.findall(page.text)}
+        await _timed(timings, "select", client.post(spec_path, data=fields))
+        selected.append(fields)
+    for fields in selected:
+        await _timed(
+            timings, "delete", client.post(f"/deck/{deck_id}/cards/delete", data=fields)
+        )
+
+
+async def _run_flows(
+    app, deck_id: str, users: int, flows: int, selects: int
+) -> tuple[float, dict[str, list[float]]]:
+    timings: dict[str, list[float]] = defaultdict(list)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        queue: asyncio.Queue[int] = asyncio.Queue()
+        for flow in range(flows):
+            queue.put_nowait(flow)
+
+        async def worker() -> None:
+            while not queue.empty():
+                await _user_flow(client, deck_id, queue.get_nowait(), selects, timings)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(users)))
+        return time.perf_counter() - start, timings
+
+
+def run_case(
+    backend: str, size: int, users: int, flows: int, selects: int, latency: float
+) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        deck_service = _deck_service(backend, directory)
+        start = time.perf_counter()
+        deck_id = _populate(deck_service, size)
+        populate_seconds = time.perf_counter() - start
+        caching = isinstance(deck_service, CachingDeckService)
+        before = deck_service.cache_stats() if caching else None
+        state = WebState(deck_service=deck_service, card_generator=StubCardGenerator(latency))
+        app = build_app(state, profiling=ProfilingConfig())
+        seconds, timings = asyncio.run(_run_flows(app, deck_id, users, flows, selects))
+        state.async_deck_service.close()
+    requests = sum(len(values) for values in timings.values())
+    cache = None
+    if caching:
+        # lookups of the flows only
+        after = deck_service.cache_stats()
+        hits, misses = after.hits - before.hits, after.misses - before.misses
+        cache = {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+        }
+    return {
+        "backend": backend,
+        "deck_size": size,
+        "populate_seconds": populate_seconds,
+        "flow_seconds": seconds,
+        "requests": requests,
+        "requests_per_second": requests / seconds,
+        "flows_per_second": flows / seconds,
+        "latency_ms": {
+            step: {
+                "count": len(values),
+                "p50": _percentile(values, 50) * 1000,
+                "p99": _percentile(values, 99) * 1000,
+            }
+            for step, values in timings.items()
+        },
+        "cache": cache,
+        # ru_maxrss is in kilobytes on linux
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def _commit() -> str | None:
+    try:
+        completed = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return completed.stdout.strip()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000])
+    parser.add_argument("--users", type=int, default=8, help="concurrent users")
+    parser.add_argument("--flows", type=int, default=32, help="user flows per case")
+    parser.add_argument("--selects", type=int, default=10, help="cards selected per flow")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="stub generation latency")
+    parser.add_argument("--output", type=Path, help="also write the json to this file")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for backend in args.backends:
+        for size in args.sizes:
+            # a fresh process per case isolates the peak memory
+            with context.Pool(1) as pool:
+                results.append(
+                    pool.apply(
+                        run_case,
+                        (backend, size, args.users, args.flows, args.selects, args.latency_ms / 1000),
+                    )
+                )
+            print(f"{backend} {size}: {results[-1]['requests_per_second']:.0f} req/s", file=sys.stderr)
+    report = {
+        "benchmark": "webapp_flows",
+        "commit": _commit(),
+        "config": {
+            "users": args.users,
+            "flows": args.flows,
+            "selects": args.selects,
+            "latency_ms": args.latency_ms,
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output is not None:
+        args.output.write_text(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,3 +4,5 @@ contain config variables used by other modules
 from pathlib import Path
 
 data_folder = Path(__file__).parent / "data"
+# results of the wikipedia tools, see train.tool_cache
+tool_cache_path = data_folder / "tool_cache.sqlite3"
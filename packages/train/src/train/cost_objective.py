@@ -0,0 +1,176 @@
+"""
+Latency and cost aware objective for the WikipediaIndex search module.
+
+Recall alone rewards prompts making the agent call the index again and again.
+MeasuredWikipediaIndex records, for each example, the tool calls, LM tokens
+and wall time of the search next to the websites, cost_aware_feedback turns
+them into a single score with configurable weights, and measure_candidates
+averages them per GEPA candidate for the recall vs cost chart of the report.
+
+Tokens are only counted for calls reaching the LM: responses served by the
+dspy cache count 0 tokens and almost no time, disable the cache
+(dspy.configure_cache(enable_memory_cache=False, enable_disk_cache=False),
+or an LM created with cache=False like anki_scroll.llms.grok_fast_no_cache)
+before measuring candidates.
+
+The seconds are the wall time of the whole search, LM and tools. Under a
+train.tool_cache.ToolCache a cached search or article takes no http time, the
+seconds then mostly measure the LM, compare candidates measured with the same
+cache content.
+"""
+from dataclasses import dataclass
+import time
+from typing import Any, Callable
+
+import dspy
+from dspy.utils.usage_tracker import track_usage
+
+from anki_scroll.service.website_query import WikipediaIndex
+from train.wikipedia_index_search import ScoreFeedback, recall_feedback, recall_metric
+
+# fields added to the predictions by MeasuredWikipediaIndex
+cost_fields = ("tool_calls", "tokens", "seconds")
+
+
+def count_tool_calls(trajectory: dict[str, Any]) -> int:
+    """tools called by a ReAct agent, the final finish is not a call"""
+    return sum(
+        1 for key, value in trajectory.items()
+        if key.startswith("tool_name_") and value != "finish"
+    )
+
+
+def count_tokens(usage: dict[str, dict[str, Any]]) -> int:
+    """tokens of every LM in a dspy usage summary"""
+    total = 0
+    for lm_usage in usage.values():
+        tokens = lm_usage.get("total_tokens")
+        if tokens is None:
+            tokens = (lm_usage.get("prompt_tokens") or 0) + (lm_usage.get("completion_tokens") or 0)
+        total += tokens
+    return total
+
+
+class MeasuredWikipediaIndex(WikipediaIndex):
+    """
+    WikipediaIndex whose predictions also hold the tool calls, tokens and
+    seconds of the search. It has the same predictors, the optimized prompts
+    load in a WikipediaIndex.
+    """
+
+    def forward(self, query: str, limit: int = 5) -> dspy.Prediction:
+        start = time.perf_counter()
+        # nested trackers roll their usage up, the caller's tracking is kept
+        with track_usage() as tracker:
+            preds = self.search_agent(query=query, n=limit)
+        return dspy.Prediction(
+            websites=list(preds.articles),
+            tool_calls=count_tool_calls(preds.trajectory),
+            tokens=count_tokens(tracker.get_total_tokens()),
+            seconds=time.perf_counter() - start,
+        )
+
+
+@dataclass
+class CostWeights:
+    """Recall lost per unit of cost, all zero gives the recall."""
+
+    per_tool_call: float = 0.0
+    per_second: float = 0.0
+    per_1k_tokens: float = 0.0
+
+    def penalty(self, tool_calls: float, tokens: float, seconds: float) -> float:
+        return (
+            self.per_tool_call * tool_calls
+            + self.per_second * seconds
+            + self.per_1k_tokens * tokens / 1000
+        )
+
+
+def cost_aware_feedback(weights: CostWeights) -> Callable[..., ScoreFeedback]:
+    """
+    GEPA metric scoring recall minus the weighted costs, floored at 0, the
+    feedback tells the reflection LM what the search cost.
+    Predictions without costs are scored by recall only.
+    """
+
+    def metric(gold: dspy.Example, pred: dspy.Prediction, trace=None, pred_name=None, pred_trace=None) -> ScoreFeedback:
+        recall = recall_feedback(gold, pred, trace, pred_name, pred_trace)
+        if any(pred.get(field) is None for field in cost_fields):
+            return recall
+        penalty = weights.penalty(pred["tool_calls"], pred["tokens"], pred["seconds"])
+        feedback = recall.feedback + (
+            f"the search called the tools {pred['tool_calls']} times, used {pred['tokens']} tokens"
+            f" and took {pred['seconds']:.1f} seconds, lowering the score by {penalty:.2f}:"
+            f" find the pages with fewer and more precise searches\n"
+        )
+        return ScoreFeedback(score=max(0.0, recall.score - penalty), feedback=feedback)
+
+    return metric
+
+
+@dataclass
+class CandidateCost:
+    """Mean recall and costs of a candidate over a dataset."""
+
+    index: int
+    recall: float
+    tool_calls: float
+    tokens: float
+    seconds: float
+
+
+def measure_candidates(
+    candidates: list[dspy.Module],
+    dataset: list[dspy.Example],
+    num_threads: int = 7,
+) -> list[CandidateCost]:
+    """
+    Evaluate each candidate, e.g. DspyGEPAResult.candidates, on dataset with
+    its prompts loaded in a MeasuredWikipediaIndex.
+    Failed examples count as 0 recall and are left out of the costs.
+    """
+    evaluate = dspy.Evaluate(
+        devset=dataset,
+        metric=recall_metric,
+        num_threads=num_threads,
+        display_progress=False,
+        provide_traceback=True,
+    )
+    costs = []
+    for index, candidate in enumerate(candidates):
+        measured = MeasuredWikipediaIndex()
+        # same predictors, the lm instances are kept with the prompts
+        for (_, target), (_, source) in zip(measured.named_predictors(), candidate.named_predictors()):
+            target.signature = source.signature
+            target.demos = source.demos
+            target.lm = source.lm
+        results = evaluate(measured).results
+        measures = [pred for _, pred, _ in results if pred.get("seconds") is not None]
+        costs.append(
+            CandidateCost(
+                index=index,
+                recall=sum(score for _, _, score in results) / len(results) if results else 0.0,
+                tool_calls=_mean(pred["tool_calls"] for pred in measures),
+                tokens=_mean(pred["tokens"] for pred in measures),
+                seconds=_mean(pred["seconds"] for pred in measures),
+            )
+        )
+    return costs
+
+
+def _mean(values) -> float:
+    values = list(values)
+    return sum(values) / len(values) if values else 0.0
+
+
+def pareto_front(costs: list[CandidateCost], cost: str) -> list[CandidateCost]:
+    """
+    Candidates no other candidate beats on both recall and the cost attribute,
+    ordered by increasing cost.
+    """
+    front = []
+    for candidate in sorted(costs, key=lambda c: (getattr(c, cost), -c.recall)):
+        if not front or candidate.recall > front[-1].recall:
+            front.append(candidate)
+    return front
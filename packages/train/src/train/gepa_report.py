@@ -1,36 +1,89 @@
+import difflib
+import json
+from dataclasses import asdict
+from pathlib import Path
+
 import matplotlib.pyplot as plt
 from jinja2 import Template
 import markdown
 from dspy.teleprompt.gepa.gepa import DspyGEPAResult
 
+from train.cost_objective import CandidateCost, pareto_front
+
+# cost attributes of CandidateCost charted against recall, with their axis label
+pareto_costs = {
+    "seconds": "Mean latency (s)",
+    "tokens": "Mean tokens",
+    "tool_calls": "Mean tool calls",
+}
+
 
-def generate_gepa_report(result: DspyGEPAResult, chart_path: str = "gepa_chart.png") -> str:
+def generate_score_chart(scores: list[float], chart_path: str) -> None:
+    """Chart the validation score of each candidate, the format follows the extension of chart_path."""
+    iterations = list(range(len(scores)))
+    plt.figure(figsize=(10, 6))
+    # markers hide the line once there are hundreds of candidates
+    plt.plot(iterations, scores, marker='o' if len(scores) <= 100 else None)
+    plt.title('GEPA Optimization: Iterations vs Validation Aggregate Scores')
+    plt.xlabel('Iteration')
+    plt.ylabel('Validation Aggregate Score')
+    plt.grid(True)
+    plt.savefig(chart_path)
+    plt.close()
+
+
+def generate_pareto_chart(costs: list[CandidateCost], chart_path: str) -> None:
+    """Chart recall against each cost, the Pareto optimal candidates joined by a line."""
+    figure, axes = plt.subplots(1, len(pareto_costs), figsize=(6 * len(pareto_costs), 5))
+    for ax, (cost, label) in zip(axes, pareto_costs.items()):
+        front = pareto_front(costs, cost)
+        ax.scatter([getattr(c, cost) for c in costs], [c.recall for c in costs], color='grey', label='candidate')
+        ax.step([getattr(c, cost) for c in front], [c.recall for c in front], where='post', marker='o', color='tab:red', label='Pareto front')
+        # label the front only once the labels would cover the points
+        for c in costs if len(costs) <= 50 else front:
+            ax.annotate(str(c.index), (getattr(c, cost), c.recall), textcoords='offset points', xytext=(4, 4))
+        ax.set_xlabel(label)
+        ax.set_ylabel('Recall')
+        ax.grid(True)
+        ax.legend()
+    figure.suptitle('GEPA candidates: recall vs cost')
+    figure.tight_layout()
+    figure.savefig(chart_path)
+    plt.close(figure)
+
+
+def generate_gepa_report(
+    result: DspyGEPAResult,
+    chart_path: str = "gepa_chart.png",
+    costs: list[CandidateCost] | None = None,
+    pareto_chart_path: str = "gepa_pareto.png",
+) -> str:
     """
     Generate an HTML report for a DspyGEPAResult.
 
     Args:
         result: The DspyGEPAResult to report on.
         chart_path: Path to save the chart PNG file.
+        costs: Recall and costs of the candidates, from train.cost_objective.measure_candidates,
+            adds the recall vs cost chart and the costs of each candidate.
+        pareto_chart_path: Path to save the recall vs cost chart PNG file.
 
     Returns:
         HTML string of the report.
     """
-    # Generate chart
-    iterations = list(range(len(result.val_aggregate_scores)))
-    plt.figure(figsize=(10, 6))
-    plt.plot(iterations, result.val_aggregate_scores, marker='o')
-    plt.title('GEPA Optimization: Iterations vs Validation Aggregate Scores')
-    plt.xlabel('Iteration')
-    plt.ylabel('Validation Aggregate Score')
-    plt.grid(True)
-    plt.savefig(chart_path)
-    plt.close()
+    generate_score_chart(result.val_aggregate_scores, chart_path)
+    if costs:
+        generate_pareto_chart(costs, pareto_chart_path)
+    costs_by_index = {c.index: c for c in costs or []}
+    pareto_optimal = {c.index for cost in pareto_costs for c in pareto_front(costs or [], cost)}
 
     # Prepare iteration data
     iteration_data = [
         {
             'index': i,
-            'score': result.val_aggregate_scores[i]
+            'score': result.val_aggregate_scores[i],
+            'cost': costs_by_index.get(i),
+            'pareto': i in pareto_optimal,
         }
         for i in range(len(result.candidates))
     ]
@@ -80,10 +133,18 @@ def generate_gepa_report(result: DspyGEPAResult, chart_path: str = "gepa_chart.p
         <div class="chart">
             <img src="{{ chart_path }}" alt="GEPA Chart">
         </div>
+        {% if costs %}
+        <h2>Recall vs Cost</h2>
+        <div class="chart">
+            <img src="{{ pareto_chart_path }}" alt="GEPA Pareto Chart">
+        </div>
+        {% endif %}
         <h2>Iterations</h2>
         <ul>
             {% for item in iteration_data %}
-            <li class="iteration">Iteration {{ item.index }}: Score {{ item.score }}</li>
+            <li class="iteration">Iteration {{ item.index }}: Score {{ item.score }}
+                {% if item.cost %}, Recall {{ '%.3f' % item.cost.recall }}, {{ '%.1f' % item.cost.seconds }} s, {{ '%.0f' % item.cost.tokens }} tokens, {{ '%.1f' % item.cost.tool_calls }} tool calls{% if item.pareto %} (Pareto optimal){% endif %}{% endif %}
+            </li>
             {% endfor %}
         </ul>
         <h2>Prompt Summaries</h2>
@@ -101,5 +162,290 @@ def generate_gepa_report(result: DspyGEPAResult, chart_path: str = "gepa_chart.p
     """
 
     template = Template(html_template)
-    html = template.render(chart_path=chart_path, iteration_data=iteration_data, candidate_prompts=candidate_prompts)
-    return html
\ No newline at end of file
+    html = template.render(
+        chart_path=chart_path,
+        pareto_chart_path=pareto_chart_path,
+        costs=costs,
+        iteration_data=iteration_data,
+        candidate_prompts=candidate_prompts,
+    )
+    return html
+
+
+def prompt_diff(parent: list[str], lines: list[str]) -> list[list]:
+    """
+    Edits turning the parent prompt lines into lines:
+    ["=", n] keeps n lines, ["-", n] drops n lines, ["+", [lines]] inserts lines.
+    """
+    edits = []
+    matcher = difflib.SequenceMatcher(None, parent, lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            edits.append(["=", i2 - i1])
+            continue
+        if tag in ("delete", "replace"):
+            edits.append(["-", i2 - i1])
+        if tag in ("insert", "replace"):
+            edits.append(["+", lines[j1:j2]])
+    return edits
+
+
+def _candidate_prompts(candidate) -> dict[str, list[str]]:
+    return {name: pred.signature.instructions.splitlines() for name, pred in candidate.named_predictors()}
+
+
+def write_gepa_report(
+    result: DspyGEPAResult,
+    directory: str | Path,
+    costs: list[CandidateCost] | None = None,
+) -> Path:
+    """
+    Write a report of a large GEPA run to directory and return the path of its viewer, index.html.
+
+    generate_gepa_report puts every prompt in the page, which becomes too large
+    to open after a few hundred candidates. Here the page only holds one row per
+    candidate, paginated, and the prompts of a candidate are loaded when it is
+    expanded. Each candidate stores its prompts as a diff from its parent, the
+    viewer rebuilds them from the chain of parents. The directory holds:
+    - index.html: the viewer, it opens from the file system and holds the
+      scores, parents and costs of the candidates,
+    - prompts/candidate_<index>.js: the prompt diffs of a candidate,
+    - scores.svg and pareto.svg: the charts.
+
+    Args:
+        result: The DspyGEPAResult to report on.
+        directory: Directory of the report, created if needed.
+        costs: Recall and costs of the candidates, from train.cost_objective.measure_candidates.
+    """
+    directory = Path(directory)
+    prompts_directory = directory / "prompts"
+    prompts_directory.mkdir(parents=True, exist_ok=True)
+
+    generate_score_chart(result.val_aggregate_scores, str(directory / "scores.svg"))
+    if costs:
+        generate_pareto_chart(costs, str(directory / "pareto.svg"))
+    costs_by_index = {c.index: asdict(c) for c in costs or []}
+    pareto_optimal = {c.index for cost in pareto_costs for c in pareto_front(costs or [], cost)}
+
+    prompts = [_candidate_prompts(candidate) for candidate in result.candidates]
+    candidates = []
+    for i, candidate_prompts in enumerate(prompts):
+        # a merge has two parents, the diff is taken from the first one
+        parent = next((p for p in result.parents[i] if p is not None), None)
+        parent_prompts = prompts[parent] if parent is not None else {}
+        diffs = {
+            name: prompt_diff(parent_prompts.get(name, []), lines)
+            for name, lines in candidate_prompts.items()
+        }
+        changed = [name for name, lines in candidate_prompts.items() if lines != parent_prompts.get(name)]
+        (prompts_directory / f"candidate_{i}.js").write_text(
+            f"gepaPromptsLoaded({i}, {json.dumps(diffs)});\n"
+        )
+        candidates.append({
+            "index": i,
+            "score": result.val_aggregate_scores[i],
+            "parent": parent,
+            "parents": result.parents[i],
+            "changed": changed,
+            "cost": costs_by_index.get(i),
+            "pareto": i in pareto_optimal,
+        })
+
+    data = {
+        "best": result.best_idx,
+        "total_metric_calls": result.total_metric_calls,
+        "candidates": candidates,
+    }
+    html = Template(lazy_report_template).render(data=data, pareto_chart=bool(costs))
+    index = directory / "index.html"
+    index.write_text(html)
+    return index
+
+
+# browsers do not fetch files next to a page opened from the file system,
+# the viewer loads the prompts with script tags instead
+lazy_report_template = """
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>GEPA Report</title>
+    <style>
+        body { font-family: Arial, sans-serif; margin: 20px; }
+        .chart { text-align: center; margin-bottom: 20px; }
+        .chart img { max-width: 100%; }
+        .expandable { cursor: pointer; background-color: #f0f0f0; padding: 10px; border: 1px solid #ccc; margin-top: 5px; }
+        .expandable:hover { background-color: #e0e0e0; }
+        .best { font-weight: bold; }
+        .content { padding: 10px; border: 1px solid #ccc; }
+        pre { white-space: pre-wrap; margin: 0; }
+        .added { background-color: #e6ffec; }
+        .removed { background-color: #ffebe9; text-decoration: line-through; }
+        .kept { color: #888; }
+        .pages button { margin: 2px; }
+    </style>
+</head>
+<body>
+    <h1>GEPA Optimization Report</h1>
+    <p>{{ data.candidates | length }} candidates, {{ data.total_metric_calls }} metric calls, best candidate {{ data.best }}</p>
+    <div class="chart"><img src="scores.svg" alt="GEPA Chart"></div>
+    {% if pareto_chart %}
+    <h2>Recall vs Cost</h2>
+    <div class="chart"><img src="pareto.svg" alt="GEPA Pareto Chart"></div>
+    {% endif %}
+    <h2>Candidates</h2>
+    <label>Sort by <select id="order" onchange="showPage(0)">
+        <option value="index">index</option>
+        <option value="score">score</option>
+    </select></label>
+    <div class="pages" id="pages"></div>
+    <div id="candidates"></div>
+    <script>
+        const report = {{ data | tojson }};
+        const pageSize = 50;
+        // candidate index -> {predictor: edits}, and the callbacks waiting for it
+        const diffs = {};
+        const waiting = {};
+
+        function gepaPromptsLoaded(index, candidateDiffs) {
+            diffs[index] = candidateDiffs;
+            (waiting[index] || []).forEach(callback => callback());
+            delete waiting[index];
+        }
+
+        function loadDiffs(index, callback) {
+            if (index in diffs) { callback(); return; }
+            if (!(index in waiting)) {
+                waiting[index] = [];
+                const script = document.createElement("script");
+                script.src = "prompts/candidate_" + index + ".js";
+                document.head.appendChild(script);
+            }
+            waiting[index].push(callback);
+        }
+
+        // prompt lines of a candidate, rebuilt from the diffs of its ancestors
+        const prompts = {};
+        function loadPrompts(index, callback) {
+            if (index in prompts) { callback(); return; }
+            const parent = report.candidates[index].parent;
+            const build = () => loadDiffs(index, () => {
+                const parentPrompts = parent === null ? {} : prompts[parent];
+                prompts[index] = {};
+                for (const [name, edits] of Object.entries(diffs[index])) {
+                    prompts[index][name] = applyDiff(parentPrompts[name] || [], edits);
+                }
+                callback();
+            });
+            if (parent === null) { build(); } else { loadPrompts(parent, build); }
+        }
+
+        function applyDiff(parentLines, edits) {
+            const lines = [];
+            let position = 0;
+            for (const [tag, value] of edits) {
+                if (tag === "=") { lines.push(...parentLines.slice(position, position + value)); position += value; }
+                else if (tag === "-") { position += value; }
+                else { lines.push(...value); }
+            }
+            return lines;
+        }
+
+        function line(text, className) {
+            const pre = document.createElement("pre");
+            pre.className = className;
+            pre.textContent = text;
+            return pre;
+        }
+
+        function renderDiff(container, parentLines, edits) {
+            let position = 0;
+            for (const [tag, value] of edits) {
+                if (tag === "=") {
+                    const kept = parentLines.slice(position, position + value);
+                    position += value;
+                    if (kept.length > 4) {
+                        kept.splice(2, kept.length - 4, "... " + (kept.length - 4) + " unchanged lines");
+                    }
+                    kept.forEach(text => container.appendChild(line(text, "kept")));
+                } else if (tag === "-") {
+                    parentLines.slice(position, position + value).forEach(text => container.appendChild(line(text, "removed")));
+                    position += value;
+                } else {
+                    value.forEach(text => container.appendChild(line(text, "added")));
+                }
+            }
+        }
+
+        function toggle(index) {
+            const content = document.getElementById("candidate-" + index);
+            if (content.style.display === "block") { content.style.display = "none"; return; }
+            content.style.display = "block";
+            if (content.dataset.loaded) { return; }
+            content.textContent = "Loading...";
+            const candidate = report.candidates[index];
+            loadPrompts(index, () => {
+                content.textContent = "";
+                content.dataset.loaded = "true";
+                const parentPrompts = candidate.parent === null ? {} : prompts[candidate.parent];
+                for (const [name, lines] of Object.entries(prompts[index])) {
+                    const title = document.createElement("h3");
+                    title.textContent = name + (candidate.changed.includes(name) ? "" : " (unchanged)");
+                    content.appendChild(title);
+                    if (candidate.parent === null || !candidate.changed.includes(name)) {
+                        content.appendChild(line(lines.join("\\n"), ""));
+                    } else {
+                        renderDiff(content, parentPrompts[name] || [], diffs[index][name]);
+                    }
+                }
+            });
+        }
+
+        function describe(candidate) {
+            let text = "Candidate " + candidate.index + ": Score " + candidate.score;
+            if (candidate.parent !== null) { text += ", from " + candidate.parents.join(" and "); }
+            const cost = candidate.cost;
+            if (cost) {
+                text += ", Recall " + cost.recall.toFixed(3) + ", " + cost.seconds.toFixed(1) + " s, "
+                    + cost.tokens.toFixed(0) + " tokens, " + cost.tool_calls.toFixed(1) + " tool calls";
+                if (candidate.pareto) { text += " (Pareto optimal)"; }
+            }
+            return text;
+        }
+
+        function showPage(page) {
+            const order = document.getElementById("order").value;
+            const sorted = report.candidates.slice();
+            if (order === "score") { sorted.sort((a, b) => b.score - a.score); }
+            const list = document.getElementById("candidates");
+            list.textContent = "";
+            for (const candidate of sorted.slice(page * pageSize, (page + 1) * pageSize)) {
+                const header = document.createElement("div");
+                header.className = "expandable" + (candidate.index === report.best ? " best" : "");
+                header.textContent = describe(candidate);
+                header.onclick = () => toggle(candidate.index);
+                const content = document.createElement("div");
+                content.id = "candidate-" + candidate.index;
+                content.className = "content";
+                content.style.display = "none";
+                list.appendChild(header);
+                list.appendChild(content);
+            }
+            const pages = document.getElementById("pages");
+            pages.textContent = "";
+            const count = Math.ceil(sorted.length / pageSize);
+            for (let i = 0; count > 1 && i < count; i++) {
+                const button = document.createElement("button");
+                button.textContent = i + 1;
+                button.disabled = i === page;
+                button.onclick = () => showPage(i);
+                pages.appendChild(button);
+            }
+        }
+
+        showPage(0);
+    </script>
+</body>
+</html>
+"""
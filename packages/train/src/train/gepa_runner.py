@@ -0,0 +1,284 @@
+"""
+Resumable GEPA runs.
+
+GEPA saves its state (candidate pool, validation scores, budget used) in the
+run directory before every iteration and resumes from it when the directory
+already holds a state, so a crashed or interrupted run restarts where it
+stopped instead of spending the LM budget again. The runner adds, in the
+same directory:
+- scores.jsonl: the validation scores of every evaluated candidate, with the
+  tool calls, tokens and seconds of each example when the program measures them,
+- reflective_datasets.jsonl: the examples and feedback used by each reflection,
+- throughput.json: metric calls per minute, rewritten after each iteration.
+
+A resumed run evaluates the iteration interrupted by the crash again, its
+records are dropped from the jsonl files when the first iteration starts.
+
+usage: python -m train.gepa_runner --run-dir runs/wikipedia_index --num-threads 8
+"""
+import argparse
+import functools
+import json
+import threading
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Callable
+
+import dspy
+
+from train.config import data_folder
+from train.cost_objective import CostWeights, MeasuredWikipediaIndex, cost_aware_feedback, cost_fields
+
+
+@dataclass
+class GepaRunConfig:
+    """Parameters of a resumable run, the budget counts the calls of previous attempts."""
+
+    run_dir: Path
+    max_metric_calls: int = 150
+    # candidates are evaluated on a pool of that many threads
+    num_threads: int = 7
+    reflection_minibatch_size: int = 3
+    use_merge: bool = False
+    seed: int = 0
+
+
+@dataclass
+class Throughput:
+    """
+    Metric calls of the current attempt, previous attempts are only in total_metric_calls.
+    metric_calls counts every call, including the feedback calls GEPA does not charge to the budget.
+    """
+
+    metric_calls: int
+    elapsed_seconds: float
+    metric_calls_per_minute: float
+    # metric calls of the whole run, as counted by GEPA
+    total_metric_calls: int
+    iteration: int
+    resumed: bool
+
+
+def _write_json(path: Path, data: Any) -> None:
+    temporary = path.with_name(path.name + ".tmp")
+    temporary.write_text(json.dumps(data, indent=2, default=str))
+    temporary.replace(path)
+
+
+def _iteration(line: str) -> int | None:
+    """iteration of a jsonl record, None for a line cut by a crash"""
+    try:
+        return json.loads(line)["iteration"]
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+class RunRecorder:
+    """
+    GEPA callback appending the scores and reflective datasets to the run
+    directory and counting the metric calls.
+    """
+
+    def __init__(self, run_dir: Path, resumed: bool) -> None:
+        self.run_dir = run_dir
+        self.resumed = resumed
+        self.metric_calls = 0
+        self.total_metric_calls = 0
+        self.iteration = 0
+        self._started_at = time.monotonic()
+        self._lock = threading.Lock()
+        # records of the iterations not in the restored state are dropped once
+        self._truncated = not resumed
+
+    def count(self, metric: Callable) -> Callable:
+        """metric counting its calls, evaluations call it from several threads"""
+
+        @functools.wraps(metric)
+        def counted(*args, **kwargs):
+            with self._lock:
+                self.metric_calls += 1
+            return metric(*args, **kwargs)
+
+        return counted
+
+    def _append(self, filename: str, record: dict[str, Any]) -> None:
+        with self._lock:
+            with open(self.run_dir / filename, "a") as file:
+                file.write(json.dumps(record, default=str) + "\n")
+
+    def _truncate(self, next_iteration: int) -> None:
+        """drop the records of next_iteration and after, GEPA runs them again"""
+        with self._lock:
+            if self._truncated:
+                return
+            self._truncated = True
+            for filename in ("scores.jsonl", "reflective_datasets.jsonl"):
+                path = self.run_dir / filename
+                if not path.exists():
+                    continue
+                kept = []
+                for line in path.read_text().splitlines(keepends=True):
+                    iteration = _iteration(line)
+                    if iteration is not None and iteration < next_iteration:
+                        kept.append(line)
+                temporary = path.with_name(path.name + ".tmp")
+                temporary.write_text("".join(kept))
+                temporary.replace(path)
+
+    def on_iteration_start(self, event) -> None:
+        self._truncate(event["iteration"])
+
+    def on_optimization_end(self, event) -> None:
+        # no iteration started. the events of iteration n see state.i == n - 1
+        # and the state is saved before state.i is incremented, so a state
+        # with i holds the iterations up to i + 1
+        self._truncate(event["final_state"].i + 2)
+
+    def on_valset_evaluated(self, event) -> None:
+        if self.resumed and event["iteration"] == 0:
+            # the seed was recorded by the first attempt
+            return
+        record = {
+            "iteration": event["iteration"],
+            "candidate": event["candidate_idx"],
+            "parents": list(event["parent_ids"]),
+            "average_score": event["average_score"],
+            "scores": {str(key): score for key, score in event["scores_by_val_id"].items()},
+            "is_best": event["is_best_program"],
+        }
+        # GEPA does not pass the outputs of the seed candidate
+        costs = {
+            str(key): {field: output.get(field) for field in cost_fields}
+            for key, output in (event["outputs_by_val_id"] or {}).items()
+            if isinstance(output, dspy.Prediction) and output.get("seconds") is not None
+        }
+        if costs:
+            record["costs"] = costs
+        self._append("scores.jsonl", record)
+
+    def on_reflective_dataset_built(self, event) -> None:
+        self._append(
+            "reflective_datasets.jsonl",
+            {
+                "iteration": event["iteration"],
+                "candidate": event["candidate_idx"],
+                "components": event["components"],
+                "dataset": event["dataset"],
+            },
+        )
+
+    def on_iteration_end(self, event) -> None:
+        self.iteration = event["iteration"]
+        self.total_metric_calls = event["state"].total_num_evals
+        _write_json(self.run_dir / "throughput.json", asdict(self.throughput()))
+
+    def throughput(self) -> Throughput:
+        elapsed = time.monotonic() - self._started_at
+        return Throughput(
+            metric_calls=self.metric_calls,
+            elapsed_seconds=elapsed,
+            metric_calls_per_minute=self.metric_calls / elapsed * 60 if elapsed else 0.0,
+            total_metric_calls=self.total_metric_calls,
+            iteration=self.iteration,
+            resumed=self.resumed,
+        )
+
+
+def run_gepa(
+    program: dspy.Module,
+    metric: Callable,
+    trainset: list[dspy.Example],
+    valset: list[dspy.Example],
+    config: GepaRunConfig,
+    **gepa_options,
+) -> tuple[dspy.Module, Throughput]:
+    """
+    Compile program with dspy.GEPA, resuming from config.run_dir when it holds a state.
+    :param gepa_options: other arguments of dspy.GEPA, e.g. reflection_lm or instruction_proposer
+    """
+    config.run_dir.mkdir(parents=True, exist_ok=True)
+    resumed = (config.run_dir / "gepa_state.bin").exists()
+    recorder = RunRecorder(config.run_dir, resumed)
+    gepa_kwargs = dict(gepa_options.pop("gepa_kwargs", None) or {})
+    gepa_kwargs["callbacks"] = [*gepa_kwargs.get("callbacks", []), recorder]
+    # instructions proposed by an lm define signatures pickle cannot save
+    gepa_kwargs.setdefault("use_cloudpickle", True)
+    gepa = dspy.GEPA(
+        metric=recorder.count(metric),
+        max_metric_calls=config.max_metric_calls,
+        num_threads=config.num_threads,
+        reflection_minibatch_size=config.reflection_minibatch_size,
+        use_merge=config.use_merge,
+        seed=config.seed,
+        track_stats=True,
+        log_dir=str(config.run_dir),
+        gepa_kwargs=gepa_kwargs,
+        **gepa_options,
+    )
+    optimized = gepa.compile(program, trainset=trainset, valset=valset)
+    throughput = recorder.throughput()
+    _write_json(config.run_dir / "throughput.json", asdict(throughput))
+    return optimized, throughput
+
+
+def main() -> None:
+    """Train the WikipediaIndex search module like the notebook, resumable."""
+    from anki_scroll.llms import grok_fast, grok_fast_no_cache, oss_120
+    from anki_scroll.lm_scheduler import LMScheduler, SchedulerConfig, set_scheduler
+    from train.tool_cache import ToolCache
+    from train.wikipedia_index_search import CustomInstructionProposer, load_wikipedia_dataset
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--run-dir", type=Path, default=data_folder / "runs" / "wikipedia_index")
+    parser.add_argument("--max-metric-calls", type=int, default=150)
+    parser.add_argument("--num-threads", type=int, default=7)
+    parser.add_argument("--output", type=Path, default=data_folder / "wikipedia_index.json")
+    parser.add_argument("--per-tool-call", type=float, default=0.0, help="recall lost per tool call")
+    parser.add_argument(
+        "--per-second",
+        type=float,
+        default=0.0,
+        help="recall lost per second, tool results served by the tool cache take no http time",
+    )
+    parser.add_argument("--per-1k-tokens", type=float, default=0.0, help="recall lost per 1000 tokens")
+    args = parser.parse_args()
+
+    config = GepaRunConfig(
+        run_dir=args.run_dir,
+        max_metric_calls=args.max_metric_calls,
+        num_threads=args.num_threads,
+    )
+    weights = CostWeights(
+        per_tool_call=args.per_tool_call,
+        per_second=args.per_second,
+        per_1k_tokens=args.per_1k_tokens,
+    )
+    # the default scheduler runs 4 calls at once, fewer than the evaluation
+    # threads, one more slot for the reflection LM
+    scheduler_config = SchedulerConfig.load()
+    scheduler_config.max_concurrency = max(scheduler_config.max_concurrency, args.num_threads + 1)
+    set_scheduler(LMScheduler(scheduler_config))
+    examples = load_wikipedia_dataset()
+    with ToolCache():
+        # same predictors as WikipediaIndex, the saved prompts load in it
+        index = MeasuredWikipediaIndex()
+        # responses from the dspy cache cost no tokens and almost no time, the
+        # candidates evaluated before would look cheaper than the new ones
+        cost_aware = any((weights.per_tool_call, weights.per_second, weights.per_1k_tokens))
+        index.set_lm(grok_fast_no_cache if cost_aware else grok_fast)
+        optimized, throughput = run_gepa(
+            index,
+            cost_aware_feedback(weights),
+            trainset=examples,
+            valset=examples,
+            config=config,
+            reflection_lm=oss_120,
+            instruction_proposer=CustomInstructionProposer(),
+        )
+    optimized.save(args.output)
+    print(json.dumps(asdict(throughput), indent=2))
+
+
+if __name__ == "__main__":
+    main()
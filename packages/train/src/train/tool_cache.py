@@ -0,0 +1,185 @@
+"""
+Persistent cache of the wikipedia tools used while training.
+
+Evaluations and GEPA iterations repeat the same index searches and article
+fetches, the cache keeps their results in a sqlite file shared by the
+threads and processes of a run and across runs, so that repeated runs are
+bounded by LM time only. In offline mode a missing result raises
+ToolCacheMiss instead of reaching wikipedia. A ReAct agent turns the error of
+a tool into an observation and goes on, so the block also raises
+ToolCacheMiss on exit when a result was missing: the evaluation it ran did
+not see the same pages as the cached runs.
+
+Failed fetches ("article not found: ..." is returned for any error status,
+429 and 5xx included) are not cached, the next call fetches them again.
+
+usage:
+    with ToolCache():
+        index = WikipediaIndex()  # the tools must be created inside the block
+        evaluate(index)
+"""
+import functools
+import hashlib
+import inspect
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Callable
+
+from anki_scroll.service import website_query
+from anki_scroll.service.website_query import WebsiteResult
+from train.config import tool_cache_path
+
+
+class ToolCacheMiss(LookupError):
+    """The result is not cached and the cache is offline."""
+
+
+def _encode_results(results: list[WebsiteResult]) -> Any:
+    return [result.model_dump() for result in results]
+
+
+def _decode_results(value: Any) -> list[WebsiteResult]:
+    return [WebsiteResult(**result) for result in value]
+
+
+def _identity(value: Any) -> Any:
+    return value
+
+
+def _always(value: Any) -> bool:
+    return True
+
+
+def _article_found(value: str) -> bool:
+    return not value.startswith("article not found: ")
+
+
+# module attribute -> (encode, decode, cacheable) of its results
+_TOOLS: dict[str, tuple[Callable[[Any], Any], Callable[[Any], Any], Callable[[Any], bool]]] = {
+    "_query_wikipedia_index": (_encode_results, _decode_results, _always),
+    "_wikipedia_article": (_identity, _identity, _article_found),
+}
+
+
+class ToolCache:
+    """
+    Memoize the wikipedia tools to a sqlite file.
+    Installing the cache replaces the functions of website_query, tools
+    created before, e.g. by WikipediaIndex(), keep calling wikipedia.
+    """
+
+    def __init__(self, path=tool_cache_path, offline: bool = False) -> None:
+        """
+        :param path: sqlite file of the cache, created if needed
+        :param offline: raise ToolCacheMiss instead of calling the tool on a miss,
+            and on exit of the block when there was one
+        """
+        self.path = Path(path)
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+        # first result missing in offline mode
+        self.offline_miss: ToolCacheMiss | None = None
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._originals: dict[str, Callable] = {}
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS tool_results ("
+            " tool TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+            " PRIMARY KEY (tool, key))"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite connections cannot be shared between threads
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def key(arguments: dict[str, Any]) -> str:
+        encoded = json.dumps(arguments, sort_keys=True, default=str)
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+    def get(self, tool: str, key: str) -> Any | None:
+        row = self._connection().execute(
+            "SELECT value FROM tool_results WHERE tool = ? AND key = ?", (tool, key)
+        ).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def put(self, tool: str, key: str, value: Any) -> None:
+        self._connection().execute(
+            "INSERT OR REPLACE INTO tool_results (tool, key, value) VALUES (?, ?, ?)",
+            (tool, key, json.dumps(value)),
+        )
+
+    def _count(self, hit: bool) -> None:
+        with self._stats_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def wrap(
+        self, tool: str, function: Callable, encode=_identity, decode=_identity, cacheable=_always
+    ) -> Callable:
+        """function reading its results from the cache, errors and results not cacheable are not cached"""
+        signature = inspect.signature(function)
+
+        @functools.wraps(function)
+        def cached(*args, **kwargs):
+            # the agent passes keywords, other callers positions
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = self.key(bound.arguments)
+            value = self.get(tool, key)
+            self._count(value is not None)
+            if value is not None:
+                return decode(value)
+            if self.offline:
+                miss = ToolCacheMiss(f"{tool}({bound.arguments}) is not cached")
+                with self._stats_lock:
+                    if self.offline_miss is None:
+                        self.offline_miss = miss
+                raise miss
+            result = function(*args, **kwargs)
+            if cacheable(result):
+                self.put(tool, key, encode(result))
+            return result
+
+        return cached
+
+    def install(self) -> "ToolCache":
+        """Replace the tools of website_query with cached ones."""
+        for name, (encode, decode, cacheable) in _TOOLS.items():
+            if name in self._originals:
+                continue
+            original = getattr(website_query, name)
+            self._originals[name] = original
+            setattr(website_query, name, self.wrap(name, original, encode, decode, cacheable))
+        return self
+
+    def uninstall(self) -> None:
+        for name, original in self._originals.items():
+            setattr(website_query, name, original)
+        self._originals.clear()
+
+    def __enter__(self) -> "ToolCache":
+        return self.install()
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        self.uninstall()
+        # the agents swallowed the misses, an error raised in the block wins
+        if exc_type is None and self.offline_miss is not None:
+            raise ToolCacheMiss(
+                f"{self.misses} tool results were not cached, first: {self.offline_miss}"
+            ) from self.offline_miss
+
+    def stats(self) -> dict[str, int]:
+        with self._stats_lock:
+            return {"hits": self.hits, "misses": self.misses}
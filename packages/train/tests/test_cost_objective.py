@@ -0,0 +1,125 @@
+import unittest
+
+import dspy
+
+from train.cost_objective import (
+    CandidateCost,
+    CostWeights,
+    MeasuredWikipediaIndex,
+    cost_aware_feedback,
+    count_tokens,
+    count_tool_calls,
+    pareto_front,
+)
+
+
+def _candidate(index: int, recall: float, tool_calls: float) -> CandidateCost:
+    return CandidateCost(index=index, recall=recall, tool_calls=tool_calls, tokens=0.0, seconds=0.0)
+
+
+class ParetoFrontTests(unittest.TestCase):
+    def test_dominated_candidates_are_left_out(self):
+        costs = [
+            _candidate(0, recall=0.5, tool_calls=4),
+            _candidate(1, recall=0.8, tool_calls=2),
+            _candidate(2, recall=0.9, tool_calls=6),
+            _candidate(3, recall=0.4, tool_calls=1),
+        ]
+        front = pareto_front(costs, "tool_calls")
+        self.assertEqual([c.index for c in front], [3, 1, 2])
+
+    def test_ties(self):
+        costs = [
+            _candidate(0, recall=0.5, tool_calls=2),
+            _candidate(1, recall=0.7, tool_calls=2),
+            # same recall for more calls adds nothing
+            _candidate(2, recall=0.7, tool_calls=3),
+        ]
+        self.assertEqual([c.index for c in pareto_front(costs, "tool_calls")], [1])
+
+    def test_single_candidate(self):
+        costs = [_candidate(0, recall=0.0, tool_calls=5)]
+        self.assertEqual(pareto_front(costs, "tool_calls"), costs)
+        self.assertEqual(pareto_front([], "tool_calls"), [])
+
+
+class CostAwareFeedbackTests(unittest.TestCase):
+    gold = dspy.Example(query="q", pages=["Python", "Snake"]).with_inputs("query")
+
+    def _pred(self, **costs) -> dspy.Prediction:
+        websites = ["https://en.wikipedia.org/wiki/Python", "https://en.wikipedia.org/wiki/Java"]
+        return dspy.Prediction(websites=websites, **costs)
+
+    def test_zero_weights_give_the_recall(self):
+        metric = cost_aware_feedback(CostWeights())
+        result = metric(self.gold, self._pred(tool_calls=4, tokens=3000, seconds=12.0))
+        self.assertEqual(result.score, 0.5)
+        self.assertIn("called the tools 4 times, used 3000 tokens", result.feedback)
+        self.assertIn("lowering the score by 0.00", result.feedback)
+
+    def test_weighted_costs(self):
+        metric = cost_aware_feedback(CostWeights(per_tool_call=0.05, per_second=0.01, per_1k_tokens=0.02))
+        result = metric(self.gold, self._pred(tool_calls=4, tokens=3000, seconds=5.0))
+        # 0.2 + 0.05 + 0.06
+        self.assertAlmostEqual(result.score, 0.5 - 0.31)
+        self.assertIn("took 5.0 seconds, lowering the score by 0.31", result.feedback)
+        self.assertIn("you did not retrieve the following wikipedia pages: Snake", result.feedback)
+
+    def test_score_floored_at_zero(self):
+        metric = cost_aware_feedback(CostWeights(per_tool_call=1.0))
+        result = metric(self.gold, self._pred(tool_calls=3, tokens=0, seconds=0.0))
+        self.assertEqual(result.score, 0.0)
+
+    def test_prediction_without_costs(self):
+        metric = cost_aware_feedback(CostWeights(per_tool_call=1.0))
+        result = metric(self.gold, self._pred())
+        self.assertEqual(result.score, 0.5)
+        self.assertNotIn("called the tools", result.feedback)
+
+
+class CountingTests(unittest.TestCase):
+    trajectory = {
+        "thought_0": "search",
+        "tool_name_0": "_query_wikipedia_index",
+        "tool_args_0": {"query": "python"},
+        "observation_0": "...",
+        "tool_name_1": "_query_wikipedia_index",
+        "tool_args_1": {"query": "snake"},
+        "observation_1": "...",
+        "tool_name_2": "finish",
+        "tool_args_2": {},
+        "observation_2": "Completed.",
+    }
+
+    def test_count_tool_calls(self):
+        self.assertEqual(count_tool_calls(self.trajectory), 2)
+        self.assertEqual(count_tool_calls({}), 0)
+
+    def test_count_tokens(self):
+        usage = {
+            "lm/a": {"total_tokens": 150, "prompt_tokens": 100, "completion_tokens": 50},
+            # no total reported
+            "lm/b": {"prompt_tokens": 30, "completion_tokens": None},
+        }
+        self.assertEqual(count_tokens(usage), 180)
+        self.assertEqual(count_tokens({}), 0)
+
+    def test_measured_search(self):
+        trajectory = self.trajectory
+
+        def search_agent(query, n):
+            # what the LM calls of the agent add to the tracker
+            dspy.settings.usage_tracker.add_usage("lm/a", {"prompt_tokens": 200, "completion_tokens": 20})
+            dspy.settings.usage_tracker.add_usage("lm/a", {"prompt_tokens": 300, "completion_tokens": 30})
+            return dspy.Prediction(articles=["https://en.wikipedia.org/wiki/Python"], trajectory=trajectory)
+
+        index = MeasuredWikipediaIndex()
+        index.search_agent = search_agent
+        pred = index.forward("python")
+        self.assertEqual(pred.websites, ["https://en.wikipedia.org/wiki/Python"])
+        self.assertEqual((pred.tool_calls, pred.tokens), (2, 550))
+        self.assertGreaterEqual(pred.seconds, 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+import json
+import re
+import tempfile
+import unittest
+from pathlib import Path
+
+import dspy
+import matplotlib
+
+matplotlib.use("Agg")
+
+from dspy.teleprompt.gepa.gepa import DspyGEPAResult
+
+from train.cost_objective import CandidateCost
+from train.gepa_report import prompt_diff, write_gepa_report
+
+
+class PromptDiffTests(unittest.TestCase):
+    def test_added_and_removed_lines(self):
+        parent = ["search the index", "use short queries", "return 5 pages"]
+        lines = ["search the index", "use precise queries", "return 5 pages", "stop early"]
+        self.assertEqual(
+            prompt_diff(parent, lines),
+            [["=", 1], ["-", 1], ["+", ["use precise queries"]], ["=", 1], ["+", ["stop early"]]],
+        )
+
+    def test_removed_lines(self):
+        self.assertEqual(prompt_diff(["a", "b", "c"], ["a"]), [["=", 1], ["-", 2]])
+
+    def test_from_nothing(self):
+        self.assertEqual(prompt_diff([], ["a", "b"]), [["+", ["a", "b"]]])
+        self.assertEqual(prompt_diff(["a"], ["a"]), [["=", 1]])
+
+
+class Program(dspy.Module):
+    def __init__(self, search: str, answer: str):
+        super().__init__()
+        self.search = dspy.Predict(dspy.Signature("query -> pages", search))
+        self.answer = dspy.Predict(dspy.Signature("pages -> answer", answer))
+
+
+def _result(count: int) -> DspyGEPAResult:
+    candidates = [Program("search\nthe index", "answer")]
+    parents = [[None]]
+    for i in range(1, count):
+        candidates.append(Program(f"search\nthe index\nattempt {i}", "answer"))
+        parents.append([i - 1])
+    return DspyGEPAResult(
+        candidates=candidates,
+        parents=parents,
+        val_aggregate_scores=[i / count for i in range(count)],
+        val_subscores=[{} for _ in range(count)],
+        per_val_instance_best_candidates={},
+        discovery_eval_counts=[0] * count,
+        total_metric_calls=10 * count,
+    )
+
+
+class WriteGepaReportTests(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name) / "report"
+
+    def _report(self, html: str) -> dict:
+        return json.loads(re.search(r"const report = (.*);\n", html).group(1))
+
+    def test_files(self):
+        costs = [
+            CandidateCost(index=i, recall=0.2 * i, tool_calls=i, tokens=100.0 * i, seconds=float(i))
+            for i in range(3)
+        ]
+        index = write_gepa_report(_result(3), self.directory, costs)
+        self.assertEqual(index, self.directory / "index.html")
+        self.assertEqual(
+            sorted(str(path.relative_to(self.directory)) for path in self.directory.rglob("*")),
+            [
+                "index.html", "pareto.svg", "prompts",
+                "prompts/candidate_0.js", "prompts/candidate_1.js", "prompts/candidate_2.js",
+                "scores.svg",
+            ],
+        )
+        for chart in ("scores.svg", "pareto.svg"):
+            self.assertIn("<svg", (self.directory / chart).read_text())
+
+        html = index.read_text()
+        self.assertIn('src="pareto.svg"', html)
+        report = self._report(html)
+        self.assertEqual((report["best"], report["total_metric_calls"]), (2, 30))
+        candidate = report["candidates"][2]
+        self.assertEqual((candidate["parent"], candidate["changed"]), (1, ["search"]))
+        self.assertEqual(candidate["cost"]["tokens"], 200.0)
+        self.assertTrue(candidate["pareto"])
+
+        # only the changed lines are stored for a child
+        self.assertEqual(
+            (self.directory / "prompts" / "candidate_2.js").read_text(),
+            'gepaPromptsLoaded(2, {"search": [["=", 2], ["-", 1], ["+", ["attempt 2"]]], "answer": [["=", 1]]});\n',
+        )
+
+    def test_without_costs(self):
+        html = write_gepa_report(_result(2), self.directory).read_text()
+        self.assertFalse((self.directory / "pareto.svg").exists())
+        self.assertNotIn('src="pareto.svg"', html)
+        self.assertIsNone(self._report(html)["candidates"][1]["cost"])
+
+    def test_paginated_viewer(self):
+        html = write_gepa_report(_result(120), self.directory).read_text()
+        # the page holds one row per candidate, no prompt
+        self.assertEqual(len(self._report(html)["candidates"]), 120)
+        self.assertIn("const pageSize = 50;", html)
+        self.assertNotIn("attempt 119", html)
+        self.assertIn("attempt 119", (self.directory / "prompts" / "candidate_119.js").read_text())
+
+
+if __name__ == "__main__":
+    unittest.main()
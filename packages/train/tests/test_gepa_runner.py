@@ -0,0 +1,100 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+
+import dspy
+
+from train.gepa_runner import RunRecorder
+
+
+def _records(path: Path) -> list[dict]:
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def _valset_event(iteration: int, candidate: int) -> dict:
+    return {
+        "iteration": iteration,
+        "candidate_idx": candidate,
+        "parent_ids": [0] if candidate else [],
+        "average_score": 0.5,
+        "scores_by_val_id": {0: 0.5},
+        "is_best_program": False,
+        "outputs_by_val_id": {0: dspy.Prediction(tool_calls=2, tokens=100, seconds=1.5)},
+    }
+
+
+class RunRecorderTests(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.run_dir = Path(directory.name)
+        self.scores = self.run_dir / "scores.jsonl"
+        self.datasets = self.run_dir / "reflective_datasets.jsonl"
+
+    def _crashed_run(self):
+        """records of iterations 0 to 3, the last line cut by the crash"""
+        recorder = RunRecorder(self.run_dir, resumed=False)
+        for iteration in range(4):
+            recorder.on_valset_evaluated(_valset_event(iteration, iteration))
+            if iteration:
+                recorder.on_reflective_dataset_built(
+                    {"iteration": iteration, "candidate_idx": 0, "components": ["react"], "dataset": {}}
+                )
+        with open(self.scores, "a") as file:
+            file.write('{"iteration": 4, "candid')
+
+    def test_records(self):
+        recorder = RunRecorder(self.run_dir, resumed=False)
+        recorder.on_valset_evaluated(_valset_event(1, 1))
+        record = _records(self.scores)[0]
+        self.assertEqual((record["iteration"], record["candidate"], record["parents"]), (1, 1, [0]))
+        self.assertEqual(record["costs"], {"0": {"tool_calls": 2, "tokens": 100, "seconds": 1.5}})
+
+    def test_resume_truncates_to_the_restart(self):
+        self._crashed_run()
+        recorder = RunRecorder(self.run_dir, resumed=True)
+        # GEPA reports the seed again before the first iteration
+        recorder.on_valset_evaluated(_valset_event(0, 0))
+        recorder.on_iteration_start({"iteration": 3, "state": None})
+        self.assertEqual([r["iteration"] for r in _records(self.scores)], [0, 1, 2])
+        self.assertEqual([r["iteration"] for r in _records(self.datasets)], [1, 2])
+        # the records of the run again are appended once
+        recorder.on_valset_evaluated(_valset_event(3, 3))
+        recorder.on_iteration_start({"iteration": 4, "state": None})
+        self.assertEqual([r["iteration"] for r in _records(self.scores)], [0, 1, 2, 3])
+
+    def test_fresh_run_keeps_its_records(self):
+        self._crashed_run()
+        recorder = RunRecorder(self.run_dir, resumed=False)
+        recorder.on_iteration_start({"iteration": 1, "state": None})
+        self.assertEqual(len(self.scores.read_text().splitlines()), 5)
+
+    def test_resume_without_iterations(self):
+        self._crashed_run()
+        recorder = RunRecorder(self.run_dir, resumed=True)
+        # the state saved with i == 1 holds the iterations up to 2
+        recorder.on_optimization_end({"final_state": SimpleNamespace(i=1)})
+        self.assertEqual([r["iteration"] for r in _records(self.scores)], [0, 1, 2])
+        self.assertEqual([r["iteration"] for r in _records(self.datasets)], [1, 2])
+
+    def test_throughput_after_each_iteration(self):
+        recorder = RunRecorder(self.run_dir, resumed=True)
+        metric = recorder.count(lambda *args: 1.0)
+        throughput = self.run_dir / "throughput.json"
+        for iteration, total in ((1, 10), (2, 25)):
+            metric()
+            recorder.on_iteration_end(
+                {"iteration": iteration, "state": SimpleNamespace(total_num_evals=total), "proposal_accepted": True}
+            )
+            written = json.loads(throughput.read_text())
+            self.assertEqual(
+                (written["iteration"], written["total_metric_calls"], written["metric_calls"]),
+                (iteration, total, iteration),
+            )
+            self.assertTrue(written["resumed"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from anki_scroll.service import website_query
+from anki_scroll.service.website_query import WebsiteResult
+from train.tool_cache import ToolCache, ToolCacheMiss
+
+
+class FakeWikipedia:
+    """stands for the http tools, counts the requests"""
+
+    def __init__(self):
+        self.requests = []
+        self.missing = set()
+
+    def article(self, article: str, language: str = "en") -> str:
+        self.requests.append((article, language))
+        if article in self.missing:
+            return f"article not found: {article}"
+        return f"{language} text of {article}"
+
+    def index(self, terms: list[str], language: str = "en") -> list[WebsiteResult]:
+        self.requests.append((tuple(terms), language))
+        return [WebsiteResult(url=f"https://{language}.wikipedia.org/wiki/{terms[0]}", title=terms[0], excerpt="")]
+
+
+class ToolCacheTests(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name) / "tools.sqlite3"
+        self.wikipedia = FakeWikipedia()
+        for name, function in (
+            ("_wikipedia_article", self.wikipedia.article),
+            ("_query_wikipedia_index", self.wikipedia.index),
+        ):
+            patcher = mock.patch.object(website_query, name, function)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_positions_keywords_and_defaults_share_a_key(self):
+        with ToolCache(self.path):
+            first = website_query._wikipedia_article("Comet")
+            self.assertEqual(website_query._wikipedia_article(article="Comet"), first)
+            self.assertEqual(website_query._wikipedia_article("Comet", language="en"), first)
+            website_query._wikipedia_article("Comet", "fr")
+        self.assertEqual(self.wikipedia.requests, [("Comet", "en"), ("Comet", "fr")])
+
+    def test_results_shared_across_instances(self):
+        with ToolCache(self.path):
+            results = website_query._query_wikipedia_index(["comet"])
+        with ToolCache(self.path) as cache:
+            self.assertEqual(website_query._query_wikipedia_index(terms=["comet"]), results)
+        self.assertEqual(cache.stats(), {"hits": 1, "misses": 0})
+        self.assertEqual(len(self.wikipedia.requests), 1)
+
+    def test_not_found_is_not_cached(self):
+        self.wikipedia.missing.add("Comet")
+        with ToolCache(self.path):
+            self.assertEqual(website_query._wikipedia_article("Comet"), "article not found: Comet")
+            self.wikipedia.missing.clear()
+            self.assertEqual(website_query._wikipedia_article("Comet"), "en text of Comet")
+        self.assertEqual(len(self.wikipedia.requests), 2)
+
+    def test_offline(self):
+        with ToolCache(self.path):
+            website_query._wikipedia_article("Comet")
+        with ToolCache(self.path, offline=True) as cache:
+            self.assertEqual(website_query._wikipedia_article("Comet"), "en text of Comet")
+        self.assertIsNone(cache.offline_miss)
+
+        with self.assertRaises(ToolCacheMiss):
+            with ToolCache(self.path, offline=True):
+                try:
+                    website_query._wikipedia_article("Nebula")
+                except ToolCacheMiss:
+                    # like a ReAct agent turning the error into an observation
+                    pass
+        self.assertEqual(len(self.wikipedia.requests), 1)
+
+    def test_error_of_the_block_wins(self):
+        with self.assertRaises(KeyError):
+            with ToolCache(self.path, offline=True):
+                with self.assertRaises(ToolCacheMiss):
+                    website_query._wikipedia_article("Nebula")
+                raise KeyError("evaluation failed")
+
+    def test_install_and_uninstall(self):
+        cache = ToolCache(self.path)
+        cache.install()
+        installed = website_query._wikipedia_article
+        self.assertIsNot(installed, self.wikipedia.article)
+        # installing again keeps the first wrappers
+        cache.install()
+        self.assertIs(website_query._wikipedia_article, installed)
+        cache.uninstall()
+        self.assertEqual(website_query._wikipedia_article, self.wikipedia.article)
+        self.assertEqual(website_query._query_wikipedia_index, self.wikipedia.index)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,2 +1,10 @@
+# modules only needed once a card is generated or a duplicate checked, importing
+# the web application must not load them (tests/test_startup.py and
+# benchmarks/import_time.py check it)
+LAZY_MODULES = ("dspy", "numpy", "bs4", "mlflow", "requests", "litellm")
+
+
 def main() -> None:
-    print("Hello from anki-scroll!")
+    from anki_scroll.cli import run
+
+    raise SystemExit(run())
@@ -0,0 +1,120 @@
+"""
+Async adapter running a synchronous DeckService on dedicated threads,
+so that database latency never blocks the event loop.
+"""
+from __future__ import annotations
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, TypeVar
+
+from anki_scroll.services import (
+    AsyncDeck,
+    AsyncDeckService,
+    Card,
+    Deck,
+    DeckService,
+    DeckStats,
+)
+
+T = TypeVar("T")
+
+
+class ThreadedDeck(AsyncDeck):
+    """Async view over a deck of the wrapped service."""
+
+    def __init__(self, deck: Deck, service: ThreadedDeckService) -> None:
+        self._deck = deck
+        self._service = service
+
+    def name(self) -> str:
+        return self._deck.name()
+
+    def id(self) -> str:
+        return self._deck.id()
+
+    async def add(self, card: Card):
+        await self._service._write(self._deck.add, card)
+
+    async def remove(self, card: Card):
+        await self._service._write(self._deck.remove, card)
+
+    async def add_many(self, cards: list[Card]) -> int:
+        return await self._service._write(self._deck.add_many, cards)
+
+    async def remove_many(self, cards: list[Card]) -> int:
+        return await self._service._write(self._deck.remove_many, cards)
+
+    async def cards(self) -> list[Card]:
+        return await self._service._read(lambda: list(self._deck))
+
+    async def stats(self) -> DeckStats:
+        return await self._service._read(self._deck.stats)
+
+
+class ThreadedDeckService(AsyncDeckService):
+    """
+    Run the operations of a synchronous DeckService on a bounded thread pool.
+
+    Writes are serialized on a single writer thread, which matches the single
+    writer model of sqlite and avoids lock contention between our own threads.
+    Reads run on a separate pool of reader threads.
+    The wrapped service must support being called from several threads,
+    use reader_threads=0 to run every operation on the writer thread otherwise.
+    """
+
+    def __init__(self, service: DeckService, reader_threads: int = 4) -> None:
+        """
+        :param service: the synchronous service doing the work
+        :param reader_threads: size of the pool used for read operations
+        """
+        self._service = service
+        self._writer = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="anki-scroll-writer"
+        )
+        self._readers = self._writer
+        if reader_threads > 0:
+            self._readers = ThreadPoolExecutor(
+                max_workers=reader_threads, thread_name_prefix="anki-scroll-reader"
+            )
+
+    @property
+    def service(self) -> DeckService:
+        """the wrapped synchronous service"""
+        return self._service
+
+    async def decks(self) -> list[AsyncDeck]:
+        decks = await self._read(lambda: list(self._service.decks()))
+        return [ThreadedDeck(deck, self) for deck in decks]
+
+    async def get_deck(self, id: str) -> AsyncDeck | None:
+        deck = await self._read(self._service.get_deck, id)
+        if deck is None:
+            return None
+        return ThreadedDeck(deck, self)
+
+    async def add_deck(self, deck: Deck):
+        await self._write(self._service.add_deck, deck)
+
+    async def create_deck(self, name: str) -> AsyncDeck | None:
+        deck = await self._write(self._service.create_deck, name)
+        if deck is None:
+            return None
+        return ThreadedDeck(deck, self)
+
+    async def remove_deck(self, id: str):
+        await self._write(self._service.remove_deck, id)
+
+    def close(self) -> None:
+        """Stop the threads once the pending operations are done."""
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+
+    async def _read(self, fn: Callable[..., T], *args) -> T:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, partial(fn, *args))
+
+    async def _write(self, fn: Callable[..., T], *args) -> T:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer, partial(fn, *args))
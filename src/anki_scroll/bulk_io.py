@@ -0,0 +1,358 @@
+"""
+Streaming import and export of cards.
+
+Readers are generators and writers consume iterators, so files of any size
+are processed in constant memory. Supported formats:
+
+- csv: ``question,answer`` header followed by one card per row
+- jsonl: one ``{"question": ..., "answer": ...}`` object per line
+- apkg: Anki package, notes of the Basic model (front and back fields)
+"""
+from __future__ import annotations
+
+import csv
+import html
+import json
+import shutil
+import sqlite3
+import tempfile
+import time
+import zipfile
+from collections.abc import Iterable, Iterator
+from hashlib import sha1
+from itertools import batched
+from pathlib import Path
+from typing import Callable
+
+from anki_scroll.services import Card, Deck
+
+CHUNK_SIZE = 1000
+
+Progress = Callable[[int], None]
+
+
+def _card(question: object, answer: object, location: str) -> Card:
+    """
+    Card read from a file, Card does not validate its fields: rows missing a
+    field or holding other json values would only fail in the deck.
+    """
+    for field, value in (("question", question), ("answer", answer)):
+        if not isinstance(value, str):
+            raise ValueError(f"{location}: {field} must be a string, got {value!r}")
+    return Card(question=question, answer=answer)
+
+
+################################ csv
+
+
+def read_csv(path: Path) -> Iterator[Card]:
+    with open(path, newline="", encoding="utf-8") as file:
+        reader = csv.DictReader(file)
+        while True:
+            try:
+                row = next(reader)
+            except StopIteration:
+                return
+            except csv.Error as error:
+                raise ValueError(f"{path}: invalid csv after line {reader.line_num}: {error}") from None
+            yield _card(row.get("question"), row.get("answer"), f"{path}:{reader.line_num}")
+
+
+def write_csv(cards: Iterable[Card], path: Path) -> int:
+    written = 0
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(["question", "answer"])
+        for card in cards:
+            writer.writerow([card.question, card.answer])
+            written += 1
+    return written
+
+
+################################ jsonl
+
+
+def read_jsonl(path: Path) -> Iterator[Card]:
+    with open(path, encoding="utf-8") as file:
+        for number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            location = f"{path}:{number}"
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError as error:
+                raise ValueError(f"{location}: invalid json: {error}") from None
+            if not isinstance(item, dict):
+                raise ValueError(f"{location}: expected an object, got {item!r}")
+            yield _card(item.get("question"), item.get("answer"), location)
+
+
+def write_jsonl(cards: Iterable[Card], path: Path) -> int:
+    written = 0
+    with open(path, "w", encoding="utf-8") as file:
+        for card in cards:
+            file.write(json.dumps({"question": card.question, "answer": card.answer}))
+            file.write("\n")
+            written += 1
+    return written
+
+
+################################ anki package
+
+# anki separates the fields of a note with the unit separator
+_FIELD_SEPARATOR = "\x1f"
+
+_APKG_SCHEMA = """
+CREATE TABLE col (
+    id integer PRIMARY KEY, crt integer NOT NULL, mod integer NOT NULL,
+    scm integer NOT NULL, ver integer NOT NULL, dty integer NOT NULL,
+    usn integer NOT NULL, ls integer NOT NULL, conf text NOT NULL,
+    models text NOT NULL, decks text NOT NULL, dconf text NOT NULL, tags text NOT NULL
+);
+CREATE TABLE notes (
+    id integer PRIMARY KEY, guid text NOT NULL, mid integer NOT NULL,
+    mod integer NOT NULL, usn integer NOT NULL, tags text NOT NULL,
+    flds text NOT NULL, sfld integer NOT NULL, csum integer NOT NULL,
+    flags integer NOT NULL, data text NOT NULL
+);
+CREATE TABLE cards (
+    id integer PRIMARY KEY, nid integer NOT NULL, did integer NOT NULL,
+    ord integer NOT NULL, mod integer NOT NULL, usn integer NOT NULL,
+    type integer NOT NULL, queue integer NOT NULL, due integer NOT NULL,
+    ivl integer NOT NULL, factor integer NOT NULL, reps integer NOT NULL,
+    lapses integer NOT NULL, left integer NOT NULL, odue integer NOT NULL,
+    odid integer NOT NULL, flags integer NOT NULL, data text NOT NULL
+);
+CREATE TABLE revlog (
+    id integer PRIMARY KEY, cid integer NOT NULL, usn integer NOT NULL,
+    ivl integer NOT NULL, lastIvl integer NOT NULL, factor integer NOT NULL,
+    time integer NOT NULL, type integer NOT NULL
+);
+CREATE TABLE graves (usn integer NOT NULL, oid integer NOT NULL, type integer NOT NULL);
+CREATE INDEX ix_notes_usn ON notes (usn);
+CREATE INDEX ix_cards_usn ON cards (usn);
+CREATE INDEX ix_revlog_usn ON revlog (usn);
+CREATE INDEX ix_cards_nid ON cards (nid);
+CREATE INDEX ix_cards_sched ON cards (did, queue, due);
+CREATE INDEX ix_revlog_cid ON revlog (cid);
+CREATE INDEX ix_notes_csum ON notes (csum);
+"""
+
+
+def _apkg_collection(deck_name: str, model_id: int, deck_id: int, now: int) -> tuple:
+    """Row of the col table describing a Basic model and a single deck."""
+    model = {
+        "id": model_id,
+        "name": "Basic",
+        "type": 0,
+        "mod": now,
+        "usn": -1,
+        "sortf": 0,
+        "did": deck_id,
+        "tmpls": [
+            {
+                "name": "Card 1",
+                "ord": 0,
+                "qfmt": "{{Front}}",
+                "afmt": "{{FrontSide}}\n\n<hr id=answer>\n\n{{Back}}",
+                "bqfmt": "",
+                "bafmt": "",
+                "did": None,
+            }
+        ],
+        "flds": [
+            {"name": name, "ord": ord, "sticky": False, "rtl": False,
+             "font": "Arial", "size": 20, "media": []}
+            for ord, name in enumerate(["Front", "Back"])
+        ],
+        "css": ".card { font-family: arial; font-size: 20px; text-align: center; }",
+        "latexPre": "\\documentclass[12pt]{article}\n\\begin{document}\n",
+        "latexPost": "\\end{document}",
+        "req": [[0, "all", [0]]],
+        "tags": [],
+        "vers": [],
+    }
+
+    def deck(id: int, name: str) -> dict:
+        return {
+            "id": id, "name": name, "desc": "", "mod": now, "usn": -1,
+            "collapsed": False, "newToday": [0, 0], "revToday": [0, 0],
+            "lrnToday": [0, 0], "timeToday": [0, 0], "dyn": 0, "conf": 1,
+            "extendNew": 10, "extendRev": 50,
+        }
+
+    deck_conf = {
+        "id": 1, "name": "Default", "mod": 0, "usn": 0, "maxTaken": 60,
+        "autoplay": True, "timer": 0, "replayq": True, "dyn": False,
+        "new": {"delays": [1, 10], "ints": [1, 4, 7], "initialFactor": 2500,
+                "order": 1, "perDay": 20, "bury": True, "separate": True},
+        "rev": {"perDay": 200, "ease4": 1.3, "fuzz": 0.05, "ivlFct": 1,
+                "maxIvl": 36500, "bury": True, "minSpace": 1},
+        "lapse": {"delays": [10], "mult": 0, "minInt": 1, "leechFails": 8,
+                  "leechAction": 0},
+    }
+    conf = {"nextPos": 1, "estTimes": True, "activeDecks": [1], "sortType": "noteFld",
+            "timeLim": 0, "sortBackwards": False, "addToCur": True, "curDeck": 1,
+            "newSpread": 0, "dueCounts": True, "curModel": model_id, "collapseTime": 1200}
+    decks = {"1": deck(1, "Default"), str(deck_id): deck(deck_id, deck_name)}
+    return (
+        1, now, now * 1000, now * 1000, 11, 0, 0, 0,
+        json.dumps(conf), json.dumps({str(model_id): model}), json.dumps(decks),
+        json.dumps({"1": deck_conf}), "{}",
+    )
+
+
+def _checksum(text: str) -> int:
+    return int(sha1(text.encode("utf-8")).hexdigest()[:8], 16)
+
+
+def write_apkg(cards: Iterable[Card], path: Path, deck_name: str) -> int:
+    """
+    Write the cards as an Anki package containing a single deck.
+    The collection is built in a temporary sqlite file, then zipped.
+    """
+    now = int(time.time())
+    # anki uses millisecond timestamps as ids
+    model_id = now * 1000
+    deck_id = now * 1000 + 1
+    written = 0
+    with tempfile.TemporaryDirectory() as directory:
+        collection_path = Path(directory) / "collection.anki2"
+        conn = sqlite3.connect(collection_path)
+        try:
+            conn.executescript(_APKG_SCHEMA)
+            conn.execute(
+                "INSERT INTO col VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                _apkg_collection(deck_name, model_id, deck_id, now),
+            )
+            for chunk in batched(cards, CHUNK_SIZE):
+                notes = []
+                anki_cards = []
+                for card in chunk:
+                    note_id = deck_id + written + 1
+                    front = html.escape(card.question)
+                    back = html.escape(card.answer)
+                    guid = sha1(f"{deck_name}{note_id}".encode("utf-8")).hexdigest()[:10]
+                    notes.append((
+                        note_id, guid, model_id, now, -1, "",
+                        f"{front}{_FIELD_SEPARATOR}{back}", front,
+                        _checksum(card.question), 0, "",
+                    ))
+                    anki_cards.append((
+                        note_id, note_id, deck_id, 0, now, -1, 0, 0,
+                        written + 1, 0, 0, 0, 0, 0, 0, 0, 0, "",
+                    ))
+                    written += 1
+                conn.executemany(
+                    "INSERT INTO notes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", notes
+                )
+                conn.executemany(
+                    "INSERT INTO cards VALUES "
+                    "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    anki_cards,
+                )
+            conn.commit()
+        finally:
+            conn.close()
+        with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as package:
+            package.write(collection_path, "collection.anki2")
+            package.writestr("media", "{}")
+    return written
+
+
+def read_apkg(path: Path) -> Iterator[Card]:
+    """
+    Read the first two fields of every note of an Anki package.
+    Packages exported with the recent compressed format (collection.anki21b)
+    are not supported, they must be exported with the legacy option.
+    """
+    with zipfile.ZipFile(path) as package, tempfile.TemporaryDirectory() as directory:
+        names = set(package.namelist())
+        for name in ("collection.anki21", "collection.anki2"):
+            if name in names:
+                break
+        else:
+            raise ValueError(f"{path} does not contain a legacy anki collection")
+        collection_path = Path(directory) / name
+        with package.open(name) as source, open(collection_path, "wb") as target:
+            shutil.copyfileobj(source, target)
+        conn = sqlite3.connect(collection_path)
+        try:
+            cursor = conn.execute("SELECT id, flds FROM notes ORDER BY id")
+            while rows := cursor.fetchmany(CHUNK_SIZE):
+                for note_id, fields in rows:
+                    if not isinstance(fields, str):
+                        raise ValueError(f"{path}: note {note_id}: fields must be text, got {fields!r}")
+                    question, _, rest = fields.partition(_FIELD_SEPARATOR)
+                    answer = rest.split(_FIELD_SEPARATOR, 1)[0]
+                    yield Card(question=html.unescape(question), answer=html.unescape(answer))
+        finally:
+            conn.close()
+
+
+################################ import / export
+
+FORMATS = ("csv", "jsonl", "apkg")
+
+
+def detect_format(path: Path) -> str:
+    suffix = path.suffix.lower().lstrip(".")
+    if suffix not in FORMATS:
+        raise ValueError(f"cannot guess the format of {path}, expected one of {FORMATS}")
+    return suffix
+
+
+def read_cards(path: Path, format: str | None = None) -> Iterator[Card]:
+    format = format or detect_format(path)
+    if format == "csv":
+        return read_csv(path)
+    if format == "jsonl":
+        return read_jsonl(path)
+    if format == "apkg":
+        return read_apkg(path)
+    raise ValueError(f"unknown format: {format}")
+
+
+def write_cards(
+    cards: Iterable[Card], path: Path, deck_name: str, format: str | None = None
+) -> int:
+    format = format or detect_format(path)
+    if format == "csv":
+        return write_csv(cards, path)
+    if format == "jsonl":
+        return write_jsonl(cards, path)
+    if format == "apkg":
+        return write_apkg(cards, path, deck_name)
+    raise ValueError(f"unknown format: {format}")
+
+
+def _reporting(cards: Iterable[Card], progress: Progress | None) -> Iterator[Card]:
+    """Call progress with the number of cards seen every CHUNK_SIZE cards and at the end."""
+    count = 0
+    for card in cards:
+        yield card
+        count += 1
+        if progress is not None and count % CHUNK_SIZE == 0:
+            progress(count)
+    if progress is not None and count % CHUNK_SIZE != 0:
+        progress(count)
+
+
+def import_cards(
+    deck: Deck,
+    path: Path,
+    format: str | None = None,
+    progress: Progress | None = None,
+) -> int:
+    """Stream the cards of the file into the deck, return the number of cards imported."""
+    return deck.add_many(_reporting(read_cards(path, format), progress))
+
+
+def export_cards(
+    deck: Deck,
+    path: Path,
+    format: str | None = None,
+    progress: Progress | None = None,
+) -> int:
+    """Stream the cards of the deck into the file, return the number of cards exported."""
+    return write_cards(_reporting(deck, progress), path, deck.name(), format)
@@ -0,0 +1,283 @@
+"""
+Read-through cache that can be put in front of any DeckService.
+
+By default the storage is assumed to be shared with other processes: card
+lists are cached with the incarnation and version of their deck, and reads
+check them against the stats of the storage, one cheap query. Those checks
+are themselves cached for max_staleness seconds, the writes of the other
+processes are seen that late at most, the writes going through the wrapper
+at once. With max_staleness=0 every read queries the storage.
+With shared=False everything is cached and only invalidated by the writes
+going through the wrapper, which is only correct in a single process.
+"""
+from __future__ import annotations
+
+from collections import OrderedDict
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass, replace
+from threading import RLock
+import time
+from typing import Dict
+
+from anki_scroll.services import Card, Deck, DeckService, DeckStats
+
+
+@dataclass(slots=True)
+class CacheStats:
+    """Counters describing the efficiency of the cache."""
+
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+
+class CachingDeck(Deck):
+    """
+    Wrap a deck of the underlying service.
+    Reads are served from the cache of the service, writes invalidate it.
+    """
+
+    def __init__(self, deck: Deck, service: CachingDeckService) -> None:
+        self._deck = deck
+        self._id = deck.id()
+        self._service = service
+
+    def name(self) -> str:
+        return self._deck.name()
+
+    def id(self) -> str:
+        return self._id
+
+    def add(self, card: Card):
+        try:
+            self._deck.add(card)
+        finally:
+            self._service._invalidate(self._id)
+
+    def remove(self, card: Card):
+        try:
+            self._deck.remove(card)
+        finally:
+            self._service._invalidate(self._id)
+
+    def add_many(self, cards: Iterable[Card]) -> int:
+        try:
+            return self._deck.add_many(cards)
+        finally:
+            self._service._invalidate(self._id)
+
+    def remove_many(self, cards: Iterable[Card]) -> int:
+        try:
+            return self._deck.remove_many(cards)
+        finally:
+            self._service._invalidate(self._id)
+
+    def __iter__(self) -> Iterator[Card]:
+        return iter(self._service._cards(self._id, self._deck))
+
+    def stats(self) -> DeckStats:
+        return self._service._stats(self._id, self._deck)
+
+
+class CachingDeckService(DeckService):
+    """
+    Cache the card lists of another DeckService, and when it is not shared
+    the deck listing, lookups and stats.
+
+    Card lists are kept in a LRU bounded by the total number of cached cards,
+    decks bigger than the limit are never cached.
+    """
+
+    def __init__(
+        self,
+        service: DeckService,
+        max_cards: int = 100_000,
+        shared: bool = True,
+        max_staleness: float = 0.0,
+    ) -> None:
+        """
+        :param service: the service holding the data
+        :param max_cards: maximum number of cards kept in memory across all decks
+        :param shared: other processes write to the storage of service, validate the reads
+        :param max_staleness: seconds a validation of a shared storage is trusted
+        """
+        self._service = service
+        self._max_cards = max_cards
+        self._shared = shared
+        self._max_staleness = max_staleness
+        self._lock = RLock()
+        self._listing: list[str] | None = None
+        self._decks: Dict[str, CachingDeck] = {}
+        self._deck_stats: Dict[str, DeckStats] = {}
+        # monotonic time the storage was last asked, only used when shared
+        self._listing_checked = 0.0
+        self._deck_checked: Dict[str, float] = {}
+        self._stats_checked: Dict[str, float] = {}
+        # deck id -> (incarnation, version) of the deck when read, cards
+        self._cached_cards: OrderedDict[
+            str, tuple[tuple[int, int], tuple[Card, ...]]
+        ] = OrderedDict()
+        self._cached_size = 0
+        # bumped on every invalidation, a read started before an invalidation
+        # must not populate the cache with data that may be stale
+        self._generations: Dict[str, int] = {}
+        self._listing_generation = 0
+        self._cache_stats = CacheStats()
+
+    def cache_stats(self) -> CacheStats:
+        with self._lock:
+            return replace(self._cache_stats)
+
+    def _fresh(self, checked: float | None) -> bool:
+        """whether data read from the storage at checked can be served"""
+        if not self._shared:
+            return True
+        return checked is not None and time.monotonic() - checked < self._max_staleness
+
+    def decks(self) -> Iterator[Deck]:
+        with self._lock:
+            listing = self._listing
+            if listing is not None and self._fresh(self._listing_checked):
+                self._cache_stats.hits += 1
+                return iter([self._decks[deck_id] for deck_id in listing])
+            self._cache_stats.misses += 1
+            generation = self._listing_generation
+        checked = time.monotonic()
+        decks = [self._wrap(deck) for deck in self._service.decks()]
+        with self._lock:
+            if self._listing_generation == generation:
+                self._listing = [deck.id() for deck in decks]
+                self._listing_checked = checked
+            for deck in decks:
+                self._deck_checked[deck.id()] = checked
+        return iter(decks)
+
+    def get_deck(self, id: str) -> Deck | None:
+        with self._lock:
+            cached = self._decks.get(id)
+            if cached is not None and self._fresh(self._deck_checked.get(id)):
+                self._cache_stats.hits += 1
+                return cached
+            self._cache_stats.misses += 1
+        checked = time.monotonic()
+        deck = self._service.get_deck(id)
+        if deck is None:
+            if self._shared:
+                # removed by another process
+                self._forget(id)
+            return None
+        wrapped = self._wrap(deck)
+        with self._lock:
+            self._deck_checked[id] = checked
+        return wrapped
+
+    def add_deck(self, deck: Deck):
+        try:
+            self._service.add_deck(deck)
+        finally:
+            self._invalidate_listing()
+            self._invalidate(deck.id())
+
+    def create_deck(self, name: str) -> Deck | None:
+        """Create a deck unless it already exists."""
+        deck = self._service.create_deck(name)
+        self._invalidate_listing()
+        if deck is None:
+            return None
+        return self._wrap(deck)
+
+    def remove_deck(self, id: str):
+        try:
+            self._service.remove_deck(id)
+        finally:
+            self._invalidate_listing()
+            self._forget(id)
+
+    def _forget(self, deck_id: str) -> None:
+        with self._lock:
+            self._invalidate(deck_id)
+            self._invalidate_listing()
+            self._decks.pop(deck_id, None)
+            self._deck_checked.pop(deck_id, None)
+
+    def _wrap(self, deck: Deck) -> CachingDeck:
+        with self._lock:
+            cached = self._decks.get(deck.id())
+            if cached is None:
+                cached = CachingDeck(deck, self)
+                self._decks[cached.id()] = cached
+            return cached
+
+    def _cards(self, deck_id: str, deck: Deck) -> tuple[Card, ...]:
+        # read before the cards, a write in between only makes the entry look older
+        if self._shared:
+            stats = self._read_stats(deck_id, deck)
+            key = (stats.incarnation, stats.version)
+        else:
+            key = None
+        with self._lock:
+            cached = self._cached_cards.get(deck_id)
+            if cached is not None and (key is None or cached[0] == key):
+                self._cache_stats.hits += 1
+                self._cached_cards.move_to_end(deck_id)
+                return cached[1]
+            self._cache_stats.misses += 1
+            generation = self._generations.get(deck_id, 0)
+        cards = tuple(deck)
+        with self._lock:
+            if self._generations.get(deck_id, 0) == generation:
+                self._store_cards(deck_id, key, cards)
+        return cards
+
+    def _stats(self, deck_id: str, deck: Deck) -> DeckStats:
+        with self._lock:
+            stats = self._deck_stats.get(deck_id)
+            if stats is not None and self._fresh(self._stats_checked.get(deck_id)):
+                self._cache_stats.hits += 1
+                return stats
+            self._cache_stats.misses += 1
+        return self._read_stats(deck_id, deck)
+
+    def _read_stats(self, deck_id: str, deck: Deck) -> DeckStats:
+        """stats of the deck, cached or read, without counting a hit or a miss"""
+        with self._lock:
+            stats = self._deck_stats.get(deck_id)
+            if stats is not None and self._fresh(self._stats_checked.get(deck_id)):
+                return stats
+            generation = self._generations.get(deck_id, 0)
+        checked = time.monotonic()
+        stats = deck.stats()
+        with self._lock:
+            if self._generations.get(deck_id, 0) == generation:
+                self._deck_stats[deck_id] = stats
+                self._stats_checked[deck_id] = checked
+        return stats
+
+    def _store_cards(
+        self, deck_id: str, key: tuple[int, int] | None, cards: tuple[Card, ...]
+    ) -> None:
+        previous = self._cached_cards.pop(deck_id, None)
+        if previous is not None:
+            self._cached_size -= len(previous[1])
+        if len(cards) > self._max_cards:
+            return
+        self._cached_cards[deck_id] = (key, cards)
+        self._cached_size += len(cards)
+        while self._cached_size > self._max_cards:
+            _, (_, evicted) = self._cached_cards.popitem(last=False)
+            self._cached_size -= len(evicted)
+            self._cache_stats.evictions += 1
+
+    def _invalidate(self, deck_id: str) -> None:
+        with self._lock:
+            self._generations[deck_id] = self._generations.get(deck_id, 0) + 1
+            self._deck_stats.pop(deck_id, None)
+            self._stats_checked.pop(deck_id, None)
+            cached = self._cached_cards.pop(deck_id, None)
+            if cached is not None:
+                self._cached_size -= len(cached[1])
+
+    def _invalidate_listing(self) -> None:
+        with self._lock:
+            self._listing_generation += 1
+            self._listing = None
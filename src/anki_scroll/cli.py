@@ -0,0 +1,88 @@
+"""
+Command line interface of anki-scroll.
+
+anki-scroll import cards.csv --deck Biology
+anki-scroll export Biology biology.apkg
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+from pathlib import Path
+
+from anki_scroll.bulk_io import FORMATS, export_cards, import_cards
+from anki_scroll.services import DeckService, find_deck_by_name
+from anki_scroll.sql_service import SqlConfig, SqlDeckService
+
+
+def _progress(action: str):
+    def report(count: int) -> None:
+        print(f"\r{action} {count} cards", end="", file=sys.stderr, flush=True)
+
+    return report
+
+
+def _deck_service(args: argparse.Namespace) -> DeckService:
+    config = SqlConfig.load()
+    if args.db:
+        config.database = args.db
+    return SqlDeckService(config=config)
+
+
+def _import(args: argparse.Namespace) -> int:
+    deck_service = _deck_service(args)
+    deck = deck_service.create_deck(args.deck) or find_deck_by_name(deck_service, args.deck)
+    if deck is None:
+        print(f"cannot create deck {args.deck}", file=sys.stderr)
+        return 1
+    try:
+        count = import_cards(deck, args.file, args.format, _progress("imported"))
+    except ValueError as error:
+        # the chunks read before the invalid card are kept
+        print(f"\rimport stopped: {error}", file=sys.stderr)
+        return 1
+    except OSError as error:
+        print(f"\rcannot read {args.file}: {error}", file=sys.stderr)
+        return 1
+    print(f"\rimported {count} cards into {deck.name()}", file=sys.stderr)
+    return 0
+
+
+def _export(args: argparse.Namespace) -> int:
+    deck = find_deck_by_name(_deck_service(args), args.deck)
+    if deck is None:
+        print(f"deck not found: {args.deck}", file=sys.stderr)
+        return 1
+    try:
+        count = export_cards(deck, args.file, args.format, _progress("exported"))
+    except OSError as error:
+        print(f"\rcannot write {args.file}: {error}", file=sys.stderr)
+        return 1
+    print(f"\rexported {count} cards to {args.file}", file=sys.stderr)
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="anki-scroll")
+    parser.add_argument(
+        "--db", help="sqlite database, defaults to ANKI_SCROLL_DB_PATH"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = commands.add_parser("import", help="import cards from a file")
+    import_parser.add_argument("file", type=Path)
+    import_parser.add_argument("--deck", required=True, help="name of the target deck, created if needed")
+    import_parser.add_argument("--format", choices=FORMATS, help="guessed from the extension by default")
+    import_parser.set_defaults(handler=_import)
+
+    export_parser = commands.add_parser("export", help="export a deck to a file")
+    export_parser.add_argument("deck", help="name of the deck")
+    export_parser.add_argument("file", type=Path)
+    export_parser.add_argument("--format", choices=FORMATS, help="guessed from the extension by default")
+    export_parser.set_defaults(handler=_export)
+    return parser
+
+
+def run(argv: list[str] | None = None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.handler(args)
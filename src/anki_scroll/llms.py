@@ -1,10 +1,43 @@
-from dotenv import load_dotenv
-import dspy
-load_dotenv()
+"""
+Language models used by the services.
+
+The models are created on first access, `from anki_scroll.llms import grok_fast`
+works as before but importing this module neither imports dspy nor reads .env.
+Every call of these models is admitted by anki_scroll.lm_scheduler.
+"""
+from __future__ import annotations
+
+from functools import cache
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    import dspy
+
 
 def _open_router(model: str):
     return f"openrouter/{model}"
 
-grok_fast = dspy.LM(_open_router("x-ai/grok-4.1-fast"))
-grok_fast_no_cache = dspy.LM(_open_router("x-ai/grok-4.1-fast"), cache=False)
-oss_120 = dspy.LM(_open_router("openai/gpt-oss-120b"), temperature= 1.0)
\ No newline at end of file
+
+# name -> (model, extra arguments of dspy.LM)
+_MODELS: dict[str, tuple[str, dict[str, Any]]] = {
+    "grok_fast": ("x-ai/grok-4.1-fast", {}),
+    "grok_fast_no_cache": ("x-ai/grok-4.1-fast", {"cache": False}),
+    "oss_120": ("openai/gpt-oss-120b", {"temperature": 1.0}),
+}
+
+
+@cache
+def _model(name: str) -> dspy.LM:
+    from dotenv import load_dotenv
+
+    from anki_scroll.service.scheduled_lm import ScheduledLM
+
+    load_dotenv()
+    model, kwargs = _MODELS[name]
+    return ScheduledLM(_open_router(model), **kwargs)
+
+
+def __getattr__(name: str) -> dspy.LM:
+    if name not in _MODELS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    return _model(name)
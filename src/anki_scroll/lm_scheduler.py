@@ -0,0 +1,286 @@
+"""
+Process-wide scheduler of the calls to the language models.
+
+Every call of a model from anki_scroll.llms takes a slot here first, so
+interactive generation and background work (prefetch, warm-up, evaluation)
+share the provider rate limits instead of competing for them:
+
+- at most max_concurrency calls run at once, interactive_reserve of those
+  slots are never given to background calls,
+- waiting calls are admitted by priority then arrival, a user never waits
+  behind speculative work,
+- a token bucket refilled at tokens_per_minute bounds the token rate, the
+  estimate taken on admission is corrected once the call reports its usage,
+- a call is rejected with SchedulerOverloaded when too many calls of its
+  priority already wait, or when it waited longer than the timeout.
+
+The priority is the one of the calling context, INTERACTIVE unless the
+caller runs under `with lm_priority(Priority.BACKGROUND)`.
+"""
+from __future__ import annotations
+
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from enum import IntEnum
+from typing import Iterator, Self
+
+from dotenv import load_dotenv
+
+from anki_scroll.metrics import REGISTRY
+
+
+class Priority(IntEnum):
+    """Lower values are admitted first."""
+
+    INTERACTIVE = 0
+    BACKGROUND = 1
+
+
+class SchedulerOverloaded(RuntimeError):
+    """The call was rejected instead of queued, retry later."""
+
+
+_PRIORITY: ContextVar[Priority] = ContextVar("anki_scroll_lm_priority", default=Priority.INTERACTIVE)
+
+_QUEUED = REGISTRY.gauge(
+    "anki_scroll_lm_queued_calls",
+    "Language model calls waiting for a slot.",
+    ("priority",),
+)
+_RUNNING = REGISTRY.gauge(
+    "anki_scroll_lm_running_calls",
+    "Language model calls in flight.",
+    ("priority",),
+)
+_REJECTED = REGISTRY.counter(
+    "anki_scroll_lm_rejected_calls_total",
+    "Language model calls rejected because the scheduler was overloaded.",
+    ("priority",),
+)
+_WAIT_SECONDS = REGISTRY.histogram(
+    "anki_scroll_lm_wait_seconds",
+    "Time language model calls waited for a slot.",
+    ("priority",),
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0),
+)
+
+
+def current_priority() -> Priority:
+    return _PRIORITY.get()
+
+
+@contextmanager
+def lm_priority(priority: Priority) -> Iterator[None]:
+    """
+    Run the model calls of the block at this priority.
+    The priority is a context variable: code run with contextvars.copy_context()
+    or starlette's run_in_threadpool keeps it, a plain threading.Thread or a
+    ThreadPoolExecutor worker does not and runs at INTERACTIVE.
+    """
+    token = _PRIORITY.set(priority)
+    try:
+        yield
+    finally:
+        _PRIORITY.reset(token)
+
+
+@dataclass(slots=True)
+class SchedulerConfig:
+    """Limits shared by all the model calls of the process."""
+
+    # also caps the threads of an evaluation or optimization run in the
+    # process, raise it with their num_threads
+    max_concurrency: int = 4
+    # slots kept free for interactive calls, background calls never take them
+    interactive_reserve: int = 1
+    # None disables token rate limiting
+    tokens_per_minute: int | None = None
+    # calls of each priority allowed to wait, further calls are rejected
+    max_interactive_queue: int = 64
+    max_background_queue: int = 8
+    # seconds a call waits for a slot before being rejected
+    interactive_timeout: float = 120.0
+    background_timeout: float = 600.0
+
+    def __post_init__(self) -> None:
+        if self.max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        if not 0 <= self.interactive_reserve < self.max_concurrency:
+            raise ValueError("interactive_reserve must leave at least one slot to background calls")
+
+    @classmethod
+    def load(cls) -> Self:
+        """
+        Load configuration from the environment.
+        ANKI_SCROLL_LM_MAX_CONCURRENCY, ANKI_SCROLL_LM_INTERACTIVE_RESERVE and
+        ANKI_SCROLL_LM_TOKENS_PER_MINUTE override the corresponding fields.
+        """
+        load_dotenv()
+        config = cls()
+        max_concurrency = os.environ.get("ANKI_SCROLL_LM_MAX_CONCURRENCY")
+        if max_concurrency:
+            config.max_concurrency = int(max_concurrency)
+            config.interactive_reserve = min(config.interactive_reserve, config.max_concurrency - 1)
+        reserve = os.environ.get("ANKI_SCROLL_LM_INTERACTIVE_RESERVE")
+        if reserve:
+            config.interactive_reserve = int(reserve)
+        tokens_per_minute = os.environ.get("ANKI_SCROLL_LM_TOKENS_PER_MINUTE")
+        if tokens_per_minute:
+            config.tokens_per_minute = int(tokens_per_minute)
+        config.__post_init__()
+        return config
+
+    def max_queue(self, priority: Priority) -> int:
+        if priority is Priority.INTERACTIVE:
+            return self.max_interactive_queue
+        return self.max_background_queue
+
+    def timeout(self, priority: Priority) -> float:
+        if priority is Priority.INTERACTIVE:
+            return self.interactive_timeout
+        return self.background_timeout
+
+
+@dataclass(slots=True)
+class Slot:
+    """An admitted call, set `used` to the tokens it really consumed."""
+
+    priority: Priority
+    tokens: int
+    used: int | None = None
+
+
+class LMScheduler:
+    """
+    Admission control of the model calls, see the module documentation.
+    Calls block the calling thread while they wait, models run in worker threads.
+    """
+
+    def __init__(self, config: SchedulerConfig | None = None) -> None:
+        self._config = config or SchedulerConfig()
+        self._condition = threading.Condition()
+        # (priority, arrival) of the waiting calls
+        self._waiting: list[tuple[int, int]] = []
+        self._arrivals = itertools.count()
+        self._queued = {priority: 0 for priority in Priority}
+        self._running = {priority: 0 for priority in Priority}
+        rate = self._config.tokens_per_minute
+        self._capacity = float(rate) if rate else 0.0
+        self._tokens = self._capacity
+        self._refilled_at = time.monotonic()
+
+    @property
+    def config(self) -> SchedulerConfig:
+        return self._config
+
+    @contextmanager
+    def slot(self, tokens: int = 0, priority: Priority | None = None) -> Iterator[Slot]:
+        """Hold a slot for the duration of the block."""
+        slot = self.acquire(tokens, priority)
+        try:
+            yield slot
+        finally:
+            self.release(slot)
+
+    def acquire(self, tokens: int = 0, priority: Priority | None = None) -> Slot:
+        """
+        Wait for a slot, the priority defaults to the one of the context.
+        :param tokens: estimate of the tokens of the call
+        :raises SchedulerOverloaded: the queue of the priority is full or the wait timed out
+        """
+        priority = current_priority() if priority is None else priority
+        label = priority.name.lower()
+        start = time.monotonic()
+        deadline = start + self._config.timeout(priority)
+        entry = (int(priority), next(self._arrivals))
+        with self._condition:
+            heapq.heappush(self._waiting, entry)
+            try:
+                delay = self._admission_delay(entry, priority, tokens)
+                if delay and self._queued[priority] >= self._config.max_queue(priority):
+                    raise SchedulerOverloaded(f"too many {label} model calls waiting")
+                self._queued[priority] += 1
+                _QUEUED.labels(label).inc()
+                try:
+                    while delay:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise SchedulerOverloaded(f"{label} model call waited more than the timeout")
+                        self._condition.wait(min(delay, remaining))
+                        delay = self._admission_delay(entry, priority, tokens)
+                finally:
+                    self._queued[priority] -= 1
+                    _QUEUED.labels(label).dec()
+            except SchedulerOverloaded:
+                _REJECTED.labels(label).inc()
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                # the next call may be admissible now
+                self._condition.notify_all()
+                raise
+            heapq.heappop(self._waiting)
+            self._running[priority] += 1
+            if self._capacity:
+                self._tokens -= tokens
+            # a call of lower priority may be admissible as well
+            self._condition.notify_all()
+        _RUNNING.labels(label).inc()
+        _WAIT_SECONDS.labels(label).observe(time.monotonic() - start)
+        return Slot(priority=priority, tokens=tokens)
+
+    def release(self, slot: Slot) -> None:
+        with self._condition:
+            self._running[slot.priority] -= 1
+            if self._capacity and slot.used is not None:
+                self._tokens -= slot.used - slot.tokens
+            self._condition.notify_all()
+        _RUNNING.labels(slot.priority.name.lower()).dec()
+
+    def _admission_delay(self, entry: tuple[int, int], priority: Priority, tokens: int) -> float:
+        """0 when the call can run now, otherwise how long to wait before checking again."""
+        if self._waiting[0] != entry:
+            return float("inf")
+        running = sum(self._running.values())
+        limit = self._config.max_concurrency
+        if priority is not Priority.INTERACTIVE:
+            limit -= self._config.interactive_reserve
+        if running >= limit:
+            return float("inf")
+        if not self._capacity:
+            return 0.0
+        now = time.monotonic()
+        rate = self._capacity / 60
+        self._tokens = min(self._capacity, self._tokens + (now - self._refilled_at) * rate)
+        self._refilled_at = now
+        # a call larger than the bucket runs once the bucket is full
+        needed = min(tokens, self._capacity)
+        if self._tokens >= needed:
+            return 0.0
+        return (needed - self._tokens) / rate
+
+
+_scheduler: LMScheduler | None = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> LMScheduler:
+    """The scheduler of the process, configured from the environment on first use."""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = LMScheduler(SchedulerConfig.load())
+    return _scheduler
+
+
+def set_scheduler(scheduler: LMScheduler) -> None:
+    """Replace the scheduler of the process, calls already admitted are not affected."""
+    global _scheduler
+    with _scheduler_lock:
+        _scheduler = scheduler
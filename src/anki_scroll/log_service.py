@@ -0,0 +1,680 @@
+"""
+A deck service storing every modification in an append-only log file.
+
+Suited to single process deployments that mostly append cards and scan decks:
+appends are a single buffered write, scans read the cards from a memory map of
+the log. Deletions append tombstones, the space is reclaimed by compaction which
+rewrites the live records into a new log. Only the offsets of the live cards are
+kept in memory, close saves them next to the log and the next open loads them.
+After a crash the index is rebuilt by scanning the whole log.
+
+Compared with SqlDeckService (benchmarks/log_vs_sqlite.py, 200k cards), appends
+are about 10x faster. Scans are only about 1.5x faster, building the Card
+objects dominates both. Reopening takes 1.5x as long as sqlite after a clean
+close, 8x as long after a crash.
+"""
+from __future__ import annotations
+
+import mmap
+import os
+import random
+import struct
+import sys
+import threading
+import time
+from array import array
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass
+from hashlib import sha256
+from itertools import batched
+from pathlib import Path
+from typing import Dict, Self
+
+from dotenv import load_dotenv
+
+from anki_scroll.services import Card, Deck, DeckService, DeckStats
+
+try:
+    import fcntl
+except ImportError:  # windows
+    fcntl = None
+
+_MAGIC = b"ASL1"
+
+# record types
+_OP_DECK = 1
+_OP_DROP_DECK = 2
+_OP_CARD = 3
+_OP_TOMBSTONE = 4
+_OP_STATS = 5
+
+# every record starts with its type and the size of its payload
+_RECORD_HEADER = struct.Struct("<BI")
+_U32 = struct.Struct("<I")
+_U64 = struct.Struct("<Q")
+# timestamp and deck number, prefix of every payload
+_PREFIX = struct.Struct("<dI")
+_TOMBSTONE = struct.Struct("<dIQ")
+_STATS = struct.Struct("<dIQ")
+# header, prefix and question size of a card record
+_CARD_LAYOUT = struct.Struct("<BIdII")
+
+# index saved by close, lets the next open skip the replay of an unchanged log
+_INDEX_MAGIC = b"ASI1"
+# size, inode and modification time of the log, next deck number, records and decks
+_INDEX_HEADER = struct.Struct("<QQqIQI")
+# number, incarnation, version, modification time, meta records and cards of a deck
+_INDEX_DECK = struct.Struct("<IQQdIQ")
+
+CHUNK_SIZE = 1000
+
+
+@dataclass(slots=True)
+class LogConfig:
+    """
+    Parameters of the log storage.
+    """
+
+    path: str
+    # compact once the dead records are more than this fraction of the log
+    compaction_ratio: float = 0.5
+    # never compact logs with less dead records than that
+    min_dead_records: int = 1000
+    # run compaction on a background thread when the ratio is reached
+    background_compaction: bool = True
+    # fsync after each write, otherwise data is only flushed to the os
+    fsync: bool = False
+
+    @classmethod
+    def load(cls) -> Self:
+        """
+        Load configuration from the environment.
+        ANKI_SCROLL_LOG_PATH is the path of the log file,
+        defaults to ``anki_scroll.log`` in the current working directory.
+        """
+        load_dotenv()
+        path = os.environ.get("ANKI_SCROLL_LOG_PATH")
+        if not path:
+            path = str(Path.cwd() / "anki_scroll.log")
+        return cls(path=path)
+
+
+def _pack_str(value: str) -> bytes:
+    encoded = value.encode("utf-8")
+    return _U32.pack(len(encoded)) + encoded
+
+
+def _card_content(card: Card) -> bytes:
+    return _pack_str(card.question) + _pack_str(card.answer)
+
+
+def _record(op: int, payload: bytes) -> bytes:
+    return _RECORD_HEADER.pack(op, len(payload)) + payload
+
+
+def _read_str(buffer, position: int) -> tuple[str, int]:
+    (size,) = _U32.unpack_from(buffer, position)
+    start = position + _U32.size
+    return str(buffer[start:start + size], "utf-8"), start + size
+
+
+class _DeckIndex:
+    """In-memory state of a deck, rebuilt from the log."""
+
+    __slots__ = (
+        "number", "id", "name", "incarnation", "offsets", "content", "version",
+        "modified_at", "meta_records",
+    )
+
+    def __init__(
+        self, number: int, id: str, name: str, incarnation: int, modified_at: float
+    ) -> None:
+        self.number = number
+        self.id = id
+        self.name = name
+        self.incarnation = incarnation
+        # offsets of the live card records, in insertion order
+        self.offsets: Dict[int, None] = {}
+        # hash of the encoded content -> offsets, used to find the card to remove,
+        # built by the first removal so that replay only records the offsets
+        self.content: Dict[int, list[int]] | None = None
+        self.version = 0
+        self.modified_at = modified_at
+        # deck and stats records, live as long as the deck
+        self.meta_records = 1
+
+    def insert(self, offset: int, content: bytes) -> None:
+        self.offsets[offset] = None
+        if self.content is not None:
+            self.content.setdefault(hash(content), []).append(offset)
+
+    def discard(self, offset: int, content_hash: int) -> None:
+        del self.offsets[offset]
+        offsets = self.content[content_hash]
+        offsets.remove(offset)
+        if not offsets:
+            del self.content[content_hash]
+
+    def live_records(self) -> int:
+        return len(self.offsets) + self.meta_records
+
+
+class LogDeck(Deck):
+    """
+    A deck stored in the log of a LogDeckService.
+    When trying to perform an operation, if the deck was removed; raise an error.
+    """
+
+    def __init__(self, deck_id: str, name: str, service: LogDeckService) -> None:
+        self._id = deck_id
+        self._name = name
+        self._service = service
+
+    def name(self) -> str:
+        return self._name
+
+    def id(self) -> str:
+        return self._id
+
+    def add(self, card: Card):
+        self._service._append_cards(self._id, [card])
+
+    def add_many(self, cards: Iterable[Card]) -> int:
+        added = 0
+        for chunk in batched(cards, CHUNK_SIZE):
+            self._service._append_cards(self._id, chunk)
+            added += len(chunk)
+        return added
+
+    def remove(self, card: Card):
+        self._service._remove_card(self._id, card)
+
+    def __iter__(self) -> Iterator[Card]:
+        return self._service._iter_cards(self._id)
+
+    def stats(self) -> DeckStats:
+        return self._service._stats(self._id)
+
+
+class LogDeckService(DeckService):
+    """
+    A deck service backed by an append-only log file.
+    The log can only be opened by one process at a time.
+    """
+
+    def __init__(self, config: LogConfig | None = None) -> None:
+        self._config = config or LogConfig.load()
+        self._path = Path(self._config.path)
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.RLock()
+        # serializes the compactions, which only take self._lock to catch up and swap
+        self._compaction_lock = threading.Lock()
+        self._decks: Dict[str, _DeckIndex] = {}
+        self._numbers: Dict[int, _DeckIndex] = {}
+        self._next_number = 0
+        # records in the log, the dead ones are those not counted by a deck index
+        self._records = 0
+        self._compacting = False
+        self._open()
+
+    ################################ DeckService
+
+    def decks(self) -> Iterator[Deck]:
+        with self._lock:
+            indexes = sorted(self._decks.values(), key=lambda index: index.name)
+            decks = [LogDeck(index.id, index.name, self) for index in indexes]
+        return iter(decks)
+
+    def get_deck(self, id: str) -> Deck | None:
+        with self._lock:
+            index = self._decks.get(id)
+            if index is None:
+                return None
+            return LogDeck(index.id, index.name, self)
+
+    def add_deck(self, deck: Deck):
+        with self._lock:
+            if deck.id() in self._decks:
+                return
+            self._create(deck.id(), deck.name())
+        LogDeck(deck.id(), deck.name(), self).add_many(deck)
+
+    def create_deck(self, name: str) -> Deck | None:
+        """Create a deck unless it already exists."""
+        deck_name = name.strip()
+        digest = sha256(deck_name.encode("utf-8")).hexdigest()
+        with self._lock:
+            if digest in self._decks:
+                return None
+            self._create(digest, deck_name)
+        return LogDeck(digest, deck_name, self)
+
+    def remove_deck(self, id: str):
+        with self._lock:
+            index = self._decks.get(id)
+            if index is None:
+                return
+            payload = _PREFIX.pack(time.time(), index.number)
+            self._append([_record(_OP_DROP_DECK, payload)])
+            self._drop(index)
+        self._maybe_compact()
+
+    ################################ maintenance
+
+    def close(self) -> None:
+        with self._lock:
+            self._save_index()
+            self._map.close()
+            self._file.close()
+
+    def compact(self) -> None:
+        """
+        Rewrite the live records in a new log and atomically replace the old one.
+        The live records are copied without the lock, the records appended
+        meanwhile are copied with the lock held, just before the swap.
+        Iterators created before the compaction keep reading the old log.
+        """
+        with self._compaction_lock:
+            with self._lock:
+                buffer = self._current_map()
+                copied = self._file.tell()
+                decks = [
+                    (index.number, index.id, index.name, index.incarnation,
+                     index.modified_at, index.version, list(index.offsets))
+                    for index in self._decks.values()
+                ]
+            compacted = self._path.with_name(self._path.name + ".compact")
+            relocated: Dict[int, int] = {}
+            with open(compacted, "wb") as target:
+                target.write(_MAGIC)
+                position = len(_MAGIC)
+                records = 0
+                for number, deck_id, name, incarnation, modified_at, version, offsets in decks:
+                    deck_record = _record(
+                        _OP_DECK,
+                        _PREFIX.pack(modified_at, number)
+                        + _pack_str(deck_id)
+                        + _pack_str(name)
+                        + _U64.pack(incarnation),
+                    )
+                    target.write(deck_record)
+                    position += len(deck_record)
+                    for offset in offsets:
+                        _, size = _RECORD_HEADER.unpack_from(buffer, offset)
+                        end = offset + _RECORD_HEADER.size + size
+                        target.write(buffer[offset:end])
+                        relocated[offset] = position
+                        position += end - offset
+                    stats_record = _record(_OP_STATS, _STATS.pack(modified_at, number, version))
+                    target.write(stats_record)
+                    position += len(stats_record)
+                    records += len(offsets) + 2
+                target.flush()
+                os.fsync(target.fileno())
+                with self._lock:
+                    records += self._copy_tail(target, position, copied, relocated)
+                    target.flush()
+                    os.fsync(target.fileno())
+                    self._swap(compacted, relocated, records, {deck[0] for deck in decks})
+
+    def _copy_tail(self, target, target_position: int, start: int, relocated: Dict[int, int]) -> int:
+        """
+        Copy the records appended to the log since start at target_position of
+        target, tombstones point to the new offsets of their cards.
+        Return the number of records copied. Requires the lock.
+        """
+        buffer = self._current_map()
+        end = self._file.tell()
+        position = start
+        copied = 0
+        while position < end:
+            op, size = _RECORD_HEADER.unpack_from(buffer, position)
+            record_end = position + _RECORD_HEADER.size + size
+            if op == _OP_TOMBSTONE:
+                timestamp, number, offset = _TOMBSTONE.unpack_from(buffer, position + _RECORD_HEADER.size)
+                record = _record(_OP_TOMBSTONE, _TOMBSTONE.pack(timestamp, number, relocated[offset]))
+            else:
+                if op == _OP_CARD:
+                    relocated[position] = target_position
+                record = buffer[position:record_end]
+            target.write(record)
+            target_position += len(record)
+            copied += 1
+            position = record_end
+        return copied
+
+    def _swap(
+        self, compacted: Path, relocated: Dict[int, int], records: int, copied_decks: set[int]
+    ) -> None:
+        """Replace the log by the compacted one and relocate the indexes. Requires the lock."""
+        self._file.close()
+        os.replace(compacted, self._path)
+        for index in self._decks.values():
+            index.offsets = {relocated[offset]: None for offset in index.offsets}
+            # rebuilt by the next removal
+            index.content = None
+            # decks copied from the old log have their deck and stats records
+            index.meta_records = 2 if index.number in copied_decks else 1
+        # the old map stays alive as long as iterators are using it
+        self._file = open(self._path, "ab")
+        self._lock_file()
+        self._map = self._new_map()
+        self._records = records
+
+    ################################ log
+
+    def _open(self) -> None:
+        if not self._path.exists() or self._path.stat().st_size == 0:
+            with open(self._path, "wb") as file:
+                file.write(_MAGIC)
+        self._file = open(self._path, "ab")
+        self._lock_file()
+        self._map = self._new_map()
+        if self._map[:len(_MAGIC)] != _MAGIC:
+            raise ValueError(f"{self._path} is not an anki-scroll log")
+        if self._load_index():
+            return
+        end = self._replay()
+        if end < len(self._map):
+            # the last record was not completely written, drop it
+            self._map.close()
+            self._file.truncate(end)
+            self._file.seek(0, os.SEEK_END)
+            self._map = self._new_map()
+
+    def _index_path(self) -> Path:
+        return self._path.with_name(self._path.name + ".index")
+
+    def _save_index(self) -> None:
+        """Save the decks and the offsets of their cards. Requires the lock."""
+        stat = os.fstat(self._file.fileno())
+        parts = [
+            _INDEX_MAGIC,
+            _INDEX_HEADER.pack(
+                stat.st_size, stat.st_ino, stat.st_mtime_ns,
+                self._next_number, self._records, len(self._decks),
+            ),
+        ]
+        for index in self._decks.values():
+            offsets = array("Q", index.offsets)
+            if sys.byteorder == "big":
+                offsets.byteswap()
+            parts += [
+                _INDEX_DECK.pack(
+                    index.number, index.incarnation, index.version,
+                    index.modified_at, index.meta_records, len(offsets),
+                ),
+                _pack_str(index.id),
+                _pack_str(index.name),
+                offsets.tobytes(),
+            ]
+        path = self._index_path()
+        temporary = path.with_name(path.name + ".tmp")
+        temporary.write_bytes(b"".join(parts))
+        os.replace(temporary, path)
+
+    def _load_index(self) -> bool:
+        """
+        Load the index saved when the log was closed, if the log was not modified since.
+        The saved index is removed: it is stale as soon as the log is written.
+        """
+        path = self._index_path()
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return False
+        path.unlink()
+        stat = os.fstat(self._file.fileno())
+        try:
+            if data[:len(_INDEX_MAGIC)] != _INDEX_MAGIC:
+                return False
+            size, inode, mtime, next_number, records, decks = _INDEX_HEADER.unpack_from(
+                data, len(_INDEX_MAGIC)
+            )
+            if (size, inode, mtime) != (stat.st_size, stat.st_ino, stat.st_mtime_ns):
+                return False
+            position = len(_INDEX_MAGIC) + _INDEX_HEADER.size
+            for _ in range(decks):
+                number, incarnation, version, modified_at, meta_records, count = (
+                    _INDEX_DECK.unpack_from(data, position)
+                )
+                deck_id, position = _read_str(data, position + _INDEX_DECK.size)
+                name, position = _read_str(data, position)
+                offsets = array("Q", data[position:position + count * _U64.size])
+                if len(offsets) != count:
+                    raise ValueError("truncated index")
+                if sys.byteorder == "big":
+                    offsets.byteswap()
+                position += count * _U64.size
+                index = _DeckIndex(number, deck_id, name, incarnation, modified_at)
+                index.offsets = dict.fromkeys(offsets)
+                index.version = version
+                index.meta_records = meta_records
+                self._decks[deck_id] = index
+                self._numbers[number] = index
+        except (struct.error, UnicodeDecodeError, ValueError):
+            # damaged index, rebuild from the log
+            self._decks.clear()
+            self._numbers.clear()
+            return False
+        self._next_number = next_number
+        self._records = records
+        return True
+
+    def _lock_file(self) -> None:
+        if fcntl is None:
+            return
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._file.close()
+            raise RuntimeError(f"{self._path} is already used by another process")
+
+    def _new_map(self) -> mmap.mmap:
+        with open(self._path, "rb") as file:
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _replay(self) -> int:
+        """Rebuild the index from the log, return the end of the last complete record."""
+        buffer = self._map
+        position = len(_MAGIC)
+        size = len(buffer)
+        header_size = _RECORD_HEADER.size
+        while position + header_size <= size:
+            op, payload_size = _RECORD_HEADER.unpack_from(buffer, position)
+            start = position + header_size
+            end = start + payload_size
+            if end > size:
+                break
+            self._records += 1
+            if op == _OP_CARD:
+                timestamp, number = _PREFIX.unpack_from(buffer, start)
+                index = self._numbers.get(number)
+                if index is not None:
+                    # the content index is not built yet, only record the offset
+                    index.offsets[position] = None
+                    index.version += 1
+                    index.modified_at = timestamp
+            elif op == _OP_TOMBSTONE:
+                timestamp, number, offset = _TOMBSTONE.unpack_from(buffer, start)
+                index = self._numbers.get(number)
+                if index is not None:
+                    index.offsets.pop(offset, None)
+                    index.version += 1
+                    index.modified_at = timestamp
+            elif op == _OP_DECK:
+                timestamp, number = _PREFIX.unpack_from(buffer, start)
+                deck_id, name_position = _read_str(buffer, start + _PREFIX.size)
+                name, name_end = _read_str(buffer, name_position)
+                # logs written before incarnations only have the deck number
+                if name_end + _U64.size <= end:
+                    (incarnation,) = _U64.unpack_from(buffer, name_end)
+                else:
+                    incarnation = number
+                index = _DeckIndex(number, deck_id, name, incarnation, timestamp)
+                self._decks[deck_id] = index
+                self._numbers[number] = index
+                self._next_number = max(self._next_number, number + 1)
+            elif op == _OP_DROP_DECK:
+                _, number = _PREFIX.unpack_from(buffer, start)
+                index = self._numbers.get(number)
+                if index is not None:
+                    self._drop(index)
+            elif op == _OP_STATS:
+                timestamp, number, version = _STATS.unpack_from(buffer, start)
+                index = self._numbers.get(number)
+                if index is not None:
+                    index.version = version
+                    index.modified_at = timestamp
+                    index.meta_records += 1
+            else:
+                raise ValueError(f"unknown record type {op} at offset {position}")
+            position = end
+        return position
+
+    def _append(self, records: list[bytes]) -> int:
+        """Append the records, return the offset of the first one. Requires the lock."""
+        offset = self._file.tell()
+        self._file.write(b"".join(records))
+        self._file.flush()
+        if self._config.fsync:
+            os.fsync(self._file.fileno())
+        self._records += len(records)
+        return offset
+
+    def _current_map(self) -> mmap.mmap:
+        """Map covering every record appended so far. Requires the lock."""
+        if len(self._map) < self._file.tell():
+            self._map = self._new_map()
+        return self._map
+
+    def _content_index(self, index: _DeckIndex, buffer: mmap.mmap) -> Dict[int, list[int]]:
+        """Content index of the deck, built on first use. Requires the lock."""
+        if index.content is None:
+            content: Dict[int, list[int]] = {}
+            content_start = _RECORD_HEADER.size + _PREFIX.size
+            for offset in index.offsets:
+                _, size = _RECORD_HEADER.unpack_from(buffer, offset)
+                start = offset + content_start
+                content.setdefault(hash(buffer[start:offset + _RECORD_HEADER.size + size]), []).append(offset)
+            index.content = content
+        return index.content
+
+    ################################ decks
+
+    def _index(self, deck_id: str) -> _DeckIndex:
+        index = self._decks.get(deck_id)
+        if index is None:
+            raise LookupError(f"Deck '{deck_id}' does not exist in the log.")
+        return index
+
+    def _create(self, deck_id: str, name: str) -> None:
+        number = self._next_number
+        self._next_number += 1
+        timestamp = time.time()
+        incarnation = random.getrandbits(63)
+        payload = (
+            _PREFIX.pack(timestamp, number)
+            + _pack_str(deck_id)
+            + _pack_str(name)
+            + _U64.pack(incarnation)
+        )
+        self._append([_record(_OP_DECK, payload)])
+        index = _DeckIndex(number, deck_id, name, incarnation, timestamp)
+        self._decks[deck_id] = index
+        self._numbers[number] = index
+
+    def _drop(self, index: _DeckIndex) -> None:
+        del self._decks[index.id]
+        del self._numbers[index.number]
+
+    def _append_cards(self, deck_id: str, cards: Iterable[Card]) -> None:
+        with self._lock:
+            index = self._index(deck_id)
+            timestamp = time.time()
+            prefix = _PREFIX.pack(timestamp, index.number)
+            contents = [_card_content(card) for card in cards]
+            records = [_record(_OP_CARD, prefix + content) for content in contents]
+            offset = self._append(records)
+            for content, record in zip(contents, records):
+                index.insert(offset, content)
+                offset += len(record)
+            index.version += len(records)
+            index.modified_at = timestamp
+
+    def _remove_card(self, deck_id: str, card: Card) -> None:
+        with self._lock:
+            index = self._index(deck_id)
+            content = _card_content(card)
+            content_hash = hash(content)
+            buffer = self._current_map()
+            for offset in self._content_index(index, buffer).get(content_hash, ()):
+                start = offset + _RECORD_HEADER.size + _PREFIX.size
+                if buffer[start:start + len(content)] == content:
+                    break
+            else:
+                return
+            timestamp = time.time()
+            payload = _TOMBSTONE.pack(timestamp, index.number, offset)
+            self._append([_record(_OP_TOMBSTONE, payload)])
+            index.discard(offset, content_hash)
+            index.version += 1
+            index.modified_at = timestamp
+        self._maybe_compact()
+
+    def _iter_cards(self, deck_id: str) -> Iterator[Card]:
+        with self._lock:
+            offsets = list(self._index(deck_id).offsets)
+            buffer = self._current_map()
+        return self._read_cards(buffer, offsets)
+
+    def _read_cards(self, buffer: mmap.mmap, offsets: list[int]) -> Iterator[Card]:
+        # hot loop of full-deck scans, avoid function calls per field
+        unpack = _CARD_LAYOUT.unpack_from
+        layout_size = _CARD_LAYOUT.size
+        answer_skip = _U32.size
+        header_size = _RECORD_HEADER.size
+        for offset in offsets:
+            _, size, _, _, question_size = unpack(buffer, offset)
+            question_start = offset + layout_size
+            question_end = question_start + question_size
+            yield Card(
+                buffer[question_start:question_end].decode(),
+                buffer[question_end + answer_skip:offset + header_size + size].decode(),
+            )
+
+    def _stats(self, deck_id: str) -> DeckStats:
+        with self._lock:
+            index = self._index(deck_id)
+            return DeckStats(
+                count=len(index.offsets),
+                modified_at=index.modified_at,
+                version=index.version,
+                incarnation=index.incarnation,
+            )
+
+    def _dead_records(self) -> int:
+        """Records not needed to rebuild the decks. Requires the lock."""
+        return self._records - sum(index.live_records() for index in self._decks.values())
+
+    def _maybe_compact(self) -> None:
+        with self._lock:
+            if self._compacting:
+                return
+            dead_records = self._dead_records()
+            if dead_records < self._config.min_dead_records:
+                return
+            if dead_records < self._records * self._config.compaction_ratio:
+                return
+            self._compacting = True
+        if self._config.background_compaction:
+            threading.Thread(target=self._run_compaction, daemon=True).start()
+        else:
+            self._run_compaction()
+
+    def _run_compaction(self) -> None:
+        try:
+            self.compact()
+        finally:
+            with self._lock:
+                self._compacting = False
@@ -0,0 +1,45 @@
+"""
+SM-2 spaced repetition scheduling.
+https://super-memory.com/english/ol/sm2.htm
+"""
+from __future__ import annotations
+
+from dataclasses import replace
+
+from anki_scroll.services import ReviewState
+
+SECONDS_PER_DAY = 86400.0
+
+MIN_EASE = 1.3
+
+# grades of the review buttons
+AGAIN = 1
+HARD = 3
+GOOD = 4
+EASY = 5
+
+
+def sm2(state: ReviewState, grade: int, now: float) -> ReviewState:
+    """Return the state of the card after a review graded from 0 to 5."""
+    if not 0 <= grade <= 5:
+        raise ValueError(f"grade must be between 0 and 5, got {grade}")
+    if grade < 3:
+        repetitions = 0
+        interval = 1.0
+    else:
+        if state.repetitions == 0:
+            interval = 1.0
+        elif state.repetitions == 1:
+            interval = 6.0
+        else:
+            interval = round(state.interval * state.ease)
+        repetitions = state.repetitions + 1
+    penalty = 5 - grade
+    ease = max(MIN_EASE, state.ease + 0.1 - penalty * (0.08 + penalty * 0.02))
+    return replace(
+        state,
+        due=now + interval * SECONDS_PER_DAY,
+        interval=interval,
+        ease=ease,
+        repetitions=repetitions,
+    )
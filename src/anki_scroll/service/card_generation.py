@@ -1,10 +1,25 @@
 from anki_scroll.services import CardGenerator, Card
 from anki_scroll.service.website_query import WikipediaIndex, _wikipedia_article
-from anki_scroll.llms import grok_fast_no_cache
+from anki_scroll import llms
+from anki_scroll.metrics import REGISTRY
 from dataclasses import dataclass
+import threading
 import dspy
 import pydantic
 
+_BUFFER_HITS = REGISTRY.counter(
+    "anki_scroll_generator_buffer_hits_total",
+    "Cards served from the buffer of generated cards.",
+).labels()
+_BUFFER_MISSES = REGISTRY.counter(
+    "anki_scroll_generator_buffer_misses_total",
+    "Cards requested while the buffer was empty, each one generates a batch.",
+).labels()
+_GENERATION_SECONDS = REGISTRY.histogram(
+    "anki_scroll_card_generation_seconds",
+    "Time to generate a batch of cards with the llm.",
+    buckets=(0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0),
+).labels()
 
 
 @dataclass(frozen=True)
@@ -19,6 +34,10 @@ class LLMCardGeneration(CardGenerator):
     """
     generate flash cards using an llm.
     Cards are generated in batch then stored to be consumed, in order to optimise latency.
+    Safe to call from several threads: a single batch is generated at a time
+    for each spec, the other callers wait for it instead of generating their own.
+    A warm-up is never waited for, its model calls may queue behind other
+    background work while a user asks for a card of the same spec.
     """
     
     def __init__(self, batch_size=20) -> None:
@@ -27,17 +46,69 @@ class LLMCardGeneration(CardGenerator):
         """
         self._batch_size = batch_size
         self._buffer: dict[CardKey, list[Card]] = dict()
+        # guards _buffer and _generating, never held during a generation
+        self._lock = threading.Lock()
+        # held while a batch of the key is generated
+        self._generating: dict[CardKey, threading.Lock] = dict()
+        # keys of the warm-ups in progress, they hold no generation lock
+        self._warming: set[CardKey] = set()
         
     def create_card(self, theme: str, instructions: str) -> Card:
         key = CardKey(theme=theme, instructions=instructions)
-        
-        if len(self._buffer.get(key,[])) == 0:
-            self._buffer[key] = _generate_cards(
-                theme=theme, 
-                instructions=instructions, 
-                n=self._batch_size)
-        
-        return self._buffer[key].pop()
+        card = self._pop(key)
+        if card is None:
+            with self._generation_lock(key):
+                # another thread may have generated the batch meanwhile
+                card = self._pop(key)
+                if card is None:
+                    _BUFFER_MISSES.inc()
+                    cards = self._generate(theme, instructions)
+                    with self._lock:
+                        buffer = self._buffer.setdefault(key, [])
+                        buffer.extend(cards)
+                        return buffer.pop()
+        _BUFFER_HITS.inc()
+        return card
+
+    def warm_up(self, theme: str, instructions: str) -> None:
+        """
+        Generate the first batch of the spec unless cards are buffered, or a
+        batch or a warm-up of the spec is in progress.
+        """
+        key = CardKey(theme=theme, instructions=instructions)
+        generation_lock = self._generation_lock(key)
+        # skipped rather than waiting behind a user
+        if not generation_lock.acquire(blocking=False):
+            return
+        try:
+            with self._lock:
+                if self._buffer.get(key) or key in self._warming:
+                    return
+                self._warming.add(key)
+        finally:
+            generation_lock.release()
+        try:
+            # without the generation lock, a user asking for the spec meanwhile
+            # generates a batch at interactive priority instead of waiting
+            cards = self._generate(theme, instructions)
+            with self._lock:
+                self._buffer.setdefault(key, []).extend(cards)
+        finally:
+            with self._lock:
+                self._warming.discard(key)
+
+    def _pop(self, key: CardKey) -> Card | None:
+        with self._lock:
+            buffer = self._buffer.get(key)
+            return buffer.pop() if buffer else None
+
+    def _generation_lock(self, key: CardKey) -> threading.Lock:
+        with self._lock:
+            return self._generating.setdefault(key, threading.Lock())
+
+    def _generate(self, theme: str, instructions: str) -> list[Card]:
+        with _GENERATION_SECONDS.time():
+            return _generate_cards(theme=theme, instructions=instructions, n=self._batch_size)
     
     
     
@@ -64,10 +135,10 @@ class CardsFromDocument(dspy.Signature):
 
 def _generate_cards(theme: str, instructions: str, n: int) -> list[Card]:
     search = WikipediaIndex()
-    search.set_lm(grok_fast_no_cache)
+    search.set_lm(llms.grok_fast_no_cache)
     
     make_cards = dspy.ChainOfThought(CardsFromDocument)    
-    make_cards.set_lm(grok_fast_no_cache)
+    make_cards.set_lm(llms.grok_fast_no_cache)
     
     documents_urls = search.query(query=f"documents about {theme}", limit=2)
     # to do add logging in case of wrong article => directly consume url
@@ -0,0 +1,201 @@
+"""
+Near-duplicate detection of generated cards.
+
+Questions are compared with MinHash signatures of their word shingles,
+an LSH index over signature bands finds the candidates in constant time.
+NearDuplicateFilter keeps one index per deck, in sync with the deck version,
+plus a bounded index of the cards already served to the user.
+"""
+from __future__ import annotations
+
+import re
+import zlib
+from collections import deque
+from dataclasses import dataclass
+from typing import Hashable, Iterable
+
+import numpy as np
+
+from anki_scroll.services import Card
+
+# mersenne prime, products of two values below it fit in 64 bits
+_PRIME = (1 << 31) - 1
+_NON_WORD = re.compile(r"[\W_]+")
+
+
+def normalize(text: str) -> str:
+    """lower case words separated by single spaces, punctuation is ignored"""
+    return _NON_WORD.sub(" ", text.lower()).strip()
+
+
+def shingles(text: str) -> np.ndarray:
+    """
+    hashes of the distinct words and pairs of consecutive words of the normalized text.
+    Word shingles keep "concept 1" and "concept 2" apart, character ones would not.
+    """
+    words = normalize(text).split() or [""]
+    pieces = set(words)
+    pieces.update(f"{first} {second}" for first, second in zip(words, words[1:]))
+    # crc32 is stable across processes, unlike hash()
+    return np.fromiter(
+        (zlib.crc32(piece.encode("utf-8")) % _PRIME for piece in pieces),
+        dtype=np.uint64,
+        count=len(pieces),
+    )
+
+
+class MinHasher:
+    """Compute MinHash signatures with num_perm universal hash functions."""
+
+    def __init__(self, num_perm: int = 64, seed: int = 1) -> None:
+        generator = np.random.default_rng(seed)
+        self._a = generator.integers(1, _PRIME, size=(num_perm, 1), dtype=np.uint64)
+        self._b = generator.integers(0, _PRIME, size=(num_perm, 1), dtype=np.uint64)
+
+    @property
+    def num_perm(self) -> int:
+        return self._a.shape[0]
+
+    def signature(self, text: str) -> np.ndarray:
+        values = shingles(text)
+        return ((self._a * values + self._b) % _PRIME).min(axis=1)
+
+
+def similarity(first: np.ndarray, second: np.ndarray) -> float:
+    """estimated jaccard similarity of the shingles behind two signatures"""
+    return float(np.count_nonzero(first == second)) / len(first)
+
+
+class MinHashIndex:
+    """
+    LSH index of MinHash signatures.
+    Signatures are split in bands, two signatures sharing a band are candidates
+    and are compared on the whole signature.
+    """
+
+    def __init__(self, bands: int, threshold: float) -> None:
+        self._bands = bands
+        self._threshold = threshold
+        self._signatures: dict[Hashable, np.ndarray] = {}
+        self._buckets: dict[tuple[int, bytes], set[Hashable]] = {}
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._signatures
+
+    def _band_keys(self, signature: np.ndarray) -> list[tuple[int, bytes]]:
+        return [
+            (band, rows.tobytes())
+            for band, rows in enumerate(np.array_split(signature, self._bands))
+        ]
+
+    def add(self, key: Hashable, signature: np.ndarray) -> None:
+        if key in self._signatures:
+            return
+        self._signatures[key] = signature
+        for band_key in self._band_keys(signature):
+            self._buckets.setdefault(band_key, set()).add(key)
+
+    def remove(self, key: Hashable) -> None:
+        signature = self._signatures.pop(key, None)
+        if signature is None:
+            return
+        for band_key in self._band_keys(signature):
+            bucket = self._buckets[band_key]
+            bucket.discard(key)
+            if not bucket:
+                del self._buckets[band_key]
+
+    def find(self, signature: np.ndarray) -> Hashable | None:
+        """Return the key of a near duplicate of the signature, None if there is none."""
+        candidates: set[Hashable] = set()
+        for band_key in self._band_keys(signature):
+            candidates.update(self._buckets.get(band_key, ()))
+        for key in candidates:
+            if similarity(self._signatures[key], signature) >= self._threshold:
+                return key
+        return None
+
+
+@dataclass
+class _DeckIndex:
+    index: MinHashIndex
+    # deck version the index reflects
+    version: int
+
+
+class NearDuplicateFilter:
+    """
+    Detect cards whose question is close to a card of the deck or to a card
+    already served for that deck.
+    The deck index is rebuilt when the deck version differs from the one it
+    reflects. Cards added through added() keep it in sync without a rebuild.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.7,
+        num_perm: int = 64,
+        bands: int = 16,
+        served_limit: int = 1000,
+    ) -> None:
+        """
+        :param threshold: estimated jaccard similarity of the questions above which cards are duplicates
+        :param served_limit: number of served cards remembered per deck
+        """
+        self._threshold = threshold
+        self._bands = bands
+        self._served_limit = served_limit
+        self._hasher = MinHasher(num_perm)
+        self._decks: dict[str, _DeckIndex] = {}
+        self._served: dict[str, tuple[MinHashIndex, deque[Card]]] = {}
+
+    def _new_index(self) -> MinHashIndex:
+        return MinHashIndex(self._bands, self._threshold)
+
+    def needs_sync(self, deck_id: str, version: int) -> bool:
+        deck_index = self._decks.get(deck_id)
+        return deck_index is None or deck_index.version != version
+
+    def sync(self, deck_id: str, version: int, cards: Iterable[Card]) -> None:
+        """Index the cards of the deck at that version."""
+        index = self._new_index()
+        for card in cards:
+            index.add(card, self._hasher.signature(card.question))
+        self._decks[deck_id] = _DeckIndex(index, version)
+
+    def added(self, deck_id: str, cards: Iterable[Card], version: int) -> None:
+        """
+        Record the cards added to the deck by a write, version is the deck
+        version read after the write: backends bump it once per card or once per batch.
+        """
+        deck_index = self._decks.get(deck_id)
+        if deck_index is None:
+            return
+        for card in cards:
+            deck_index.index.add(card, self._hasher.signature(card.question))
+        deck_index.version = version
+
+    def served(self, deck_id: str, card: Card) -> None:
+        """Record a card shown to the user, the oldest ones are forgotten first."""
+        index, order = self._served.setdefault(deck_id, (self._new_index(), deque()))
+        if card in index:
+            return
+        index.add(card, self._hasher.signature(card.question))
+        order.append(card)
+        if len(order) > self._served_limit:
+            index.remove(order.popleft())
+
+    def is_duplicate(self, deck_id: str, card: Card) -> bool:
+        signature = self._hasher.signature(card.question)
+        deck_index = self._decks.get(deck_id)
+        if deck_index is not None and deck_index.index.find(signature) is not None:
+            return True
+        served = self._served.get(deck_id)
+        return served is not None and served[0].find(signature) is not None
+
+    def forget(self, deck_id: str) -> None:
+        self._decks.pop(deck_id, None)
+        self._served.pop(deck_id, None)
@@ -0,0 +1,51 @@
+"""
+dspy language model whose calls go through the process-wide LM scheduler.
+"""
+from __future__ import annotations
+
+from typing import Any
+
+import dspy
+from dspy.utils.usage_tracker import UsageTracker, track_usage
+
+from anki_scroll.lm_scheduler import get_scheduler
+
+# rough size of a token in characters, enough for rate limiting
+_CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(prompt: str | None, messages: list[dict[str, Any]] | None) -> int:
+    """tokens of the prompt, the completion is accounted once the call returns"""
+    if messages:
+        characters = sum(len(str(message.get("content", ""))) for message in messages)
+    else:
+        characters = len(prompt or "")
+    return characters // _CHARS_PER_TOKEN + 1
+
+
+def _used_tokens(tracker: UsageTracker) -> int | None:
+    """tokens recorded by the tracker of one call, None when it reports no usage"""
+    total = None
+    for usage in tracker.get_total_tokens().values():
+        tokens = usage.get("total_tokens")
+        if tokens is None:
+            tokens = (usage.get("prompt_tokens") or 0) + (usage.get("completion_tokens") or 0)
+        total = (total or 0) + int(tokens)
+    return total
+
+
+class ScheduledLM(dspy.LM):
+    """
+    Take a scheduler slot for every call, at the priority of the calling context.
+    Only synchronous calls are scheduled, the services do not use acall.
+    The usage is read from a tracker of the call itself, the history of the LM
+    is shared by the calls running in other threads.
+    """
+
+    def __call__(self, prompt: str | None = None, messages: list[dict[str, Any]] | None = None, **kwargs):
+        with get_scheduler().slot(estimate_tokens(prompt, messages)) as slot:
+            # nested trackers roll their usage up, the caller's tracking is kept
+            with track_usage() as tracker:
+                outputs = super().__call__(prompt, messages=messages, **kwargs)
+            slot.used = _used_tokens(tracker)
+        return outputs
@@ -4,6 +4,7 @@ import dspy
 import requests
 from bs4 import BeautifulSoup
 from dspy import Module, Signature
+from functools import cache
 from pathlib import Path
 
 ################################ service definition
@@ -89,11 +90,16 @@ class WikipediaIndex(SearchWikipediaService):
 
 ################ query wikipedia api
 
-session = requests.Session()
 headers = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; rv:91.0) Gecko/20100101 Firefox/91.0"
 }
-session.headers.update(headers)
+
+@cache
+def _session() -> requests.Session:
+    """shared http session, created on the first request"""
+    session = requests.Session()
+    session.headers.update(headers)
+    return session
 
 _WIKIPEDIA_WIKI_BASE = "https://{language}.wikipedia.org/wiki/{article}"
 def _wikipedia_article(article: str, language: str = "en") -> str:
@@ -102,7 +108,7 @@ def _wikipedia_article(article: str, language: str = "en") -> str:
     article -- the name of the article to retrieve ex: china
     """
     
-    response = session.get(_WIKIPEDIA_WIKI_BASE.format(language=language, article=article))
+    response = _session().get(_WIKIPEDIA_WIKI_BASE.format(language=language, article=article))
     if response.ok:
         html = BeautifulSoup(response.text, "html.parser")
         return html.text
@@ -120,7 +126,7 @@ def _query_wikipedia_index(terms: list[str], language: str = "en") -> list[Websi
     terms -- list of the terms of the query. e.g: china history
     """
     query = " ".join(terms)
-    response = session.get(
+    response = _session().get(
         _WIKIPEDIA_INDEX_BASE.format(language=language), 
         params={"search":query, "title":"Special:Search"})
     
@@ -1,12 +1,15 @@
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
-from typing import Iterator, Optional
+from typing import Iterable, Iterator, Optional
 
-from pydantic import BaseModel
 
-
-class Card(BaseModel):
-    """anki card"""
+@dataclass(frozen=True, slots=True)
+class Card:
+    """
+    anki card
+    An immutable record, cheap to create on the storage read paths.
+    Untrusted input (forms, llm output) is validated before creating cards.
+    """
     question: str
     answer: str
     
@@ -21,6 +24,34 @@ class CardSpec:
     instructions: str
 
 
+@dataclass(frozen=True)
+class DeckStats:
+    """Summary of a deck, maintained by the storage layer on every write."""
+
+    count: int
+    modified_at: float
+    version: int
+    # drawn when the deck is created: a deck removed and created again under
+    # the same name has the same id and restarts its version, not this
+    incarnation: int
+
+
+@dataclass(frozen=True)
+class ReviewState:
+    """Spaced repetition state of a card in a deck."""
+
+    # identify the card in its deck for the review service
+    card_id: int
+    card: Card
+    # unix seconds from which the card should be reviewed
+    due: float
+    # days between the last two reviews
+    interval: float = 0.0
+    ease: float = 2.5
+    # successful reviews in a row
+    repetitions: int = 0
+
+
 class Deck(ABC):
     
     @abstractmethod
@@ -52,11 +83,42 @@ class Deck(ABC):
     def remove(self, card: Card):
         """remove the card from the deck"""
         raise NotImplementedError
+
+    def add_many(self, cards: Iterable[Card]) -> int:
+        """
+        add all the cards to the deck and return how many were added.
+        cards may be a generator, implementations should not materialize it.
+        """
+        added = 0
+        for card in cards:
+            self.add(card)
+            added += 1
+        return added
+
+    def remove_many(self, cards: Iterable[Card]) -> int:
+        """
+        remove one copy of each card from the deck and return how many were removed,
+        cards missing from the deck are ignored.
+        """
+        before = self.stats().count
+        for card in cards:
+            self.remove(card)
+        return before - self.stats().count
     
     @abstractmethod
     def __iter__(self) -> Iterator[Card]:
         raise NotImplementedError
 
+    @abstractmethod
+    def stats(self) -> DeckStats:
+        """
+        Return the number of cards, the last modification time (unix seconds),
+        a version that increases on every modification of the deck and the
+        incarnation of the deck, (id, incarnation, version) identifies its content.
+        Must not iterate over the cards.
+        """
+        raise NotImplementedError
+
   
 class CardGenerator(ABC):
     """api of service supporting card generation from specification"""
@@ -69,6 +131,12 @@ class CardGenerator(ABC):
         instructions -- additonal instructions to follow when generting the card
         """
         raise NotImplementedError
+
+    def warm_up(self, theme: str, instructions: str) -> None:
+        """
+        Prepare the cards of the spec ahead of the first create_card.
+        Nothing to prepare by default.
+        """
     
 
 class CardSpecService(ABC):
@@ -117,6 +185,115 @@ class DeckService(ABC):
     @abstractmethod
     def remove_deck(self, id:str):
         raise NotImplementedError
+
+
+def find_deck_by_name(deck_service: DeckService, name: str) -> Deck | None:
+    """Locate a deck by its name, ignoring surrounding whitespace."""
+    normalized = name.strip()
+    for deck in deck_service.decks():
+        if deck.name() == normalized:
+            return deck
+    return None
+
+
+class ReviewService(ABC):
+    """
+    Schedule the reviews of the cards of every deck.
+    Cards added to a deck are due immediately.
+    """
+
+    @abstractmethod
+    def next_due(self, deck_id: str, now: float | None = None) -> ReviewState | None:
+        """
+        The card of the deck due the earliest, None when no card is due at now.
+        Must not iterate over the cards.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def grade(
+        self, deck_id: str, card_id: int, grade: int, now: float | None = None
+    ) -> ReviewState:
+        """
+        Record a review of the card, grade from 0 (forgotten) to 5 (perfect recall),
+        and return its new state. Raise LookupError if the card is not in the deck.
+        """
+        raise NotImplementedError
     
     
     
+
+
+class AsyncDeck(ABC):
+    """
+    Non blocking counterpart of Deck, used from async code.
+    Always obtained through an AsyncDeckService.
+    """
+
+    @abstractmethod
+    def name(self) -> str:
+        raise NotImplementedError
+
+    @abstractmethod
+    def id(self) -> str:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def add(self, card: Card):
+        """add a card to the deck"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def remove(self, card: Card):
+        """remove the card from the deck"""
+        raise NotImplementedError
+
+    async def add_many(self, cards: list[Card]) -> int:
+        """add all the cards, see Deck.add_many"""
+        for card in cards:
+            await self.add(card)
+        return len(cards)
+
+    async def remove_many(self, cards: list[Card]) -> int:
+        """remove one copy of each card, see Deck.remove_many"""
+        before = (await self.stats()).count
+        for card in cards:
+            await self.remove(card)
+        return before - (await self.stats()).count
+
+    @abstractmethod
+    async def cards(self) -> list[Card]:
+        """all the cards of the deck, in insertion order"""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def stats(self) -> DeckStats:
+        raise NotImplementedError
+
+
+class AsyncDeckService(ABC):
+    """
+    Non blocking counterpart of DeckService, used from async code.
+    """
+
+    @abstractmethod
+    async def decks(self) -> list[AsyncDeck]:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_deck(self, id: str) -> AsyncDeck | None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def add_deck(self, deck: Deck):
+        """Add a deck to the app, see DeckService.add_deck."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def create_deck(self, name: str) -> AsyncDeck | None:
+        """Create a deck unless it already exists."""
+        raise NotImplementedError
+
+    @abstractmethod
+    async def remove_deck(self, id: str):
+        raise NotImplementedError
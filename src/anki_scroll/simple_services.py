@@ -4,8 +4,13 @@ They can be replaced later by more complex implementations.
 """
 from __future__ import annotations
 
-from collections.abc import Iterator
+import heapq
+import random
+import threading
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
 from hashlib import sha256
+from time import time
 from typing import Dict
 from uuid import uuid4
 
@@ -16,33 +21,110 @@ from anki_scroll.services import (
     CardSpecService,
     Deck,
     DeckService,
+    DeckStats,
+    ReviewService,
+    ReviewState,
 )
+from anki_scroll.scheduling import sm2
 
 class SimpleDeck(Deck):
-    """simple in-memory deck implementation"""
+    """
+    simple in-memory deck implementation
+
+    Cards are stored in insertion order under a sequence number, and indexed
+    by content so that removal is O(1). When a card is present several times,
+    the oldest copy is removed first.
+    """
 
     def __init__(self, name: str) -> None:
         self._name = name
-        self._cards: list[Card] = []
+        self._id = sha256(name.encode("utf-8")).hexdigest()
+        self._cards: Dict[int, Card] = {}
+        self._index: Dict[Card, list[int]] = {}
+        self._next_sequence = 0
+        self._version = 0
+        self._modified_at = time()
+        self._incarnation = random.getrandbits(63)
 
     def name(self) -> str:
         return self._name
 
     def id(self) -> str:
-        digest = sha256(self._name.encode("utf-8"))
-        return digest.hexdigest()
+        return self._id
 
     def add(self, card: Card):
-        self._cards.append(card)
+        self._insert(card)
+        self._touch()
+
+    def add_many(self, cards: Iterable[Card]) -> int:
+        added = 0
+        for card in cards:
+            self._insert(card)
+            added += 1
+        if added:
+            self._touch()
+        return added
 
     def remove(self, card: Card):
-        try:
-            self._cards.remove(card)
-        except ValueError:
-            pass
+        if self._discard(card):
+            self._touch()
+
+    def remove_many(self, cards: Iterable[Card]) -> int:
+        removed = sum(self._discard(card) for card in cards)
+        if removed:
+            self._touch()
+        return removed
 
     def __iter__(self) -> Iterator[Card]:
-        return iter(self._cards)
+        # snapshot the cards, the deck can be modified during the iteration
+        return iter(list(self._cards.values()))
+
+    def added_since(self, sequence: int) -> tuple[int, list[tuple[int, Card]]]:
+        """
+        The last sequence assigned, and the cards added after sequence that are
+        still in the deck with their sequence, oldest first. Safe while another
+        thread modifies the deck, the cards are not iterated over.
+        """
+        end = self._next_sequence
+        added = []
+        for current in range(sequence + 1, end):
+            card = self._cards.get(current)
+            if card is not None:
+                added.append((current, card))
+        return end - 1, added
+
+    def has_sequence(self, sequence: int) -> bool:
+        """whether the card added under sequence is still in the deck"""
+        return sequence in self._cards
+
+    def stats(self) -> DeckStats:
+        return DeckStats(
+            count=len(self._cards),
+            modified_at=self._modified_at,
+            version=self._version,
+            incarnation=self._incarnation,
+        )
+
+    def _insert(self, card: Card) -> None:
+        sequence = self._next_sequence
+        self._cards[sequence] = card
+        self._index.setdefault(card, []).append(sequence)
+        # published last: every sequence below _next_sequence is stored or removed
+        self._next_sequence = sequence + 1
+
+    def _discard(self, card: Card) -> bool:
+        sequences = self._index.get(card)
+        if not sequences:
+            return False
+        sequence = sequences.pop(0)
+        stored = self._cards.pop(sequence)
+        if not sequences:
+            del self._index[stored]
+        return True
+
+    def _touch(self) -> None:
+        self._version += 1
+        self._modified_at = time()
 
 
 class SimpleCardGenerator(CardGenerator):
@@ -95,7 +177,8 @@ class SimpleDeckService(DeckService):
         self._decks: Dict[str, Deck] = {}
 
     def decks(self) -> Iterator[Deck]:
-        return iter(self._decks.values())
+        # iterate over a snapshot, decks can be created from another thread
+        return iter(list(self._decks.values()))
 
     def get_deck(self, id: str) -> Deck | None:
         return self._decks.get(id)
@@ -117,3 +200,129 @@ class SimpleDeckService(DeckService):
 
     def remove_deck(self, id: str):
         self._decks.pop(id, None)
+
+
+class _ReviewQueue:
+    """Review states of one deck and a heap of (due, card_id) ordered by due time."""
+
+    def __init__(self, incarnation: int) -> None:
+        self.incarnation = incarnation
+        self.version: int | None = None
+        self.states: Dict[int, ReviewState] = {}
+        # ids of the cards of other decks than SimpleDeck, by content
+        self.ids: Dict[Card, list[int]] = {}
+        self.heap: list[tuple[float, int]] = []
+        # cards of a SimpleDeck are identified by their sequence number: the
+        # sequences up to this one are queued, alive tells whether a card is still in the deck
+        self.sequence = -1
+        self.alive: Callable[[int], bool] | None = None
+
+    def push(self, state: ReviewState) -> None:
+        self.states[state.card_id] = state
+        heapq.heappush(self.heap, (state.due, state.card_id))
+        # entries of graded or removed cards are skipped lazily, rebuild when they dominate
+        if len(self.heap) > 2 * len(self.states) + 64:
+            self.heap = [(state.due, card_id) for card_id, state in self.states.items()]
+            heapq.heapify(self.heap)
+
+    def peek(self) -> ReviewState | None:
+        while self.heap:
+            due, card_id = self.heap[0]
+            state = self.get(card_id)
+            if state is not None and state.due == due:
+                return state
+            heapq.heappop(self.heap)
+        return None
+
+    def get(self, card_id: int) -> ReviewState | None:
+        state = self.states.get(card_id)
+        if state is not None and self.alive is not None and not self.alive(card_id):
+            # removed from the deck since it was queued
+            del self.states[card_id]
+            return None
+        return state
+
+
+class SimpleReviewService(ReviewService):
+    """
+    In-memory review service for the decks of a deck service.
+    Each deck has a heap of due times: the next due card is found in O(log n).
+    The queue follows the deck through its version. For a SimpleDeck, only the
+    cards added since the last call are read and removed cards are dropped when
+    they are met. Other decks are reconciled by one pass over the deck.
+    """
+
+    def __init__(self, deck_service: DeckService) -> None:
+        self._deck_service = deck_service
+        self._queues: Dict[str, _ReviewQueue] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def _queue(self, deck_id: str, now: float) -> _ReviewQueue:
+        deck = self._deck_service.get_deck(deck_id)
+        if deck is None:
+            self._queues.pop(deck_id, None)
+            raise LookupError(f"Deck '{deck_id}' does not exist.")
+        stats = deck.stats()
+        queue = self._queues.get(deck_id)
+        if queue is None or queue.incarnation != stats.incarnation:
+            queue = self._queues[deck_id] = _ReviewQueue(stats.incarnation)
+        if queue.version != stats.version:
+            if isinstance(deck, SimpleDeck):
+                self._follow(queue, deck, now)
+            else:
+                self._reconcile(queue, deck, now)
+            queue.version = stats.version
+        return queue
+
+    def _follow(self, queue: _ReviewQueue, deck: SimpleDeck, now: float) -> None:
+        queue.sequence, added = deck.added_since(queue.sequence)
+        for sequence, card in added:
+            queue.push(ReviewState(card_id=sequence, card=card, due=now))
+        queue.alive = deck.has_sequence
+        # states of removed cards are only dropped by peek, prune them when they dominate
+        if len(queue.states) > 2 * deck.stats().count + 64:
+            queue.states = {
+                card_id: state
+                for card_id, state in queue.states.items()
+                if deck.has_sequence(card_id)
+            }
+
+    def _reconcile(self, queue: _ReviewQueue, deck: Deck, now: float) -> None:
+        # reuse the ids of the cards still in the deck, oldest copies first
+        unused = {card: deque(ids) for card, ids in queue.ids.items()}
+        ids: Dict[Card, list[int]] = {}
+        for card in deck:
+            available = unused.get(card)
+            if available:
+                card_id = available.popleft()
+            else:
+                card_id = self._next_id
+                self._next_id += 1
+                queue.push(ReviewState(card_id=card_id, card=card, due=now))
+            ids.setdefault(card, []).append(card_id)
+        for removed in unused.values():
+            for card_id in removed:
+                del queue.states[card_id]
+        queue.ids = ids
+
+    def next_due(self, deck_id: str, now: float | None = None) -> ReviewState | None:
+        now = time() if now is None else now
+        with self._lock:
+            state = self._queue(deck_id, now).peek()
+        if state is None or state.due > now:
+            return None
+        return state
+
+    def grade(
+        self, deck_id: str, card_id: int, grade: int, now: float | None = None
+    ) -> ReviewState:
+        now = time() if now is None else now
+        with self._lock:
+            queue = self._queue(deck_id, now)
+            state = queue.get(card_id)
+            if state is None:
+                raise LookupError(f"Card {card_id} is not in deck '{deck_id}'.")
+            reviewed = sm2(state, grade, now)
+            queue.push(reviewed)
+        return reviewed
@@ -1,24 +1,114 @@
 from __future__ import annotations
 
 import os
+import random
 import sqlite3
+import struct
+import threading
+import time
+import zlib
+from collections import Counter
 from contextlib import contextmanager
 from dataclasses import dataclass
 from hashlib import sha256
+from itertools import batched, starmap
 from pathlib import Path
-from typing import Callable, Iterator, Self
+from typing import Callable, Iterable, Iterator, Self, TypeVar
 from dotenv import load_dotenv
 
-from anki_scroll.services import Card, Deck, DeckService
+from anki_scroll.metrics import REGISTRY
+from anki_scroll.scheduling import sm2
+from anki_scroll.services import (
+    Card,
+    Deck,
+    DeckService,
+    DeckStats,
+    ReviewService,
+    ReviewState,
+)
+
+try:
+    import fcntl
+except ImportError:  # windows
+    fcntl = None
+
+T = TypeVar("T")
+
+# number of rows inserted or fetched at once by bulk operations
+CHUNK_SIZE = 1000
+
+# current time as unix seconds, usable inside triggers
+_SQL_NOW = "((julianday('now') - 2440587.5) * 86400.0)"
+
+# the count of the histogram is the number of queries (read) and transactions (write),
+# a sqlite trace callback counting every statement doubled the cost of bulk inserts
+_DB_SECONDS = REGISTRY.histogram(
+    "anki_scroll_db_connection_seconds",
+    "Time a connection is held, kind is read or write (one write transaction attempt).",
+    ("kind",),
+)
+_DB_RETRIES = REGISTRY.counter(
+    "anki_scroll_db_retries_total",
+    "Operations retried because the database was locked by another connection.",
+).labels()
+
+
+# header of a compressed answer: format, dictionary id (0 when none), size of the plain answer
+_COMPRESSED_HEADER = struct.Struct("<BII")
+# zlib stream, still read: zlib only loads the dictionary once the stream asks
+# for it, which tripled the decoding time of answers compressed with a dictionary
+_ZLIB_FORMAT = 1
+# raw deflate, the dictionary is loaded when the decompressor is created
+_DEFLATE_FORMAT = 2
+# window bits of raw deflate
+_DEFLATE_WBITS = -zlib.MAX_WBITS
+
+# keywords accepted by PRAGMA journal_mode and PRAGMA wal_checkpoint, the pragmas take no parameters
+JOURNAL_MODES = frozenset({"DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"})
+CHECKPOINT_MODES = frozenset({"PASSIVE", "FULL", "RESTART", "TRUNCATE"})
+
+
+def _keyword(value: str, allowed: frozenset[str], name: str) -> str:
+    """value as an upper case sql keyword, ValueError unless it is allowed"""
+    keyword = value.upper()
+    if keyword not in allowed:
+        raise ValueError(f"{name} must be one of {', '.join(sorted(allowed))}, got {value!r}")
+    return keyword
+
+
+# answer column as text, compressed answers are stored as BLOB and only those go through python
+_ANSWER_SQL = "CASE WHEN typeof(answer) = 'blob' THEN anki_scroll_answer(answer) ELSE answer END"
 
 
 @dataclass(slots=True)
 class SqlConfig:
     """
     Contain all the parameter to connect to the sql database.
+
+    The defaults are safe for several worker processes sharing one database file:
+    WAL journal so that readers never block the writer, a busy timeout and
+    a bounded number of retries with exponential backoff when the database is locked.
     """
 
     database: str
+    journal_mode: str = "WAL"
+    # seconds sqlite waits for a lock before failing with SQLITE_BUSY
+    busy_timeout: float = 5.0
+    # retries of a write transaction failing with SQLITE_BUSY after busy_timeout
+    max_retries: int = 3
+    # initial delay in seconds between retries, doubled at each attempt
+    retry_backoff: float = 0.05
+    # checkpoint the WAL into the database file once it reaches that many pages
+    wal_autocheckpoint: int = 1000
+    # serialize writes of all processes with a lock file next to the database
+    single_writer: bool = False
+    # answers of at least that many utf-8 bytes are stored zlib compressed, None disables compression
+    compress_threshold: int | None = None
+    # zlib level used for new answers
+    compression_level: int = 6
+
+    def __post_init__(self) -> None:
+        self.journal_mode = _keyword(self.journal_mode, JOURNAL_MODES, "journal_mode")
 
     @classmethod
     def load(cls) -> Self:
@@ -26,12 +116,314 @@ class SqlConfig:
         Load configuration from the environment.
         ANKI_SCROLL_DB_PATH can point to a sqlite file path or sqlite URI.
         Defaults to ``anki_scroll.sqlite3`` in the current working directory.
+        ANKI_SCROLL_DB_JOURNAL_MODE, ANKI_SCROLL_DB_BUSY_TIMEOUT,
+        ANKI_SCROLL_DB_SINGLE_WRITER and ANKI_SCROLL_DB_COMPRESS_THRESHOLD
+        override the corresponding fields.
         """
         load_dotenv()
         db_path = os.environ.get("ANKI_SCROLL_DB_PATH")
         if not db_path:
             db_path = str(Path.cwd() / "anki_scroll.sqlite3")
-        return cls(database=db_path)
+        journal_mode = os.environ.get("ANKI_SCROLL_DB_JOURNAL_MODE")
+        config = cls(database=db_path, journal_mode=journal_mode or "WAL")
+        busy_timeout = os.environ.get("ANKI_SCROLL_DB_BUSY_TIMEOUT")
+        if busy_timeout:
+            config.busy_timeout = float(busy_timeout)
+        single_writer = os.environ.get("ANKI_SCROLL_DB_SINGLE_WRITER", "")
+        config.single_writer = single_writer.lower() in ("1", "true", "yes")
+        compress_threshold = os.environ.get("ANKI_SCROLL_DB_COMPRESS_THRESHOLD")
+        if compress_threshold:
+            config.compress_threshold = int(compress_threshold)
+        return config
+
+
+@dataclass(frozen=True)
+class CompressionReport:
+    """Size of the answers in the database, see SqlDeckService.compression_report."""
+
+    answers: int
+    compressed_answers: int
+    # utf-8 size of all the answers once decompressed
+    plain_bytes: int
+    # size of the answers as stored in the cards table
+    stored_bytes: int
+
+    @property
+    def ratio(self) -> float:
+        """plain size over stored size, 1.0 when nothing is compressed"""
+        if self.stored_bytes == 0:
+            return 1.0
+        return self.plain_bytes / self.stored_bytes
+
+
+class AnswerCodec:
+    """
+    Compress long answers with zlib, optionally with a shared dictionary.
+    Compressed answers are BLOB and plain answers TEXT, both coexist in the
+    cards table so the threshold can change at any time, and a database
+    written with compression stays readable when it is disabled.
+    Dictionaries are stored in the database, a compressed answer keeps the id
+    of the dictionary it was compressed with.
+    Answers are decompressed as the rows are read, not when a card is rendered:
+    Card holds str answers and the scans (review queue, dedup, export) read them
+    all. A full-deck scan of compressed answers takes about 2.5x the time of a
+    plain scan (benchmarks/answer_compression.py), compression trades scan time
+    for database size.
+    """
+
+    def __init__(
+        self,
+        threshold: int | None,
+        level: int,
+        load_dictionary: Callable[[int], bytes],
+    ) -> None:
+        self._threshold = threshold
+        self._level = level
+        self._load_dictionary = load_dictionary
+        self._dictionaries: dict[int, bytes] = {}
+        self._dictionary_id = 0
+        self._lock = threading.Lock()
+
+    @property
+    def dictionary_id(self) -> int:
+        """id of the dictionary used for new answers, 0 when none"""
+        return self._dictionary_id
+
+    def use_dictionary(self, dictionary_id: int, dictionary: bytes) -> None:
+        with self._lock:
+            self._dictionaries[dictionary_id] = dictionary
+            self._dictionary_id = dictionary_id
+
+    def encode(self, answer: str) -> str | bytes:
+        """Return the value to store, the answer itself unless compression saves space."""
+        if self._threshold is None:
+            return answer
+        data = answer.encode("utf-8")
+        if len(data) < self._threshold:
+            return answer
+        dictionary_id = self._dictionary_id
+        if dictionary_id:
+            compressor = zlib.compressobj(
+                self._level, zlib.DEFLATED, _DEFLATE_WBITS, zdict=self._dictionaries[dictionary_id]
+            )
+        else:
+            compressor = zlib.compressobj(self._level, zlib.DEFLATED, _DEFLATE_WBITS)
+        compressed = compressor.compress(data) + compressor.flush()
+        if _COMPRESSED_HEADER.size + len(compressed) >= len(data):
+            return answer
+        return _COMPRESSED_HEADER.pack(_DEFLATE_FORMAT, dictionary_id, len(data)) + compressed
+
+    def decode(self, value: str | bytes) -> str:
+        if isinstance(value, str):
+            return value
+        version, dictionary_id, _ = _COMPRESSED_HEADER.unpack_from(value)
+        if version == _DEFLATE_FORMAT:
+            wbits = _DEFLATE_WBITS
+        elif version == _ZLIB_FORMAT:
+            wbits = zlib.MAX_WBITS
+        else:
+            raise ValueError(f"unknown compressed answer format {version}")
+        payload = value[_COMPRESSED_HEADER.size:]
+        if not dictionary_id:
+            return zlib.decompress(payload, wbits).decode("utf-8")
+        decompressor = zlib.decompressobj(wbits, zdict=self._dictionary(dictionary_id))
+        return (decompressor.decompress(payload) + decompressor.flush()).decode("utf-8")
+
+    def matches(self, value: str | bytes, answer: str, size: int) -> bool:
+        """
+        Whether the stored value is the answer of size utf-8 bytes.
+        Compressed values are only decompressed when their header has that size,
+        compressing the answer to compare blobs would cost more than decompressing
+        and miss the values compressed with other settings.
+        """
+        if isinstance(value, str):
+            return value == answer
+        return self.plain_size(value) == size and self.decode(value) == answer
+
+    @staticmethod
+    def plain_size(value: str | bytes) -> int:
+        if isinstance(value, str):
+            return len(value.encode("utf-8"))
+        return _COMPRESSED_HEADER.unpack_from(value)[2]
+
+    def _dictionary(self, dictionary_id: int) -> bytes:
+        dictionary = self._dictionaries.get(dictionary_id)
+        if dictionary is None:
+            # trained by another process after this one started
+            dictionary = self._load_dictionary(dictionary_id)
+            with self._lock:
+                self._dictionaries[dictionary_id] = dictionary
+        return dictionary
+
+
+def train_dictionary(samples: Iterable[str], size: int = 32 * 1024) -> bytes:
+    """
+    Build a zlib dictionary from sample answers.
+    zlib has no trainer, the dictionary is the text preceding every answer:
+    keep the word sequences that save the most bytes across samples, the
+    most useful ones last since zlib favors the closest matches.
+    """
+    scores: Counter[str] = Counter()
+    for sample in samples:
+        words = sample.split()
+        # a sequence only helps once per answer, count it once
+        seen: set[str] = set()
+        for length in (1, 2, 3, 4):
+            for start in range(len(words) - length + 1):
+                seen.add(" ".join(words[start:start + length]))
+        for sequence in seen:
+            scores[sequence] += len(sequence)
+    selected: list[bytes] = []
+    total = 0
+    for sequence, score in scores.most_common():
+        if total >= size:
+            break
+        # sequences seen in a single answer are not shared
+        if score <= len(sequence):
+            continue
+        encoded = sequence.encode("utf-8") + b" "
+        selected.append(encoded)
+        total += len(encoded)
+    selected.reverse()
+    return b"".join(selected)[-size:]
+
+
+def _is_busy(error: sqlite3.OperationalError) -> bool:
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
+
+class SqlDatabase:
+    """
+    Open connections to the sqlite database and run write transactions.
+    Writes take the write lock upfront (BEGIN IMMEDIATE) and are retried
+    with exponential backoff when another process holds it for too long.
+    """
+
+    def __init__(self, config: SqlConfig) -> None:
+        self._config = config
+        self._path = config.database
+        self._use_uri = self._path.startswith("file:")
+        self._in_memory = self._path == ":memory:" or "mode=memory" in self._path
+        self._thread_lock = threading.Lock()
+        self._lock_path: Path | None = None
+        if config.single_writer and not self._in_memory:
+            if fcntl is None:
+                raise RuntimeError("single_writer requires fcntl, it is not available on this platform")
+            file_path = self._path.removeprefix("file:").split("?", 1)[0]
+            self._lock_path = Path(f"{file_path}-writer.lock")
+        self._codec = AnswerCodec(
+            config.compress_threshold, config.compression_level, self._load_dictionary
+        )
+
+    @property
+    def config(self) -> SqlConfig:
+        return self._config
+
+    @property
+    def codec(self) -> AnswerCodec:
+        return self._codec
+
+    def _load_dictionary(self, dictionary_id: int) -> bytes:
+        with self.connect() as conn:
+            row = conn.execute(
+                "SELECT data FROM compression_dictionaries WHERE id = ?", (dictionary_id,)
+            ).fetchone()
+        if row is None:
+            raise LookupError(f"compression dictionary {dictionary_id} does not exist")
+        return row["data"]
+
+    def new_connection(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self._path, uri=self._use_uri, timeout=self._config.busy_timeout
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA foreign_keys = ON")
+        conn.execute(f"PRAGMA wal_autocheckpoint = {int(self._config.wal_autocheckpoint)}")
+        conn.create_function("anki_scroll_answer", 1, self._codec.decode, deterministic=True)
+        return conn
+
+    @contextmanager
+    def connect(self, kind: str = "read") -> Iterator[sqlite3.Connection]:
+        """kind labels the time the connection is held in the metrics"""
+        with _DB_SECONDS.labels(kind).time():
+            conn = self.new_connection()
+            try:
+                yield conn
+            finally:
+                conn.close()
+
+    def set_journal_mode(self) -> None:
+        """The journal mode is persistent, it only needs to be set once per database."""
+        if self._in_memory:
+            return
+        self.retry(self._set_journal_mode)
+
+    def _set_journal_mode(self) -> None:
+        # validated again, the field may have been assigned after the config was created
+        journal_mode = _keyword(self._config.journal_mode, JOURNAL_MODES, "journal_mode")
+        with self.connect() as conn:
+            conn.execute(f"PRAGMA journal_mode = {journal_mode}")
+
+    def retry(self, operation: Callable[[], T]) -> T:
+        """Run the operation, retrying it while the database is busy."""
+        attempt = 0
+        while True:
+            try:
+                return operation()
+            except sqlite3.OperationalError as error:
+                if not _is_busy(error) or attempt >= self._config.max_retries:
+                    raise
+            _DB_RETRIES.inc()
+            # jitter avoids waking up all the waiting processes at the same time
+            delay = self._config.retry_backoff * (2**attempt)
+            time.sleep(delay * (0.5 + random.random()))
+            attempt += 1
+
+    def write(self, operation: Callable[[sqlite3.Connection], T]) -> T:
+        """
+        Run the operation in a write transaction, commit it and return its result.
+        The operation may run several times, it must only touch the database.
+        """
+        return self.retry(lambda: self._write_once(operation))
+
+    def _write_once(self, operation: Callable[[sqlite3.Connection], T]) -> T:
+        with self._writer_lock(), self.connect("write") as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = operation(conn)
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+            return result
+
+    @contextmanager
+    def _writer_lock(self) -> Iterator[None]:
+        if not self._config.single_writer:
+            yield
+            return
+        with self._thread_lock:
+            if self._lock_path is None:
+                yield
+                return
+            with open(self._lock_path, "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def checkpoint(self, mode: str = "PASSIVE") -> tuple[int, int, int]:
+        """
+        Copy the WAL content into the database file.
+        mode is one of PASSIVE, FULL, RESTART or TRUNCATE, see sqlite documentation.
+        Return (busy, wal pages, checkpointed pages).
+        """
+        mode = _keyword(mode, CHECKPOINT_MODES, "mode")
+        with self.connect() as conn:
+            row = conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+        return row[0], row[1], row[2]
 
 
 class SqlDeck(Deck):
@@ -44,19 +436,11 @@ class SqlDeck(Deck):
         self,
         deck_id: str,
         name: str,
-        connection_factory: Callable[[], sqlite3.Connection],
+        database: SqlDatabase,
     ) -> None:
         self._id = deck_id
         self._name = name
-        self._connection_factory = connection_factory
-
-    @contextmanager
-    def _connect(self) -> Iterator[sqlite3.Connection]:
-        conn = self._connection_factory()
-        try:
-            yield conn
-        finally:
-            conn.close()
+        self._database = database
 
     def _assert_exists(self, conn: sqlite3.Connection) -> None:
         cursor = conn.execute("SELECT 1 FROM decks WHERE id = ?", (self._id,))
@@ -70,39 +454,102 @@ class SqlDeck(Deck):
         return self._id
 
     def add(self, card: Card):
-        with self._connect() as conn:
+        answer = self._database.codec.encode(card.answer)
+
+        def operation(conn: sqlite3.Connection) -> None:
             self._assert_exists(conn)
             conn.execute(
                 "INSERT INTO cards (deck_id, question, answer) VALUES (?, ?, ?)",
-                (self._id, card.question, card.answer),
+                (self._id, card.question, answer),
             )
-            conn.commit()
 
-    def remove(self, card: Card):
-        with self._connect() as conn:
-            self._assert_exists(conn)
-            conn.execute(
-                """
-                DELETE FROM cards
-                WHERE rowid IN (
-                    SELECT rowid FROM cards
-                    WHERE deck_id = ? AND question = ? AND answer = ?
-                    LIMIT 1
+        self._database.write(operation)
+
+    def add_many(self, cards: Iterable[Card]) -> int:
+        """
+        Insert the cards in chunks of CHUNK_SIZE rows.
+        Each chunk is its own transaction so that other writers are not blocked
+        during large imports, a failure keeps the chunks already inserted.
+        """
+        encode = self._database.codec.encode
+        added = 0
+        for chunk in batched(cards, CHUNK_SIZE):
+            rows = [(self._id, card.question, encode(card.answer)) for card in chunk]
+
+            def operation(conn: sqlite3.Connection) -> None:
+                self._assert_exists(conn)
+                conn.executemany(
+                    "INSERT INTO cards (deck_id, question, answer) VALUES (?, ?, ?)",
+                    rows,
                 )
-                """,
-                (self._id, card.question, card.answer),
-            )
-            conn.commit()
+
+            self._database.write(operation)
+            added += len(rows)
+        return added
+
+    def remove(self, card: Card):
+        self.remove_many([card])
+
+    def remove_many(self, cards: Iterable[Card]) -> int:
+        """
+        Remove the cards in chunks of CHUNK_SIZE, one transaction per chunk.
+        The copies of a card are found by question, then by answer: compressed
+        answers are only decompressed when they have the size of the answer.
+        """
+        codec = self._database.codec
+        removed = 0
+        for chunk in batched(cards, CHUNK_SIZE):
+            probes = [
+                (card.question, card.answer, len(card.answer.encode("utf-8"))) for card in chunk
+            ]
+
+            def operation(conn: sqlite3.Connection) -> int:
+                self._assert_exists(conn)
+                cursor = conn.cursor()
+                cursor.row_factory = None
+                deleted = 0
+                for question, answer, size in probes:
+                    copies = cursor.execute(
+                        "SELECT id, answer FROM cards WHERE deck_id = ? AND question = ? ORDER BY id",
+                        (self._id, question),
+                    ).fetchall()
+                    for card_id, value in copies:
+                        if codec.matches(value, answer, size):
+                            conn.execute("DELETE FROM cards WHERE id = ?", (card_id,))
+                            deleted += 1
+                            break
+                return deleted
+
+            removed += self._database.write(operation)
+        return removed
 
     def __iter__(self) -> Iterator[Card]:
-        with self._connect() as conn:
+        with self._database.connect() as conn:
             self._assert_exists(conn)
-            rows = conn.execute(
-                "SELECT question, answer FROM cards WHERE deck_id = ? ORDER BY rowid",
+            cursor = conn.cursor()
+            # plain tuples are much cheaper to build than sqlite3.Row
+            cursor.row_factory = None
+            cursor.execute(
+                f"SELECT question, {_ANSWER_SQL} FROM cards WHERE deck_id = ? ORDER BY id",
                 (self._id,),
-            ).fetchall()
-        for row in rows:
-            yield Card(question=row["question"], answer=row["answer"])
+            )
+            while rows := cursor.fetchmany(CHUNK_SIZE):
+                yield from starmap(Card, rows)
+
+    def stats(self) -> DeckStats:
+        with self._database.connect() as conn:
+            row = conn.execute(
+                "SELECT count, modified_at, version, incarnation FROM deck_stats WHERE deck_id = ?",
+                (self._id,),
+            ).fetchone()
+        if row is None:
+            raise LookupError(f"Deck '{self._id}' does not exist in the database.")
+        return DeckStats(
+            count=row["count"],
+            modified_at=row["modified_at"],
+            version=row["version"],
+            incarnation=row["incarnation"],
+        )
 
 
 class SqlDeckService(DeckService):
@@ -113,53 +560,254 @@ class SqlDeckService(DeckService):
 
     def __init__(self, config: SqlConfig | None = None) -> None:
         self._config = config or SqlConfig.load()
-        self._database = self._config.database
         self._ensure_directory()
-        self._initialize_schema()
+        self._database = SqlDatabase(self._config)
+        self._database.set_journal_mode()
+        self._database.retry(self._initialize_schema)
+        self._database.retry(self._load_current_dictionary)
 
     def _ensure_directory(self) -> None:
-        if self._database in (":memory:",):
+        if self._config.database in (":memory:",):
             return
-        if self._database.startswith("file:"):
+        if self._config.database.startswith("file:"):
             return
-        db_path = Path(self._database)
+        db_path = Path(self._config.database)
         if not db_path.name:
             return
         db_path.parent.mkdir(parents=True, exist_ok=True)
 
-    def _new_connection(self) -> sqlite3.Connection:
-        use_uri = self._database.startswith("file:")
-        conn = sqlite3.connect(self._database, uri=use_uri)
-        conn.row_factory = sqlite3.Row
-        conn.execute("PRAGMA foreign_keys = ON")
-        return conn
+    def checkpoint(self, mode: str = "PASSIVE") -> tuple[int, int, int]:
+        """Checkpoint the WAL, see SqlDatabase.checkpoint."""
+        return self._database.checkpoint(mode)
 
-    @contextmanager
-    def _connect(self) -> Iterator[sqlite3.Connection]:
-        conn = self._new_connection()
-        try:
-            yield conn
-        finally:
-            conn.close()
+    def review_service(self) -> SqlReviewService:
+        """Review service of the cards stored in the same database."""
+        return SqlReviewService(self._database)
 
     def _initialize_schema(self) -> None:
-        with self._connect() as conn:
+        """
+        Create the tables if needed.
+        deck_stats is maintained by triggers so that every write path,
+        including direct sql access, keeps the counters up to date.
+        """
+        with self._database.connect() as conn:
+            self._migrate(conn)
             conn.executescript(
-                """
+                f"""
                 CREATE TABLE IF NOT EXISTS decks (
                     id TEXT PRIMARY KEY,
                     name TEXT NOT NULL UNIQUE
                 );
+                -- reviews refer to the id, unlike a bare rowid it survives VACUUM and
+                -- AUTOINCREMENT never hands the id of a removed card to a new one
                 CREATE TABLE IF NOT EXISTS cards (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
                     deck_id TEXT NOT NULL,
                     question TEXT NOT NULL,
                     answer TEXT NOT NULL,
                     FOREIGN KEY(deck_id) REFERENCES decks(id) ON DELETE CASCADE
                 );
+                -- removing a card looks it up by question, without it every delete scans the table
+                CREATE INDEX IF NOT EXISTS cards_by_question ON cards (deck_id, question);
+                CREATE TABLE IF NOT EXISTS compression_dictionaries (
+                    id INTEGER PRIMARY KEY,
+                    data BLOB NOT NULL,
+                    created_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS deck_stats (
+                    deck_id TEXT PRIMARY KEY,
+                    count INTEGER NOT NULL DEFAULT 0,
+                    modified_at REAL NOT NULL,
+                    version INTEGER NOT NULL DEFAULT 0,
+                    -- random, tells apart a deck removed and created again under the same name
+                    incarnation INTEGER NOT NULL DEFAULT 0,
+                    FOREIGN KEY(deck_id) REFERENCES decks(id) ON DELETE CASCADE
+                );
+                CREATE TRIGGER IF NOT EXISTS deck_stats_on_deck_insert
+                AFTER INSERT ON decks
+                BEGIN
+                    INSERT OR IGNORE INTO deck_stats (deck_id, count, modified_at, version, incarnation)
+                    VALUES (NEW.id, 0, {_SQL_NOW}, 0, random());
+                END;
+                CREATE TRIGGER IF NOT EXISTS deck_stats_on_card_insert
+                AFTER INSERT ON cards
+                BEGIN
+                    UPDATE deck_stats
+                    SET count = count + 1, version = version + 1, modified_at = {_SQL_NOW}
+                    WHERE deck_id = NEW.deck_id;
+                END;
+                CREATE TRIGGER IF NOT EXISTS deck_stats_on_card_delete
+                AFTER DELETE ON cards
+                BEGIN
+                    UPDATE deck_stats
+                    SET count = count - 1, version = version + 1, modified_at = {_SQL_NOW}
+                    WHERE deck_id = OLD.deck_id;
+                END;
+                CREATE TABLE IF NOT EXISTS reviews (
+                    card_id INTEGER PRIMARY KEY,
+                    deck_id TEXT NOT NULL,
+                    due REAL NOT NULL,
+                    interval REAL NOT NULL DEFAULT 0,
+                    ease REAL NOT NULL DEFAULT 2.5,
+                    repetitions INTEGER NOT NULL DEFAULT 0,
+                    FOREIGN KEY(deck_id) REFERENCES decks(id) ON DELETE CASCADE
+                );
+                CREATE INDEX IF NOT EXISTS reviews_by_due ON reviews (deck_id, due);
+                CREATE TRIGGER IF NOT EXISTS reviews_on_card_insert
+                AFTER INSERT ON cards
+                BEGIN
+                    INSERT INTO reviews (card_id, deck_id, due)
+                    VALUES (NEW.id, NEW.deck_id, {_SQL_NOW});
+                END;
+                CREATE TRIGGER IF NOT EXISTS reviews_on_card_delete
+                AFTER DELETE ON cards
+                BEGIN
+                    DELETE FROM reviews WHERE card_id = OLD.id;
+                END;
+                -- backfill cards inserted before the reviews table existed
+                INSERT OR IGNORE INTO reviews (card_id, deck_id, due)
+                SELECT id, deck_id, {_SQL_NOW} FROM cards
+                WHERE id > (SELECT COALESCE(MAX(card_id), 0) FROM reviews);
+                -- backfill databases created before deck_stats existed
+                INSERT OR IGNORE INTO deck_stats (deck_id, count, modified_at, version, incarnation)
+                SELECT
+                    decks.id,
+                    (SELECT COUNT(*) FROM cards WHERE cards.deck_id = decks.id),
+                    {_SQL_NOW},
+                    0,
+                    random()
+                FROM decks;
                 """
             )
             conn.commit()
 
+    def _migrate(self, conn: sqlite3.Connection) -> None:
+        """Upgrade the tables of databases created by older versions, before the schema script."""
+        if not (self._needs_incarnation(conn) or self._needs_card_id(conn)):
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # another process may have migrated while this one waited for the lock
+            if self._needs_incarnation(conn):
+                conn.execute(
+                    "ALTER TABLE deck_stats ADD COLUMN incarnation INTEGER NOT NULL DEFAULT 0"
+                )
+                conn.execute("UPDATE deck_stats SET incarnation = random()")
+                # recreated by the schema script with the incarnation
+                conn.execute("DROP TRIGGER IF EXISTS deck_stats_on_deck_insert")
+            if self._needs_card_id(conn):
+                self._add_card_id(conn)
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+
+    @staticmethod
+    def _columns(conn: sqlite3.Connection, table: str) -> set[str]:
+        return {row["name"] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+    @classmethod
+    def _needs_incarnation(cls, conn: sqlite3.Connection) -> bool:
+        columns = cls._columns(conn, "deck_stats")
+        return bool(columns) and "incarnation" not in columns
+
+    @classmethod
+    def _needs_card_id(cls, conn: sqlite3.Connection) -> bool:
+        columns = cls._columns(conn, "cards")
+        return bool(columns) and "id" not in columns
+
+    @staticmethod
+    def _add_card_id(conn: sqlite3.Connection) -> None:
+        """
+        Rebuild the cards table with an id column, sqlite cannot add a primary key.
+        The ids are the rowids the reviews were keyed on, the triggers on cards
+        are dropped first so that the copy leaves deck_stats and reviews untouched,
+        the schema script recreates them and the index.
+        """
+        for trigger in (
+            "deck_stats_on_card_insert",
+            "deck_stats_on_card_delete",
+            "reviews_on_card_insert",
+            "reviews_on_card_delete",
+        ):
+            conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        conn.execute(
+            """
+            CREATE TABLE cards_with_id (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                deck_id TEXT NOT NULL,
+                question TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                FOREIGN KEY(deck_id) REFERENCES decks(id) ON DELETE CASCADE
+            )
+            """
+        )
+        conn.execute(
+            """
+            INSERT INTO cards_with_id (id, deck_id, question, answer)
+            SELECT rowid, deck_id, question, answer FROM cards ORDER BY rowid
+            """
+        )
+        conn.execute("DROP TABLE cards")
+        conn.execute("ALTER TABLE cards_with_id RENAME TO cards")
+
+    def _load_current_dictionary(self) -> None:
+        with self._database.connect() as conn:
+            row = conn.execute(
+                "SELECT id, data FROM compression_dictionaries ORDER BY id DESC LIMIT 1"
+            ).fetchone()
+        if row is not None:
+            self._database.codec.use_dictionary(row["id"], row["data"])
+
+    def train_compression_dictionary(
+        self, samples: int = 1000, size: int = 32 * 1024
+    ) -> int | None:
+        """
+        Train a dictionary on a random sample of the stored answers and use it
+        for the answers written from now on, existing answers are not rewritten.
+        Return the id of the dictionary, None when there is nothing to train on.
+        """
+        minimum = self._config.compress_threshold or 0
+        with self._database.connect() as conn:
+            rows = conn.execute(
+                f"""
+                SELECT {_ANSWER_SQL} AS answer FROM cards
+                WHERE typeof(answer) = 'blob' OR length(answer) >= ?
+                ORDER BY random() LIMIT ?
+                """,
+                (minimum, samples),
+            ).fetchall()
+        dictionary = train_dictionary((row["answer"] for row in rows), size)
+        if not dictionary:
+            return None
+        dictionary_id = self._database.write(
+            lambda conn: conn.execute(
+                f"INSERT INTO compression_dictionaries (data, created_at) VALUES (?, {_SQL_NOW})",
+                (dictionary,),
+            ).lastrowid
+        )
+        self._database.codec.use_dictionary(dictionary_id, dictionary)
+        return dictionary_id
+
+    def compression_report(self) -> CompressionReport:
+        """Scan the answers of all decks and report how much compression saves."""
+        plain_size = AnswerCodec.plain_size
+        answers = compressed = plain_bytes = stored_bytes = 0
+        with self._database.connect() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            cursor.execute("SELECT answer FROM cards")
+            while rows := cursor.fetchmany(CHUNK_SIZE):
+                for (value,) in rows:
+                    answers += 1
+                    plain_bytes += plain_size(value)
+                    if isinstance(value, bytes):
+                        compressed += 1
+                        stored_bytes += len(value)
+                    else:
+                        stored_bytes += len(value.encode("utf-8"))
+        return CompressionReport(answers, compressed, plain_bytes, stored_bytes)
+
     def _deck_exists(self, conn: sqlite3.Connection, deck_id: str) -> bool:
         cursor = conn.execute("SELECT 1 FROM decks WHERE id = ?", (deck_id,))
         return cursor.fetchone() is not None
@@ -168,17 +816,17 @@ class SqlDeckService(DeckService):
         return SqlDeck(
             deck_id=deck_row["id"],
             name=deck_row["name"],
-            connection_factory=self._new_connection,
+            database=self._database,
         )
 
     def decks(self) -> Iterator[Deck]:
-        with self._connect() as conn:
+        with self._database.connect() as conn:
             rows = conn.execute("SELECT id, name FROM decks ORDER BY name").fetchall()
         for row in rows:
             yield self._row_to_deck(row)
 
     def get_deck(self, id: str) -> Deck | None:
-        with self._connect() as conn:
+        with self._database.connect() as conn:
             row = conn.execute(
                 "SELECT id, name FROM decks WHERE id = ?", (id,)
             ).fetchone()
@@ -187,39 +835,112 @@ class SqlDeckService(DeckService):
         return self._row_to_deck(row)
 
     def add_deck(self, deck: Deck):
-        with self._connect() as conn:
+        def operation(conn: sqlite3.Connection) -> None:
             if self._deck_exists(conn, deck.id()):
                 return
             conn.execute(
                 "INSERT INTO decks (id, name) VALUES (?, ?)",
                 (deck.id(), deck.name()),
             )
-            cards = list(deck)
-            if cards:
+            encode = self._database.codec.encode
+            for chunk in batched(deck, CHUNK_SIZE):
                 conn.executemany(
                     "INSERT INTO cards (deck_id, question, answer) VALUES (?, ?, ?)",
-                    [
-                        (deck.id(), card.question, card.answer)
-                        for card in cards
-                    ],
+                    [(deck.id(), card.question, encode(card.answer)) for card in chunk],
                 )
-            conn.commit()
+
+        self._database.write(operation)
 
     def create_deck(self, name: str) -> Deck | None:
         """Create a deck unless it already exists."""
         deck_name = name.strip()
         digest = sha256(deck_name.encode("utf-8")).hexdigest()
-        with self._connect() as conn:
+
+        def operation(conn: sqlite3.Connection) -> bool:
             if self._deck_exists(conn, digest):
-                return None
+                return False
             conn.execute(
                 "INSERT INTO decks (id, name) VALUES (?, ?)",
                 (digest, deck_name),
             )
-            conn.commit()
-        return SqlDeck(digest, deck_name, self._new_connection)
+            return True
+
+        if not self._database.write(operation):
+            return None
+        return SqlDeck(digest, deck_name, self._database)
 
     def remove_deck(self, id: str):
-        with self._connect() as conn:
-            conn.execute("DELETE FROM decks WHERE id = ?", (id,))
-            conn.commit()
+        self._database.write(
+            lambda conn: conn.execute("DELETE FROM decks WHERE id = ?", (id,))
+        )
+
+
+class SqlReviewService(ReviewService):
+    """
+    Review states stored in the reviews table, next to the cards.
+    Triggers add a due review for every inserted card and drop it with the card,
+    the (deck_id, due) index answers the next due card in O(log n).
+    Cards are identified by cards.id.
+    Obtained through SqlDeckService.review_service.
+    """
+
+    def __init__(self, database: SqlDatabase) -> None:
+        self._database = database
+
+    def next_due(self, deck_id: str, now: float | None = None) -> ReviewState | None:
+        now = time.time() if now is None else now
+        with self._database.connect() as conn:
+            row = conn.execute(
+                f"""
+                SELECT reviews.card_id, reviews.due, reviews.interval, reviews.ease,
+                    reviews.repetitions, cards.question, {_ANSWER_SQL} AS answer
+                FROM reviews JOIN cards ON cards.id = reviews.card_id
+                WHERE reviews.deck_id = ? AND reviews.due <= ?
+                ORDER BY reviews.due
+                LIMIT 1
+                """,
+                (deck_id, now),
+            ).fetchone()
+        if row is None:
+            return None
+        return _row_to_review(row)
+
+    def grade(
+        self, deck_id: str, card_id: int, grade: int, now: float | None = None
+    ) -> ReviewState:
+        now = time.time() if now is None else now
+
+        def operation(conn: sqlite3.Connection) -> ReviewState:
+            row = conn.execute(
+                f"""
+                SELECT reviews.card_id, reviews.due, reviews.interval, reviews.ease,
+                    reviews.repetitions, cards.question, {_ANSWER_SQL} AS answer
+                FROM reviews JOIN cards ON cards.id = reviews.card_id
+                WHERE reviews.card_id = ? AND reviews.deck_id = ?
+                """,
+                (card_id, deck_id),
+            ).fetchone()
+            if row is None:
+                raise LookupError(f"Card {card_id} is not in deck '{deck_id}'.")
+            reviewed = sm2(_row_to_review(row), grade, now)
+            conn.execute(
+                """
+                UPDATE reviews SET due = ?, interval = ?, ease = ?, repetitions = ?
+                WHERE card_id = ?
+                """,
+                (reviewed.due, reviewed.interval, reviewed.ease, reviewed.repetitions, card_id),
+            )
+            return reviewed
+
+        return self._database.write(operation)
+
+
+def _row_to_review(row: sqlite3.Row) -> ReviewState:
+    return ReviewState(
+        card_id=row["card_id"],
+        card=Card(row["question"], row["answer"]),
+        due=row["due"],
+        interval=row["interval"],
+        ease=row["ease"],
+        repetitions=row["repetitions"],
+    )
@@ -0,0 +1,228 @@
+"""
+Warm-up of the generated card buffers after a restart.
+
+SpecUsage ranks the (theme, instructions) pairs used for generation by
+frecency, a use count decaying with a half-life, and is saved to a json file.
+At startup warm_up asks the generator to prepare the first batch of the top
+specs, at background priority and within the budget of WarmupConfig, so
+the first users of the common specs do not pay the cold generation latency.
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Self
+
+from dotenv import load_dotenv
+from starlette.concurrency import run_in_threadpool
+
+from anki_scroll.lm_scheduler import Priority, lm_priority
+from anki_scroll.metrics import REGISTRY
+from anki_scroll.services import CardGenerator
+
+_WARMED = REGISTRY.counter(
+    "anki_scroll_warmup_specs_total",
+    "Specs prepared by the startup warm-up, by outcome.",
+    ("outcome",),
+)
+
+# format of the usage file
+_VERSION = 1
+# seconds after which a use counts for half
+DEFAULT_HALF_LIFE = 7 * 24 * 3600.0
+# specs remembered, the least used are forgotten
+DEFAULT_MAX_TRACKED = 200
+
+
+@dataclass(slots=True)
+class WarmupConfig:
+    """Where the usage is saved and the budget of the warm-up, no path disables it."""
+
+    path: str | None = None
+    # specs prepared at startup, the most used first
+    max_specs: int = 10
+    # generations running at once during the warm-up
+    max_concurrency: int = 2
+    # seconds after which the warm-up gives up on the remaining specs
+    timeout: float = 300.0
+    # seconds between two saves of the usage
+    save_interval: float = 60.0
+    half_life: float = DEFAULT_HALF_LIFE
+    max_tracked: int = DEFAULT_MAX_TRACKED
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None
+
+    @classmethod
+    def load(cls) -> Self:
+        """
+        Load configuration from the environment.
+        ANKI_SCROLL_WARMUP_PATH enables the warm-up, ANKI_SCROLL_WARMUP_MAX_SPECS
+        and ANKI_SCROLL_WARMUP_MAX_CONCURRENCY override the budget.
+        """
+        load_dotenv()
+        config = cls(path=os.environ.get("ANKI_SCROLL_WARMUP_PATH") or None)
+        max_specs = os.environ.get("ANKI_SCROLL_WARMUP_MAX_SPECS")
+        if max_specs:
+            config.max_specs = int(max_specs)
+        max_concurrency = os.environ.get("ANKI_SCROLL_WARMUP_MAX_CONCURRENCY")
+        if max_concurrency:
+            config.max_concurrency = int(max_concurrency)
+        return config
+
+
+@dataclass(slots=True)
+class _Usage:
+    score: float
+    last_used: float
+
+
+class SpecUsage:
+    """Frecency of the specs used for generation, safe to use from several threads."""
+
+    def __init__(
+        self, half_life: float = DEFAULT_HALF_LIFE, max_tracked: int = DEFAULT_MAX_TRACKED
+    ) -> None:
+        self._half_life = half_life
+        self._max_tracked = max_tracked
+        self._usage: dict[tuple[str, str], _Usage] = {}
+        self._lock = threading.Lock()
+        # records so far, and when the last successful save took its snapshot
+        self._changes = 0
+        self._saved_changes = 0
+        # saves of the process replace the file in snapshot order
+        self._save_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._usage)
+
+    def _score(self, usage: _Usage, now: float) -> float:
+        return usage.score * math.exp2(-(now - usage.last_used) / self._half_life)
+
+    def record(self, theme: str, instructions: str, now: float | None = None) -> None:
+        now = time.time() if now is None else now
+        key = (theme, instructions)
+        with self._lock:
+            usage = self._usage.get(key)
+            if usage is None:
+                self._usage[key] = _Usage(score=1.0, last_used=now)
+                if len(self._usage) > self._max_tracked:
+                    coldest = min(self._usage, key=lambda k: self._score(self._usage[k], now))
+                    del self._usage[coldest]
+            else:
+                usage.score = self._score(usage, now) + 1.0
+                usage.last_used = now
+            self._changes += 1
+
+    def top(self, n: int, now: float | None = None) -> list[tuple[str, str]]:
+        """the n most used specs as (theme, instructions), the most used first"""
+        now = time.time() if now is None else now
+        with self._lock:
+            ranked = sorted(
+                self._usage.items(), key=lambda item: self._score(item[1], now), reverse=True
+            )
+        return [key for key, _ in ranked[:n]]
+
+    def save(self, path: str | Path) -> bool:
+        """
+        Write the usage if it changed, atomically. Return whether it was written.
+        When the write fails the error is raised and the usage stays unsaved.
+        """
+        with self._save_lock:
+            with self._lock:
+                changes = self._changes
+                if changes == self._saved_changes:
+                    return False
+                specs = [
+                    {
+                        "theme": theme,
+                        "instructions": instructions,
+                        "score": usage.score,
+                        "last_used": usage.last_used,
+                    }
+                    for (theme, instructions), usage in self._usage.items()
+                ]
+            path = Path(path)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # a temporary file of our own, other processes may save the same path
+            temporary = tempfile.NamedTemporaryFile(
+                "w", dir=path.parent, prefix=path.name + ".", suffix=".tmp", delete=False
+            )
+            try:
+                with temporary:
+                    temporary.write(json.dumps({"version": _VERSION, "specs": specs}))
+                os.replace(temporary.name, path)
+            except BaseException:
+                with contextlib.suppress(OSError):
+                    os.unlink(temporary.name)
+                raise
+            with self._lock:
+                self._saved_changes = changes
+        return True
+
+    @classmethod
+    def load(
+        cls,
+        path: str | Path,
+        half_life: float = DEFAULT_HALF_LIFE,
+        max_tracked: int = DEFAULT_MAX_TRACKED,
+    ) -> SpecUsage:
+        """Usage saved at path, empty if the file is missing or unreadable."""
+        usage = cls(half_life=half_life, max_tracked=max_tracked)
+        try:
+            data = json.loads(Path(path).read_text())
+        except (OSError, ValueError):
+            return usage
+        if not isinstance(data, dict) or data.get("version") != _VERSION:
+            return usage
+        for spec in data.get("specs", []):
+            try:
+                key = (str(spec["theme"]), str(spec["instructions"]))
+                usage._usage[key] = _Usage(
+                    score=float(spec["score"]), last_used=float(spec["last_used"])
+                )
+            except (KeyError, TypeError, ValueError):
+                continue
+        return usage
+
+
+async def warm_up(generator: CardGenerator, usage: SpecUsage, config: WarmupConfig) -> int:
+    """
+    Prepare the top specs with CardGenerator.warm_up, at background priority.
+    Failures are counted in the metrics and skipped. Return the specs prepared.
+    """
+    semaphore = asyncio.Semaphore(config.max_concurrency)
+
+    async def prepare(theme: str, instructions: str) -> bool:
+        async with semaphore:
+            try:
+                # the priority is copied to the worker thread with the context
+                with lm_priority(Priority.BACKGROUND):
+                    await run_in_threadpool(generator.warm_up, theme, instructions)
+            except Exception:
+                _WARMED.labels("failed").inc()
+                return False
+        _WARMED.labels("warmed").inc()
+        return True
+
+    tasks = [
+        asyncio.create_task(prepare(theme, instructions))
+        for theme, instructions in usage.top(config.max_specs)
+    ]
+    if not tasks:
+        return 0
+    done, pending = await asyncio.wait(tasks, timeout=config.timeout)
+    for task in pending:
+        # a generation already running in a thread still completes
+        task.cancel()
+        _WARMED.labels("timed_out").inc()
+    return sum(1 for task in done if task.result())
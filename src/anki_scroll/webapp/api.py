@@ -0,0 +1,161 @@
+"""
+Versioned JSON API for headless clients, mounted under /api/v1.
+
+Candidates for a spec are fetched k at a time, and selections or deletions
+are committed in one call through the batched Deck operations.
+"""
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from fastapi import APIRouter, HTTPException, Query, Request
+from pydantic import BaseModel, Field
+
+from anki_scroll.services import AsyncDeck, Card
+
+if TYPE_CHECKING:
+    from anki_scroll.webapp.app import WebState
+
+# cards accepted by a single batch request
+MAX_BATCH = 1000
+# candidates returned by a single request
+MAX_CANDIDATES = 20
+
+
+class CardModel(BaseModel):
+    question: str
+    answer: str
+
+
+class CardBatch(BaseModel):
+    cards: list[CardModel] = Field(max_length=MAX_BATCH)
+
+
+class DeckModel(BaseModel):
+    id: str
+    name: str
+    count: int
+    version: int
+
+
+class NewDeck(BaseModel):
+    name: str = Field(min_length=1)
+
+
+class NewSpec(BaseModel):
+    theme: str = ""
+    instructions: str = ""
+
+
+class SpecModel(BaseModel):
+    id: str
+    deck_id: str
+    theme: str
+    instructions: str
+
+
+class BatchResult(BaseModel):
+    # cards added or removed
+    count: int
+    # version of the deck after the batch
+    version: int
+
+
+router = APIRouter(prefix="/api/v1", tags=["api"])
+
+
+def _state(request: Request) -> WebState:
+    return request.app.state.web_state
+
+
+async def _deck_or_404(state: WebState, deck_id: str) -> AsyncDeck:
+    deck = await state.async_deck_service.get_deck(deck_id)
+    if deck is None:
+        raise HTTPException(status_code=404, detail="Deck not found")
+    return deck
+
+
+async def _deck_model(deck: AsyncDeck) -> DeckModel:
+    stats = await deck.stats()
+    return DeckModel(id=deck.id(), name=deck.name(), count=stats.count, version=stats.version)
+
+
+def _cards(batch: CardBatch) -> list[Card]:
+    return [Card(question=card.question, answer=card.answer) for card in batch.cards]
+
+
+@router.get("/decks")
+async def list_decks(request: Request) -> list[DeckModel]:
+    decks = await _state(request).async_deck_service.decks()
+    return [await _deck_model(deck) for deck in decks]
+
+
+@router.post("/decks", status_code=201)
+async def create_deck(request: Request, body: NewDeck) -> DeckModel:
+    deck = await _state(request).async_deck_service.create_deck(body.name.strip())
+    if deck is None:
+        raise HTTPException(status_code=409, detail="Deck already exists")
+    return await _deck_model(deck)
+
+
+@router.get("/decks/{deck_id}")
+async def get_deck(request: Request, deck_id: str) -> DeckModel:
+    return await _deck_model(await _deck_or_404(_state(request), deck_id))
+
+
+@router.delete("/decks/{deck_id}", status_code=204)
+async def remove_deck(request: Request, deck_id: str) -> None:
+    state = _state(request)
+    await _deck_or_404(state, deck_id)
+    await state.remove_deck(deck_id)
+
+
+@router.get("/decks/{deck_id}/cards")
+async def list_cards(request: Request, deck_id: str) -> list[CardModel]:
+    deck = await _deck_or_404(_state(request), deck_id)
+    return [CardModel(question=card.question, answer=card.answer) for card in await deck.cards()]
+
+
+@router.post("/decks/{deck_id}/cards")
+async def add_cards(request: Request, deck_id: str, batch: CardBatch) -> BatchResult:
+    """Add the selected cards to the deck."""
+    state = _state(request)
+    deck = await _deck_or_404(state, deck_id)
+    added = await state.select(deck, _cards(batch))
+    return BatchResult(count=added, version=(await deck.stats()).version)
+
+
+@router.post("/decks/{deck_id}/cards/delete")
+async def delete_cards(request: Request, deck_id: str, batch: CardBatch) -> BatchResult:
+    """Remove one copy of each card, cards missing from the deck are ignored."""
+    deck = await _deck_or_404(_state(request), deck_id)
+    removed = await deck.remove_many(_cards(batch))
+    return BatchResult(count=removed, version=(await deck.stats()).version)
+
+
+@router.post("/decks/{deck_id}/specs", status_code=201)
+async def create_spec(request: Request, deck_id: str, body: NewSpec) -> SpecModel:
+    state = _state(request)
+    await _deck_or_404(state, deck_id)
+    spec = state.save_spec(deck_id, body.theme, body.instructions)
+    return SpecModel(
+        id=spec.id, deck_id=spec.deck_id, theme=spec.theme, instructions=spec.instructions
+    )
+
+
+@router.get("/decks/{deck_id}/specs/{spec_id}/candidates")
+async def candidates(
+    request: Request,
+    deck_id: str,
+    spec_id: str,
+    k: int = Query(5, ge=1, le=MAX_CANDIDATES),
+) -> list[CardModel]:
+    """k generated cards for the spec, near duplicates of the deck are skipped."""
+    state = _state(request)
+    deck = await _deck_or_404(state, deck_id)
+    spec = state.get_spec(spec_id)
+    if spec is None or spec.deck_id != deck_id:
+        raise HTTPException(status_code=404, detail="Spec not found")
+    await state.sync_duplicate_filter(deck)
+    cards = [await state.next_card(deck_id, spec) for _ in range(k)]
+    return [CardModel(question=card.question, answer=card.answer) for card in cards]
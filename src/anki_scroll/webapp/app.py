@@ -1,65 +1,270 @@
-"""FastAPI web application for Anki Scroll mock UI."""
+"""
+FastAPI web application for Anki Scroll mock UI.
+
+Nothing is initialized at import time: `app` is built on first access and
+the services of WebState (database, llm, network) are created on first use.
+Run with `uvicorn anki_scroll.webapp.app:app`, or
+`uvicorn --factory anki_scroll.webapp.app:build_app` for a fresh application.
+"""
 from __future__ import annotations
 
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from email.utils import formatdate
+from functools import cache
+from hashlib import sha256
 from pathlib import Path
-from typing import Dict, Optional
+from typing import TYPE_CHECKING, Dict, Hashable, Optional
 
-from fastapi import FastAPI, Form, HTTPException, Request
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi import FastAPI, Form, HTTPException, Request, Response, WebSocket
+from fastapi.responses import HTMLResponse, PlainTextResponse, RedirectResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+from starlette.concurrency import run_in_threadpool
 
+from anki_scroll.async_service import ThreadedDeckService
+from anki_scroll.lm_scheduler import SchedulerOverloaded
+from anki_scroll.metrics import REGISTRY
 from anki_scroll.services import (
+    AsyncDeck,
+    AsyncDeckService,
     Card,
     CardGenerator,
     CardSpec,
     CardSpecService,
-    Deck,
     DeckService,
+    ReviewService,
 )
+from anki_scroll.scheduling import AGAIN, EASY, GOOD, HARD
+from anki_scroll.caching_service import CachingDeckService
 from anki_scroll.simple_services import (
     SimpleCardGenerator,
     SimpleCardSpecService,
     SimpleDeckService,
+    SimpleReviewService,
 )
 from anki_scroll.sql_service import (
     SqlDeckService
 )
-from anki_scroll.service.card_generation import LLMCardGeneration
+from anki_scroll.warmup import SpecUsage, WarmupConfig, warm_up
+from anki_scroll.webapp import api
+from anki_scroll.webapp.feed import CardFeed
+from anki_scroll.webapp.instrumentation import MetricsMiddleware, TimedTemplate
+from anki_scroll.webapp.profiling import (
+    ProfilingConfig,
+    ProfilingMiddleware,
+    build_admin_router,
+)
+
+if TYPE_CHECKING:
+    # numpy and dspy are only imported when the services are created
+    from anki_scroll.service.dedup import NearDuplicateFilter
 
 
+_logger = logging.getLogger(__name__)
+
 TEMPLATES_DIR = Path(__file__).with_name("templates")
 STATIC_DIR = Path(__file__).with_name("static")
 templates = Jinja2Templates(directory=str(TEMPLATES_DIR))
+templates.env.template_class = TimedTemplate
 
 DEFAULT_DECK_NAME = "Explorer Deck"
 
+# generated cards tried before showing a near duplicate anyway
+MAX_GENERATION_ATTEMPTS = 5
+
+# seconds the cache trusts the database before asking it again, the writes of
+# the other workers show up that late at most
+SHARED_CACHE_MAX_STALENESS = 1.0
+
+
+def _etag(*parts: object) -> str:
+    """Build a strong ETag from the parts identifying a representation."""
+    digest = sha256("|".join(str(part) for part in parts).encode("utf-8"))
+    return f'"{digest.hexdigest()[:32]}"'
+
+
+def _not_modified(request: Request, etag: str) -> bool:
+    """Check the If-None-Match header of the request against an ETag."""
+    header = request.headers.get("if-none-match")
+    if header is None:
+        return False
+    candidates = {candidate.strip() for candidate in header.split(",")}
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def _cache_headers(etag: str, modified_at: float) -> Dict[str, str]:
+    return {
+        "ETag": etag,
+        "Last-Modified": formatdate(modified_at, usegmt=True),
+        "Cache-Control": "no-cache",
+    }
+
 
-def _find_deck_by_name(deck_service: DeckService, deck_name: str) -> Deck | None:
-    """Locate a deck by its name, ignoring surrounding whitespace."""
-    normalized = deck_name.strip()
-    for deck in deck_service.decks():
-        if deck.name() == normalized:
-            return deck
-    return None
+class RenderCache:
+    """
+    Small LRU cache of rendered pages.
+    Keys must contain the incarnation and version of the decks used to render
+    the page, entries for older versions are then simply evicted over time.
+    Pages of a single deck are keyed ("deck", deck_id, ...) so that they can
+    be dropped with the deck.
+    """
+
+    def __init__(self, max_entries: int = 128) -> None:
+        self._max_entries = max_entries
+        self._entries: OrderedDict[Hashable, str] = OrderedDict()
+
+    def get(self, key: Hashable) -> str | None:
+        body = self._entries.get(key)
+        if body is not None:
+            self._entries.move_to_end(key)
+        return body
+
+    def put(self, key: Hashable, body: str) -> None:
+        self._entries[key] = body
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def discard_deck(self, deck_id: str) -> None:
+        """Drop the pages of a removed deck."""
+        for key in [key for key in self._entries if key[:2] == ("deck", deck_id)]:
+            del self._entries[key]
 
 
 class WebState:
-    """Hold in-memory data for the demo web app."""
+    """
+    Hold in-memory data for the demo web app.
+    Services not given to the constructor are created on first access.
+    """
 
     def __init__(
         self,
         deck_service: Optional[DeckService] = None,
         card_spec_service: Optional[CardSpecService] = None,
         card_generator: Optional[CardGenerator] = None,
+        async_deck_service: Optional[AsyncDeckService] = None,
+        duplicate_filter: Optional[NearDuplicateFilter] = None,
+        review_service: Optional[ReviewService] = None,
+        warmup_config: Optional[WarmupConfig] = None,
     ) -> None:
-        self.deck_service = deck_service or SqlDeckService()
+        """
+        The routes use async_deck_service, by default it runs deck_service
+        on dedicated threads so that storage never blocks the event loop.
+        Reviews are stored with the cards by default, in memory when only
+        deck_service is given.
+        The usage of the specs is only saved, and the buffers warmed up at
+        startup, when warmup_config (loaded from the environment by default) has a path.
+        """
+        self._lock = threading.RLock()
+        self._deck_service = deck_service
+        self._review_service = review_service
+        self._async_deck_service = async_deck_service
+        # the threads of a service created here are stopped by close
+        self._owns_async_deck_service = False
+        self._storage_ready = False
+        self._card_generator = card_generator
+        self._duplicate_filter = duplicate_filter
+        self._spec_usage: SpecUsage | None = None
+        self.warmup_config = warmup_config or WarmupConfig.load()
         self.card_spec_service = card_spec_service or SimpleCardSpecService()
-        self.card_generator = card_generator or LLMCardGeneration()
-        self._bootstrap()
+        self.render_cache = RenderCache()
+
+    @property
+    def deck_service(self) -> DeckService:
+        self._ensure_storage()
+        return self._deck_service
+
+    @property
+    def review_service(self) -> ReviewService:
+        self._ensure_storage()
+        return self._review_service
+
+    @property
+    def async_deck_service(self) -> AsyncDeckService:
+        self._ensure_storage()
+        return self._async_deck_service
+
+    @property
+    def card_generator(self) -> CardGenerator:
+        if self._card_generator is None:
+            with self._lock:
+                if self._card_generator is None:
+                    from anki_scroll.service.card_generation import LLMCardGeneration
+
+                    self._card_generator = LLMCardGeneration()
+        return self._card_generator
+
+    @property
+    def duplicate_filter(self) -> NearDuplicateFilter:
+        if self._duplicate_filter is None:
+            with self._lock:
+                if self._duplicate_filter is None:
+                    from anki_scroll.service.dedup import NearDuplicateFilter
+
+                    self._duplicate_filter = NearDuplicateFilter()
+        return self._duplicate_filter
+
+    @property
+    def spec_usage(self) -> SpecUsage:
+        if self._spec_usage is None:
+            with self._lock:
+                if self._spec_usage is None:
+                    config = self.warmup_config
+                    if config.enabled:
+                        self._spec_usage = SpecUsage.load(
+                            config.path, config.half_life, config.max_tracked
+                        )
+                    else:
+                        self._spec_usage = SpecUsage(config.half_life, config.max_tracked)
+        return self._spec_usage
+
+    def initialize(self) -> None:
+        """Create every service now, to fail at startup rather than on the first request."""
+        self._ensure_storage()
+        self.card_generator
+        self.duplicate_filter
+
+    def _ensure_storage(self) -> None:
+        if self._storage_ready:
+            return
+        with self._lock:
+            if self._storage_ready:
+                return
+            if self._deck_service is None:
+                sql_service = SqlDeckService()
+                # workers share the database, cached cards are checked against its versions
+                self._deck_service = CachingDeckService(
+                    sql_service, shared=True, max_staleness=SHARED_CACHE_MAX_STALENESS
+                )
+                self._review_service = self._review_service or sql_service.review_service()
+            if self._review_service is None:
+                self._review_service = SimpleReviewService(self._deck_service)
+            if self._async_deck_service is None:
+                self._async_deck_service = ThreadedDeckService(self._deck_service)
+                self._owns_async_deck_service = True
+            self._bootstrap()
+            self._storage_ready = True
+
+    def close(self) -> None:
+        """
+        Stop the threads of the async deck service created by the state,
+        once their pending operations are done. A later access creates a new one.
+        """
+        with self._lock:
+            if not self._owns_async_deck_service:
+                return
+            service = self._async_deck_service
+            self._async_deck_service = None
+            self._owns_async_deck_service = False
+            self._storage_ready = False
+        service.close()
 
     def _bootstrap(self) -> None:
-        deck = self.deck_service.create_deck(DEFAULT_DECK_NAME)
+        deck = self._deck_service.create_deck(DEFAULT_DECK_NAME)
         if deck is None:
             return
         deck.add(Card(question="What is spaced repetition?", answer="A study technique."))
@@ -80,67 +285,187 @@ class WebState:
         spec = self.card_spec_service.get(spec_id)
         return spec
 
+    async def sync_duplicate_filter(self, deck: AsyncDeck) -> None:
+        """Index the cards of the deck if it changed since the last generation."""
+        stats = await deck.stats()
+        if self.duplicate_filter.needs_sync(deck.id(), stats.version):
+            cards = await deck.cards()
+            # hashing a large deck would block the event loop
+            await run_in_threadpool(
+                self.duplicate_filter.sync, deck.id(), stats.version, cards
+            )
+
+    async def next_card(self, deck_id: str, spec: CardSpec) -> Card:
+        """Generate a card for the spec, skipping near duplicates when possible."""
+        self.spec_usage.record(spec.theme, spec.instructions)
+        for _ in range(MAX_GENERATION_ATTEMPTS):
+            card = await run_in_threadpool(
+                self.card_generator.create_card, spec.theme, spec.instructions
+            )
+            if not self.duplicate_filter.is_duplicate(deck_id, card):
+                break
+        self.duplicate_filter.served(deck_id, card)
+        return card
+
+    async def warm_up(self) -> int:
+        """Prepare the cards of the most used specs, see anki_scroll.warmup."""
+        # loading the usage and the generator reads files and imports dspy
+        usage = await run_in_threadpool(lambda: self.spec_usage)
+        generator = await run_in_threadpool(lambda: self.card_generator)
+        return await warm_up(generator, usage, self.warmup_config)
+
+    def save_spec_usage(self) -> None:
+        if self.warmup_config.enabled and self._spec_usage is not None:
+            self._spec_usage.save(self.warmup_config.path)
+
+    async def save_spec_usage_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.warmup_config.save_interval)
+            try:
+                await run_in_threadpool(self.save_spec_usage)
+            except Exception:
+                # kept unsaved, the next save retries
+                _logger.exception("saving the spec usage to %s failed", self.warmup_config.path)
 
-def build_app(state: Optional[WebState] = None) -> FastAPI:
-    app = FastAPI(title="Anki Scroll Web")
+    async def remove_deck(self, deck_id: str) -> None:
+        await self.async_deck_service.remove_deck(deck_id)
+        self.render_cache.discard_deck(deck_id)
+        # a deck created again under the same name restarts its version
+        self.duplicate_filter.forget(deck_id)
+
+    async def select(self, deck: AsyncDeck, cards: list[Card]) -> int:
+        """Add the cards chosen by the user to the deck."""
+        added = await deck.add_many(cards)
+        stats = await deck.stats()
+        self.duplicate_filter.added(deck.id(), cards, stats.version)
+        return added
+
+
+def build_app(
+    state: Optional[WebState] = None,
+    eager: bool = False,
+    profiling: Optional[ProfilingConfig] = None,
+) -> FastAPI:
+    """
+    Build the application, cheap unless eager is set.
+    :param eager: create the services when the server starts instead of on the first request
+    :param profiling: loaded from the environment by default, disabled unless configured
+    """
+    state = state or WebState()
+    profiling = profiling or ProfilingConfig.load()
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        if eager:
+            await run_in_threadpool(state.initialize)
+        background = []
+        if state.warmup_config.enabled:
+            # startup does not wait for the warm-up
+            background.append(asyncio.create_task(state.warm_up()))
+            background.append(asyncio.create_task(state.save_spec_usage_periodically()))
+        yield
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+        await run_in_threadpool(state.save_spec_usage)
+        await run_in_threadpool(state.close)
+
+    app = FastAPI(title="Anki Scroll Web", lifespan=lifespan)
+    app.add_middleware(MetricsMiddleware)
+    if profiling.enabled:
+        # not installed at all when disabled
+        app.add_middleware(ProfilingMiddleware, config=profiling)
+        app.include_router(build_admin_router(profiling))
     app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
-    app.state.web_state = state or WebState()
+    app.state.web_state = state
+    app.include_router(api.router)
 
     def _get_state(request: Request) -> WebState:
         return request.app.state.web_state
 
-    def _get_deck_or_404(state: WebState, deck_id: str) -> Deck:
-        deck = state.deck_service.get_deck(deck_id)
+    @app.exception_handler(SchedulerOverloaded)
+    async def overloaded(request: Request, error: SchedulerOverloaded) -> PlainTextResponse:
+        # the generation was rejected instead of queued, the client can retry
+        return PlainTextResponse(str(error), status_code=503, headers={"Retry-After": "5"})
+
+    async def _get_deck_or_404(state: WebState, deck_id: str) -> AsyncDeck:
+        deck = await state.async_deck_service.get_deck(deck_id)
         if deck is None:
             raise HTTPException(status_code=404, detail="Deck not found")
         return deck
-    
+
+    @app.get("/metrics", response_class=PlainTextResponse)
+    async def metrics() -> PlainTextResponse:
+        return PlainTextResponse(
+            REGISTRY.render(), media_type="text/plain; version=0.0.4"
+        )
+
     @app.get("/")
     async def index(request: Request) -> RedirectResponse:
         return RedirectResponse(url=f"/home/", status_code=303)
 
     @app.get("/home/", response_class=HTMLResponse)
-    async def home(request: Request) -> HTMLResponse:
+    async def home(request: Request) -> Response:
         state = _get_state(request)
         decks = []
-        for deck in state.deck_service.decks():
-            cards = list(deck)
+        modified_at = 0.0
+        listing = await state.async_deck_service.decks()
+        all_stats = await asyncio.gather(*(deck.stats() for deck in listing))
+        for deck, stats in zip(listing, all_stats):
+            modified_at = max(modified_at, stats.modified_at)
             decks.append(
                 {
                     "id": deck.id(),
                     "name": deck.name(),
-                    "count": len(cards),
+                    "count": stats.count,
+                    "version": stats.version,
+                    "incarnation": stats.incarnation,
                 }
             )
-        return templates.TemplateResponse(
-            request,
-            "home.html",
-            {"decks": decks},
+        etag = _etag(
+            "home", *((deck["id"], deck["incarnation"], deck["version"]) for deck in decks)
         )
+        headers = _cache_headers(etag, modified_at)
+        if _not_modified(request, etag):
+            return Response(status_code=304, headers=headers)
+        key = ("home", etag, str(request.base_url))
+        body = state.render_cache.get(key)
+        if body is None:
+            body = templates.get_template("home.html").render(
+                request=request, decks=decks
+            )
+            state.render_cache.put(key, body)
+        return HTMLResponse(body, headers=headers)
 
     @app.post("/home/new-deck")
     async def create_deck(request: Request, name: str = Form(...)) -> RedirectResponse:
         state = _get_state(request)
         deck_name = name.strip()
-        target = state.deck_service.create_deck(deck_name)
+        target = await state.async_deck_service.create_deck(deck_name)
         if target is None:
             raise HTTPException(status_code=403, detail="Deck already exists")
         return RedirectResponse(url=f"/deck/{target.id()}", status_code=303)
 
     @app.get("/deck/{deck_id}", response_class=HTMLResponse)
-    async def deck_view(request: Request, deck_id: str) -> HTMLResponse:
+    async def deck_view(request: Request, deck_id: str) -> Response:
         state = _get_state(request)
-        deck = _get_deck_or_404(state, deck_id)
-        cards = list(deck)
-        return templates.TemplateResponse(
-            request,
-            "deck.html",
-            {
-                "deck_id": deck_id,
-                "deck_name": deck.name(),
-                "cards": cards,
-            },
-        )
+        deck = await _get_deck_or_404(state, deck_id)
+        stats = await deck.stats()
+        etag = _etag("deck", deck_id, stats.incarnation, stats.version)
+        headers = _cache_headers(etag, stats.modified_at)
+        if _not_modified(request, etag):
+            return Response(status_code=304, headers=headers)
+        key = ("deck", deck_id, stats.incarnation, stats.version, str(request.base_url))
+        body = state.render_cache.get(key)
+        if body is None:
+            body = templates.get_template("deck.html").render(
+                request=request,
+                deck_id=deck_id,
+                deck_name=deck.name(),
+                cards=await deck.cards(),
+            )
+            state.render_cache.put(key, body)
+        return HTMLResponse(body, headers=headers)
 
     @app.post("/deck/{deck_id}/cards/delete")
     async def delete_card(
@@ -150,13 +475,51 @@ def build_app(state: Optional[WebState] = None) -> FastAPI:
         answer: str = Form(...),
     ) -> RedirectResponse:
         state = _get_state(request)
-        deck = _get_deck_or_404(state, deck_id)
+        deck = await _get_deck_or_404(state, deck_id)
         try:
-            deck.remove(Card(question=question, answer=answer))
+            await deck.remove(Card(question=question, answer=answer))
         except ValueError:
             pass
         return RedirectResponse(url=f"/deck/{deck_id}", status_code=303)
 
+    @app.get("/review/{deck_id}", response_class=HTMLResponse)
+    async def review_deck(request: Request, deck_id: str) -> HTMLResponse:
+        state = _get_state(request)
+        deck = await _get_deck_or_404(state, deck_id)
+        review = await run_in_threadpool(state.review_service.next_due, deck_id)
+        return templates.TemplateResponse(
+            request,
+            "review.html",
+            {
+                "deck_id": deck_id,
+                "deck_name": deck.name(),
+                "review": review,
+                "grades": {
+                    "again": AGAIN,
+                    "hard": HARD,
+                    "good": GOOD,
+                    "easy": EASY,
+                },
+            },
+        )
+
+    @app.post("/review/{deck_id}/{card_id}")
+    async def grade_card(
+        request: Request,
+        deck_id: str,
+        card_id: int,
+        grade: int = Form(...),
+    ) -> RedirectResponse:
+        state = _get_state(request)
+        await _get_deck_or_404(state, deck_id)
+        try:
+            await run_in_threadpool(state.review_service.grade, deck_id, card_id, grade)
+        except LookupError:
+            raise HTTPException(status_code=404, detail="Card not found")
+        except ValueError as error:
+            raise HTTPException(status_code=422, detail=str(error))
+        return RedirectResponse(url=f"/review/{deck_id}", status_code=303)
+
     @app.get("/create_card/{deck_id}/", response_class=HTMLResponse)
     async def create_spec(
         request: Request,
@@ -164,7 +527,7 @@ def build_app(state: Optional[WebState] = None) -> FastAPI:
         spec_id: Optional[str] = None,
     ) -> HTMLResponse:
         state = _get_state(request)
-        _get_deck_or_404(state, deck_id)
+        await _get_deck_or_404(state, deck_id)
         spec = None
         if spec_id:
             spec = state.get_spec(spec_id)
@@ -185,7 +548,7 @@ def build_app(state: Optional[WebState] = None) -> FastAPI:
         instructions: str = Form(""),
     ) -> RedirectResponse:
         state = _get_state(request)
-        _get_deck_or_404(state, deck_id)
+        await _get_deck_or_404(state, deck_id)
         spec = state.save_spec(deck_id, theme, instructions)
         return RedirectResponse(
             url=f"/select/{deck_id}/{spec.id}", status_code=303
@@ -194,11 +557,12 @@ def build_app(state: Optional[WebState] = None) -> FastAPI:
     @app.get("/select/{deck_id}/{spec_id}", response_class=HTMLResponse)
     async def select_cards(request: Request, deck_id: str, spec_id: str) -> HTMLResponse:
         state = _get_state(request)
-        _get_deck_or_404(state, deck_id)
+        deck = await _get_deck_or_404(state, deck_id)
         spec = state.get_spec(spec_id)
         if spec is None:
             raise HTTPException(status_code=404, detail="Spec not found")
-        card = state.card_generator.create_card(spec.theme, spec.instructions)
+        await state.sync_duplicate_filter(deck)
+        card = await state.next_card(deck_id, spec)
 
         return templates.TemplateResponse(
             request,
@@ -219,19 +583,62 @@ def build_app(state: Optional[WebState] = None) -> FastAPI:
         answer: str = Form(...),
     ) -> RedirectResponse:
         state = _get_state(request)
-        deck = _get_deck_or_404(state, deck_id)
+        deck = await _get_deck_or_404(state, deck_id)
         spec = state.get_spec(spec_id)
         if spec is None:
             raise HTTPException(status_code=404, detail="Spec not found")
-        deck.add(Card(question=question, answer=answer))
+        await state.select(deck, [Card(question=question, answer=answer)])
         return RedirectResponse(
             url=f"/select/{deck_id}/{spec_id}",
             status_code=303,
         )
 
+    @app.get("/feed/{deck_id}/{spec_id}", response_class=HTMLResponse)
+    async def card_feed(request: Request, deck_id: str, spec_id: str) -> HTMLResponse:
+        state = _get_state(request)
+        await _get_deck_or_404(state, deck_id)
+        spec = state.get_spec(spec_id)
+        if spec is None:
+            raise HTTPException(status_code=404, detail="Spec not found")
+        return templates.TemplateResponse(
+            request,
+            "feed.html",
+            {
+                "deck_id": deck_id,
+                "spec": spec,
+            },
+        )
+
+    @app.websocket("/feed/{deck_id}/{spec_id}/ws")
+    async def card_feed_socket(websocket: WebSocket, deck_id: str, spec_id: str) -> None:
+        state: WebState = websocket.app.state.web_state
+        deck = await state.async_deck_service.get_deck(deck_id)
+        spec = state.get_spec(spec_id)
+        if deck is None or spec is None:
+            await websocket.close(code=1008)
+            return
+        await websocket.accept()
+        await state.sync_duplicate_filter(deck)
+
+        async def select(card: Card) -> None:
+            await state.select(deck, [card])
+
+        feed = CardFeed(websocket, lambda: state.next_card(deck_id, spec), select)
+        await feed.run()
+
     return app
 
 
-app = build_app()
+@cache
+def _default_app() -> FastAPI:
+    return build_app()
+
+
+def __getattr__(name: str) -> FastAPI:
+    # `app` is built on first access so that importing the module stays cheap
+    if name == "app":
+        return _default_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 __all__ = ["build_app", "WebState", "DEFAULT_DECK_NAME"]
@@ -0,0 +1,146 @@
+"""
+Scroll feed of generated cards over a websocket.
+
+The server keeps `prefetch` cards ahead of the user: a card is generated and
+pushed as soon as the user selects or skips one, so the next card is already
+on the page when it is needed.
+
+server -> client: {"type": "card", "id": 3, "question": "...", "answer": "..."}
+                  {"type": "error", "detail": "..."}
+client -> server: {"action": "select", "id": 3}
+                  {"action": "skip", "id": 3}
+
+A malformed message is answered with an error frame and the feed goes on, a
+card that cannot be generated or saved ends the feed with an error frame and
+close code 1011.
+"""
+from __future__ import annotations
+
+import asyncio
+from typing import Awaitable, Callable
+
+from fastapi import WebSocket, WebSocketDisconnect
+
+from anki_scroll.lm_scheduler import SchedulerOverloaded
+from anki_scroll.services import Card
+
+# cards pushed ahead of the user
+DEFAULT_PREFETCH = 3
+
+ACTIONS = ("select", "skip")
+
+
+class CardFeed:
+    """Push cards on a websocket and apply the select and skip actions of the user."""
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        next_card: Callable[[], Awaitable[Card]],
+        select: Callable[[Card], Awaitable[None]],
+        prefetch: int = DEFAULT_PREFETCH,
+    ) -> None:
+        self._websocket = websocket
+        self._next_card = next_card
+        self._select = select
+        self._credits = asyncio.Semaphore(prefetch)
+        # cards pushed and not answered yet, by id
+        self._pending: dict[int, Card] = {}
+        self._next_id = 0
+        self._closed = False
+
+    async def run(self) -> None:
+        """Serve the feed until the client disconnects."""
+        producer = asyncio.create_task(self._produce())
+        try:
+            await self._consume()
+        except WebSocketDisconnect:
+            pass
+        finally:
+            producer.cancel()
+            try:
+                await producer
+            except (asyncio.CancelledError, WebSocketDisconnect):
+                pass
+
+    async def _produce(self) -> None:
+        while True:
+            await self._credits.acquire()
+            try:
+                card = await self._next_card()
+            except Exception as error:
+                await self._close(str(error))
+                return
+            card_id = self._next_id
+            self._next_id += 1
+            self._pending[card_id] = card
+            sent = await self._send(
+                {
+                    "type": "card",
+                    "id": card_id,
+                    "question": card.question,
+                    "answer": card.answer,
+                }
+            )
+            if not sent:
+                return
+
+    async def _consume(self) -> None:
+        while True:
+            try:
+                message = await self._websocket.receive_json()
+            except ValueError:
+                await self._error("message is not json")
+                continue
+            except RuntimeError:
+                # the producer closed the socket
+                if self._closed:
+                    return
+                raise
+            if not isinstance(message, dict):
+                await self._error("message must be an object")
+                continue
+            card_id = message.get("id")
+            action = message.get("action")
+            # bool is an int, but never a card id
+            if not isinstance(card_id, int) or isinstance(card_id, bool) or action not in ACTIONS:
+                await self._error('expected {"action": "select" or "skip", "id": <card id>}')
+                continue
+            card = self._pending.pop(card_id, None)
+            if card is None:
+                # unknown or already answered, nothing to refill
+                continue
+            if action == "select":
+                try:
+                    await self._select(card)
+                except (LookupError, SchedulerOverloaded) as error:
+                    await self._close(str(error))
+                    return
+            self._credits.release()
+
+    async def _send(self, message: dict) -> bool:
+        """send unless the socket is closed, return whether the message was sent"""
+        if self._closed:
+            return False
+        try:
+            await self._websocket.send_json(message)
+        except (RuntimeError, WebSocketDisconnect):
+            # the client is gone, the consumer sees the disconnect
+            self._closed = True
+            return False
+        return True
+
+    async def _error(self, detail: str) -> None:
+        await self._send({"type": "error", "detail": detail})
+
+    async def _close(self, detail: str) -> None:
+        """send the error and close the socket, once for both tasks"""
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            await self._websocket.send_json({"type": "error", "detail": detail})
+            await self._websocket.close(code=1011)
+        except (RuntimeError, WebSocketDisconnect):
+            # the client is gone already
+            pass
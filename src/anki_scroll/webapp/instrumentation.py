@@ -0,0 +1,77 @@
+"""
+Request and template metrics of the web application, see anki_scroll.metrics.
+"""
+from __future__ import annotations
+
+import time
+
+import jinja2
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from anki_scroll.metrics import REGISTRY
+
+_REQUEST_SECONDS = REGISTRY.histogram(
+    "anki_scroll_http_request_duration_seconds",
+    "Latency of the http requests by route template, method and status.",
+    ("method", "route", "status"),
+)
+_IN_PROGRESS = REGISTRY.gauge(
+    "anki_scroll_http_requests_in_progress",
+    "Http requests being served, by method.",
+    ("method",),
+)
+# methods labelled as sent, the others are counted as "other"
+HTTP_METHODS = frozenset(
+    ("GET", "HEAD", "POST", "PUT", "DELETE", "CONNECT", "OPTIONS", "TRACE", "PATCH")
+)
+
+_RENDER_SECONDS = REGISTRY.histogram(
+    "anki_scroll_template_render_seconds",
+    "Time to render a jinja template.",
+    ("template",),
+)
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware recording latency and in-flight requests.
+    Routes are labelled by their template (/deck/{deck_id}) and unknown
+    methods by "other" to keep the number of series bounded. Websocket
+    connections are not measured.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        method = scope["method"] if scope["method"] in HTTP_METHODS else "other"
+        status = 500
+
+        async def send_with_status(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        in_progress = _IN_PROGRESS.labels(method)
+        in_progress.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            in_progress.dec()
+            # the router stores the matched route in the scope
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            _REQUEST_SECONDS.labels(method, path, status).observe(time.perf_counter() - start)
+
+
+class TimedTemplate(jinja2.Template):
+    """Template recording its render time, set as template_class of the environment."""
+
+    def render(self, *args, **kwargs) -> str:
+        with _RENDER_SECONDS.labels(self.name or "string").time():
+            return super().render(*args, **kwargs)
@@ -0,0 +1,197 @@
+"""
+Opt-in profiling of the running web application.
+
+Disabled unless ANKI_SCROLL_PROFILING_DIR is set, the middleware and the
+admin routes are then not installed at all. When enabled:
+
+- a request with the header `X-Profile: 1` or the query `?profile=1` runs
+  under cProfile, the stats are written to the directory and the file name is
+  returned in the `X-Profile-Dump` response header (open it with pstats or snakeviz).
+- POST /admin/tracemalloc/snapshot takes a tracemalloc snapshot, writes it to
+  the directory and returns the allocations that grew the most since the
+  previous snapshot. Tracing starts with the first snapshot and stops with
+  POST /admin/tracemalloc/stop.
+
+When ANKI_SCROLL_PROFILING_TOKEN is set, requests must carry it in the
+`X-Profile-Token` header.
+"""
+from __future__ import annotations
+
+import cProfile
+import os
+import re
+import secrets
+import threading
+import time
+import tracemalloc
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Self
+from urllib.parse import parse_qs
+
+from dotenv import load_dotenv
+from fastapi import APIRouter, HTTPException, Query, Request
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+_SLUG = re.compile(r"[^A-Za-z0-9]+")
+
+
+@dataclass(slots=True)
+class ProfilingConfig:
+    """Where profiles are written, None disables profiling."""
+
+    directory: str | None = None
+    # required in the X-Profile-Token header when set
+    token: str | None = None
+    # frames kept per allocation by tracemalloc
+    traceback_frames: int = 10
+
+    @property
+    def enabled(self) -> bool:
+        return self.directory is not None
+
+    @classmethod
+    def load(cls) -> Self:
+        """
+        Load configuration from the environment.
+        ANKI_SCROLL_PROFILING_DIR enables profiling, ANKI_SCROLL_PROFILING_TOKEN protects it.
+        """
+        load_dotenv()
+        return cls(
+            directory=os.environ.get("ANKI_SCROLL_PROFILING_DIR") or None,
+            token=os.environ.get("ANKI_SCROLL_PROFILING_TOKEN") or None,
+        )
+
+    def authorized(self, token: str | None) -> bool:
+        if self.token is None:
+            return True
+        return token is not None and secrets.compare_digest(token, self.token)
+
+    def dump_path(self, *parts: str) -> Path:
+        directory = Path(self.directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        slug = "-".join(_SLUG.sub("_", part).strip("_") for part in parts if part)
+        return directory / f"{time.strftime('%Y%m%d-%H%M%S')}-{time.perf_counter_ns()}-{slug}"
+
+
+def _header(scope: Scope, name: bytes) -> str | None:
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+class ProfilingMiddleware:
+    """
+    Profile the requests asking for it with cProfile.
+    The profiler sees the event loop thread only: work sent to thread pools
+    is not included, coroutines of concurrent requests may be.
+    """
+
+    def __init__(self, app: ASGIApp, config: ProfilingConfig) -> None:
+        self.app = app
+        self._config = config
+        # cProfile cannot run two profiles at once in a thread
+        self._lock = threading.Lock()
+
+    def _requested(self, scope: Scope) -> bool:
+        if _header(scope, b"x-profile") == "1":
+            return True
+        query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        return query.get("profile") == ["1"]
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not self._requested(scope):
+            await self.app(scope, receive, send)
+            return
+        if not self._config.authorized(_header(scope, b"x-profile-token")):
+            await self.app(scope, receive, send)
+            return
+        if not self._lock.acquire(blocking=False):
+            # another request is being profiled
+            await self.app(scope, receive, send)
+            return
+        path = self._config.dump_path(scope["method"], scope["path"]).with_suffix(".prof")
+
+        async def send_with_dump(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"x-profile-dump", path.name.encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            try:
+                await self.app(scope, receive, send_with_dump)
+            finally:
+                profiler.disable()
+            profiler.dump_stats(path)
+        finally:
+            self._lock.release()
+
+
+class _Tracemalloc:
+    """Keep the previous snapshot to diff against."""
+
+    def __init__(self) -> None:
+        self.previous: tracemalloc.Snapshot | None = None
+        self.lock = threading.Lock()
+
+
+def build_admin_router(config: ProfilingConfig) -> APIRouter:
+    router = APIRouter(prefix="/admin", tags=["admin"])
+    tracer = _Tracemalloc()
+
+    def _check(request: Request) -> None:
+        if not config.authorized(request.headers.get("x-profile-token")):
+            raise HTTPException(status_code=403, detail="Invalid profiling token")
+
+    @router.post("/tracemalloc/snapshot")
+    def tracemalloc_snapshot(request: Request, limit: int = Query(25, ge=1, le=500)) -> dict:
+        """
+        Take a snapshot and return the top allocation sites, by growth since
+        the previous snapshot when there is one.
+        """
+        _check(request)
+        with tracer.lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(config.traceback_frames)
+                tracer.previous = None
+            snapshot = tracemalloc.take_snapshot().filter_traces(
+                [tracemalloc.Filter(False, tracemalloc.__file__)]
+            )
+            path = config.dump_path("tracemalloc").with_suffix(".snapshot")
+            snapshot.dump(str(path))
+            previous, tracer.previous = tracer.previous, snapshot
+        if previous is None:
+            statistics = [
+                {"location": str(stat.traceback), "size": stat.size, "size_diff": stat.size,
+                 "count": stat.count, "count_diff": stat.count}
+                for stat in snapshot.statistics("lineno")[:limit]
+            ]
+        else:
+            statistics = [
+                {"location": str(stat.traceback), "size": stat.size, "size_diff": stat.size_diff,
+                 "count": stat.count, "count_diff": stat.count_diff}
+                for stat in snapshot.compare_to(previous, "lineno")[:limit]
+            ]
+        current, peak = tracemalloc.get_traced_memory()
+        return {
+            "dump": path.name,
+            "compared_to_previous": previous is not None,
+            "traced_bytes": current,
+            "peak_bytes": peak,
+            "statistics": statistics,
+        }
+
+    @router.post("/tracemalloc/stop")
+    def tracemalloc_stop(request: Request) -> dict:
+        _check(request)
+        with tracer.lock:
+            tracemalloc.stop()
+            tracer.previous = None
+        return {"tracing": False}
+
+    return router
@@ -0,0 +1,167 @@
+"""
+Behaviour shared by every DeckService backend.
+
+Mix DeckServiceContract into the TestCase of a backend, its setUp must set
+self.service to the service under test.
+"""
+from hashlib import sha256
+
+from anki_scroll.services import Card
+from anki_scroll.simple_services import SimpleDeck
+
+
+class DeckServiceContract:
+    # decks of persistent backends fail once removed from their service,
+    # in-memory decks stay usable on their own
+    removed_deck_raises = True
+
+    def test_name(self):
+        deck = self.service.create_deck("History")
+        self.assertIsNotNone(deck)
+        self.assertEqual(deck.name(), "History")
+
+    def test_id(self):
+        deck = self.service.create_deck("Science")
+        self.assertIsNotNone(deck)
+        expected = sha256("Science".encode("utf-8")).hexdigest()
+        self.assertEqual(deck.id(), expected)
+
+    def test_add(self):
+        deck = self.service.create_deck("Add Deck")
+        self.assertIsNotNone(deck)
+        card = Card(question="Q", answer="A")
+        deck.add(card)
+
+        cards = list(deck)
+        self.assertEqual(len(cards), 1)
+        self.assertEqual(cards[0].question, "Q")
+        self.assertEqual(cards[0].answer, "A")
+
+    def test_add_many(self):
+        deck = self.service.create_deck("Add Many")
+        cards = [Card(question=f"Q{i}", answer="A") for i in range(3)]
+        self.assertEqual(deck.add_many(iter(cards)), 3)
+        self.assertEqual(list(deck), cards)
+
+    def test_remove(self):
+        deck = self.service.create_deck("Remove Deck")
+        self.assertIsNotNone(deck)
+        card = Card(question="Q", answer="A")
+        deck.add(card)
+        deck.remove(card)
+        cards = list(deck)
+        self.assertEqual(len(cards), 0)
+
+    def test_remove_missing(self):
+        deck = self.service.create_deck("Remove Missing")
+        deck.add(Card(question="Q", answer="A"))
+        before = deck.stats()
+        deck.remove(Card(question="Q", answer="other"))
+        self.assertEqual(deck.stats(), before)
+
+    def test_remove_many(self):
+        deck = self.service.create_deck("Remove Many")
+        cards = [Card(question=f"Q{i}", answer="A") for i in range(3)]
+        deck.add_many(cards + [cards[0]])
+        removed = deck.remove_many([cards[0], cards[1], Card(question="missing", answer="A")])
+        self.assertEqual(removed, 2)
+        self.assertEqual(list(deck), [cards[2], cards[0]])
+        self.assertEqual(deck.stats().count, 2)
+
+    def test_remove_duplicates(self):
+        deck = self.service.create_deck("Duplicates")
+        card_a = Card(question="a", answer="1")
+        card_b = Card(question="b", answer="2")
+        deck.add_many([card_a, card_b, card_a])
+        deck.remove(card_a)
+        self.assertEqual(list(deck), [card_b, card_a])
+        deck.remove(card_a)
+        deck.remove(card_a)
+        self.assertEqual(list(deck), [card_b])
+        deck.add(card_a)
+        self.assertEqual(list(deck), [card_b, card_a])
+
+    def test_iter(self):
+        deck = self.service.create_deck("Iter Deck")
+        self.assertIsNotNone(deck)
+        card_a = Card(question="A?", answer="1")
+        card_b = Card(question="B?", answer="2")
+        deck.add(card_a)
+        deck.add(card_b)
+        cards = list(deck)
+        self.assertEqual(cards, [card_a, card_b])
+
+    def test_stats(self):
+        deck = self.service.create_deck("Stats Deck")
+        self.assertIsNotNone(deck)
+        empty = deck.stats()
+        self.assertEqual(empty.count, 0)
+        card = Card(question="Q", answer="A")
+        deck.add(card)
+        deck.add(Card(question="Q2", answer="A2"))
+        added = deck.stats()
+        self.assertEqual(added.count, 2)
+        self.assertGreater(added.version, empty.version)
+        self.assertGreaterEqual(added.modified_at, empty.modified_at)
+        deck.remove(card)
+        removed = deck.stats()
+        self.assertEqual(removed.count, 1)
+        self.assertGreater(removed.version, added.version)
+
+    def test_stats_missing_deck(self):
+        if not self.removed_deck_raises:
+            self.skipTest("decks of this backend outlive their service")
+        deck = self.service.create_deck("Gone")
+        self.assertIsNotNone(deck)
+        self.service.remove_deck(deck.id())
+        with self.assertRaises(LookupError):
+            deck.stats()
+        with self.assertRaises(LookupError):
+            deck.add(Card(question="Q", answer="A"))
+
+    def test_decks(self):
+        deck = self.service.create_deck("Deck List")
+        self.assertIsNotNone(deck)
+        decks = list(self.service.decks())
+        self.assertTrue(any(candidate.id() == deck.id() for candidate in decks))
+
+    def test_get_deck(self):
+        deck = self.service.create_deck("Lookup Deck")
+        self.assertIsNotNone(deck)
+        fetched = self.service.get_deck(deck.id())
+        self.assertIsNotNone(fetched)
+        self.assertEqual(fetched.id(), deck.id())
+        self.assertIsNone(self.service.get_deck("missing"))
+
+    def test_add_deck(self):
+        donor_service = SimpleDeck("Donor")
+        donor_card = Card(question="Origin", answer="Deck")
+        donor_service.add(donor_card)
+        self.service.add_deck(donor_service)
+        retrieved = self.service.get_deck(donor_service.id())
+        self.assertIsNotNone(retrieved)
+        self.assertEqual(list(retrieved), [donor_card])
+
+    def test_create_deck(self):
+        deck = self.service.create_deck("Factory Deck")
+        self.assertIsNotNone(deck)
+        duplicate = self.service.create_deck(" Factory Deck ")
+        self.assertIsNone(duplicate)
+
+    def test_remove_deck(self):
+        deck = self.service.create_deck("Disposable")
+        self.assertIsNotNone(deck)
+        self.service.remove_deck(deck.id())
+        self.assertIsNone(self.service.get_deck(deck.id()))
+        self.service.remove_deck(deck.id())
+
+    def test_recreated_deck_incarnation(self):
+        deck = self.service.create_deck("Phoenix")
+        before = deck.stats()
+        deck.add(Card(question="Q", answer="A"))
+        self.service.remove_deck(deck.id())
+        recreated = self.service.create_deck("Phoenix")
+        after = recreated.stats()
+        self.assertEqual(list(recreated), [])
+        self.assertEqual((after.version, recreated.id()), (before.version, deck.id()))
+        self.assertNotEqual(after.incarnation, before.incarnation)
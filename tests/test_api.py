@@ -0,0 +1,121 @@
+import unittest
+
+import httpx
+
+from anki_scroll.services import Card, CardGenerator
+from anki_scroll.simple_services import SimpleDeckService
+from anki_scroll.webapp import DEFAULT_DECK_NAME, WebState, build_app
+
+
+class NumberedGenerator(CardGenerator):
+    def __init__(self):
+        self.calls = 0
+
+    def create_card(self, theme: str, instructions: str) -> Card:
+        self.calls += 1
+        return Card(question=f"{theme} fact number {self.calls}", answer=f"Answer {self.calls}")
+
+
+class ApiTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.generator = NumberedGenerator()
+        self.state = WebState(deck_service=SimpleDeckService(), card_generator=self.generator)
+        transport = httpx.ASGITransport(app=build_app(self.state))
+        self.client = httpx.AsyncClient(transport=transport, base_url="http://test/api/v1")
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+
+    async def _deck_id(self):
+        response = await self.client.post("/decks", json={"name": "Api"})
+        self.assertEqual(response.status_code, 201)
+        return response.json()["id"]
+
+    async def test_list_decks(self):
+        response = await self.client.get("/decks")
+        self.assertEqual(response.status_code, 200)
+        decks = response.json()
+        self.assertEqual(decks[0]["name"], DEFAULT_DECK_NAME)
+        self.assertEqual(decks[0]["count"], 2)
+
+    async def test_create_existing_deck(self):
+        await self._deck_id()
+        response = await self.client.post("/decks", json={"name": "Api"})
+        self.assertEqual(response.status_code, 409)
+
+    async def test_add_and_delete_batches(self):
+        deck_id = await self._deck_id()
+        cards = [{"question": f"Q{i}", "answer": f"A{i}"} for i in range(5)]
+        added = await self.client.post(f"/decks/{deck_id}/cards", json={"cards": cards})
+        self.assertEqual(added.json()["count"], 5)
+        removed = await self.client.post(
+            f"/decks/{deck_id}/cards/delete",
+            json={"cards": cards[:2] + [{"question": "missing", "answer": "missing"}]},
+        )
+        self.assertEqual(removed.json()["count"], 2)
+        listed = await self.client.get(f"/decks/{deck_id}/cards")
+        self.assertEqual(listed.json(), cards[2:])
+        deck = await self.client.get(f"/decks/{deck_id}")
+        self.assertEqual(deck.json()["count"], 3)
+
+    async def test_batch_limit(self):
+        deck_id = await self._deck_id()
+        cards = [{"question": "Q", "answer": "A"}] * 1001
+        response = await self.client.post(f"/decks/{deck_id}/cards", json={"cards": cards})
+        self.assertEqual(response.status_code, 422)
+
+    async def test_candidates(self):
+        deck_id = await self._deck_id()
+        spec = await self.client.post(f"/decks/{deck_id}/specs", json={"theme": "Astronomy"})
+        self.assertEqual(spec.status_code, 201)
+        spec_id = spec.json()["id"]
+        response = await self.client.get(f"/decks/{deck_id}/specs/{spec_id}/candidates", params={"k": 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 3)
+        self.assertEqual(self.generator.calls, 3)
+
+    async def test_candidates_of_other_deck_spec(self):
+        deck_id = await self._deck_id()
+        spec = self.state.save_spec("another deck", "Astronomy", "")
+        response = await self.client.get(f"/decks/{deck_id}/specs/{spec.id}/candidates")
+        self.assertEqual(response.status_code, 404)
+
+    async def test_missing_deck(self):
+        response = await self.client.get("/decks/missing/cards")
+        self.assertEqual(response.status_code, 404)
+
+
+class MetricsEndpointTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        state = WebState(deck_service=SimpleDeckService(), card_generator=NumberedGenerator())
+        transport = httpx.ASGITransport(app=build_app(state))
+        self.client = httpx.AsyncClient(transport=transport, base_url="http://test")
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+
+    async def test_metrics(self):
+        decks = (await self.client.get("/api/v1/decks")).json()
+        await self.client.get(f"/deck/{decks[0]['id']}")
+        response = await self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["content-type"].startswith("text/plain"))
+        text = response.text
+        self.assertIn(
+            'anki_scroll_http_request_duration_seconds_count{method="GET",route="/deck/{deck_id}",status="200"}',
+            text,
+        )
+        self.assertIn('anki_scroll_template_render_seconds_count{template="deck.html"}', text)
+        self.assertIn('anki_scroll_http_requests_in_progress{method="GET"} 1.0', text)
+
+
+    async def test_unknown_methods_share_a_label(self):
+        for method in ("BREW", "PROPFIND", "X-RANDOM-1"):
+            await self.client.request(method, "/api/v1/decks")
+        text = (await self.client.get("/metrics")).text
+        self.assertIn('anki_scroll_http_request_duration_seconds_count{method="other",route=', text)
+        self.assertNotIn('method="BREW"', text)
+        self.assertNotIn('method="X-RANDOM-1"', text)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import asyncio
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+from anki_scroll.async_service import ThreadedDeckService
+from anki_scroll.services import Card, DeckStats
+from anki_scroll.simple_services import SimpleDeck, SimpleDeckService
+from anki_scroll.sql_service import SqlConfig, SqlDeckService
+
+
+class SlowDeck(SimpleDeck):
+    def stats(self) -> DeckStats:
+        time.sleep(0.2)
+        return super().stats()
+
+
+class TestThreadedDeckService(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        config = SqlConfig(database=str(Path(self._tempdir.name) / "test.sqlite"))
+        self.service = ThreadedDeckService(SqlDeckService(config=config))
+
+    async def asyncTearDown(self):
+        self.service.close()
+        self._tempdir.cleanup()
+
+    async def test_create_and_get_deck(self):
+        deck = await self.service.create_deck("async")
+        self.assertIsNotNone(deck)
+        fetched = await self.service.get_deck(deck.id())
+        self.assertEqual(fetched.name(), "async")
+        self.assertIsNone(await self.service.create_deck("async"))
+        self.assertIsNone(await self.service.get_deck("missing"))
+
+    async def test_add_remove_cards(self):
+        deck = await self.service.create_deck("cards")
+        card_a = Card(question="a", answer="1")
+        card_b = Card(question="b", answer="2")
+        await deck.add(card_a)
+        await deck.add(card_b)
+        self.assertEqual(await deck.cards(), [card_a, card_b])
+        await deck.remove(card_a)
+        self.assertEqual(await deck.cards(), [card_b])
+        self.assertEqual((await deck.stats()).count, 1)
+
+    async def test_decks_and_remove_deck(self):
+        deck = await self.service.create_deck("listed")
+        self.assertIn(deck.id(), [item.id() for item in await self.service.decks()])
+        await self.service.remove_deck(deck.id())
+        self.assertEqual(await self.service.decks(), [])
+
+    async def test_add_deck(self):
+        donor = SimpleDeck("donor")
+        card = Card(question="q", answer="a")
+        donor.add(card)
+        await self.service.add_deck(donor)
+        deck = await self.service.get_deck(donor.id())
+        self.assertEqual(await deck.cards(), [card])
+
+
+class TestThreadedDeckServiceConcurrency(unittest.IsolatedAsyncioTestCase):
+    async def test_reads_do_not_block_event_loop(self):
+        inner = SimpleDeckService()
+        inner.add_deck(SlowDeck("slow"))
+        service = ThreadedDeckService(inner, reader_threads=2)
+        try:
+            deck = (await service.decks())[0]
+            start = time.perf_counter()
+            ticks = 0
+
+            async def ticker():
+                nonlocal ticks
+                while time.perf_counter() - start < 0.2:
+                    ticks += 1
+                    await asyncio.sleep(0.01)
+
+            await asyncio.gather(deck.stats(), deck.stats(), ticker())
+            elapsed = time.perf_counter() - start
+        finally:
+            service.close()
+        self.assertGreater(ticks, 5)
+        self.assertLess(elapsed, 0.39)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,151 @@
+import sqlite3
+import tempfile
+import unittest
+import zipfile
+from pathlib import Path
+
+from anki_scroll.bulk_io import (
+    CHUNK_SIZE,
+    export_cards,
+    import_cards,
+    read_apkg,
+    read_cards,
+    write_cards,
+)
+from anki_scroll.cli import run
+from anki_scroll.services import Card
+from anki_scroll.simple_services import SimpleDeck
+from anki_scroll.sql_service import SqlConfig, SqlDeckService
+
+
+CARDS = [
+    Card(question="What is 1+1?", answer="2"),
+    Card(question='Quotes "and", commas', answer="multi\nline <b>html</b>"),
+    Card(question="Unicode ü", answer="ß"),
+]
+
+
+class TestFormats(unittest.TestCase):
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self.directory = Path(self._tempdir.name)
+
+    def tearDown(self):
+        self._tempdir.cleanup()
+
+    def test_round_trip(self):
+        for format in ("csv", "jsonl", "apkg"):
+            with self.subTest(format=format):
+                path = self.directory / f"cards.{format}"
+                written = write_cards(iter(CARDS), path, "Deck")
+                self.assertEqual(written, len(CARDS))
+                self.assertEqual(list(read_cards(path)), CARDS)
+
+    def test_apkg_content(self):
+        path = self.directory / "deck.apkg"
+        write_cards(CARDS, path, "Exported")
+        with zipfile.ZipFile(path) as package:
+            self.assertIn("media", package.namelist())
+            package.extract("collection.anki2", self.directory)
+        conn = sqlite3.connect(self.directory / "collection.anki2")
+        try:
+            notes = conn.execute("SELECT COUNT(*) FROM notes").fetchone()[0]
+            cards = conn.execute("SELECT COUNT(*) FROM cards").fetchone()[0]
+            decks = conn.execute("SELECT decks FROM col").fetchone()[0]
+        finally:
+            conn.close()
+        self.assertEqual(notes, len(CARDS))
+        self.assertEqual(cards, len(CARDS))
+        self.assertIn("Exported", decks)
+
+    def test_apkg_without_collection(self):
+        path = self.directory / "broken.apkg"
+        with zipfile.ZipFile(path, "w") as package:
+            package.writestr("media", "{}")
+        with self.assertRaises(ValueError):
+            list(read_apkg(path))
+
+    def test_invalid_cards(self):
+        files = {
+            "cards.jsonl": '{"question": "q", "answer": "a"}\n\n{"question": ["x"], "answer": 3}\n',
+            "null.jsonl": '{"question": "q", "answer": null}\n',
+            "broken.jsonl": '{"question": "q", "answer": "a"}\n{"question": \n',
+            "list.jsonl": '["q", "a"]\n',
+            "short.csv": 'question,answer\nq,a\nonly question\n',
+            "header.csv": 'front,back\nq,a\n',
+        }
+        lines = {"cards.jsonl": 3, "null.jsonl": 1, "broken.jsonl": 2,
+                 "list.jsonl": 1, "short.csv": 3, "header.csv": 2}
+        for name, content in files.items():
+            with self.subTest(name=name):
+                path = self.directory / name
+                path.write_text(content, encoding="utf-8")
+                with self.assertRaisesRegex(ValueError, f"{name}:{lines[name]}: "):
+                    list(read_cards(path))
+
+    def test_unknown_extension(self):
+        with self.assertRaises(ValueError):
+            list(read_cards(self.directory / "cards.txt"))
+
+
+class TestImportExport(unittest.TestCase):
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self.directory = Path(self._tempdir.name)
+        self.db_path = str(self.directory / "test.sqlite")
+        self.service = SqlDeckService(config=SqlConfig(database=self.db_path))
+
+    def tearDown(self):
+        self._tempdir.cleanup()
+
+    def test_import_progress(self):
+        total = CHUNK_SIZE * 2 + 5
+        path = self.directory / "many.jsonl"
+        write_cards(
+            (Card(question=f"q{i}", answer=f"a{i}") for i in range(total)), path, "many"
+        )
+        deck = self.service.create_deck("Many")
+        reports = []
+        imported = import_cards(deck, path, progress=reports.append)
+        self.assertEqual(imported, total)
+        self.assertEqual(reports, [CHUNK_SIZE, CHUNK_SIZE * 2, total])
+        self.assertEqual(deck.stats().count, total)
+        self.assertEqual(next(iter(deck)), Card(question="q0", answer="a0"))
+
+    def test_export(self):
+        deck = SimpleDeck("simple")
+        deck.add_many(CARDS)
+        path = self.directory / "export.csv"
+        self.assertEqual(export_cards(deck, path), len(CARDS))
+        self.assertEqual(list(read_cards(path)), CARDS)
+
+    def test_cli(self):
+        source = self.directory / "source.csv"
+        target = self.directory / "target.jsonl"
+        write_cards(CARDS, source, "cli")
+        self.assertEqual(run(["--db", self.db_path, "import", str(source), "--deck", "Cli"]), 0)
+        self.assertEqual(run(["--db", self.db_path, "import", str(source), "--deck", "Cli"]), 0)
+        self.assertEqual(run(["--db", self.db_path, "export", "Cli", str(target)]), 0)
+        self.assertEqual(list(read_cards(target)), CARDS + CARDS)
+        self.assertEqual(run(["--db", self.db_path, "export", "Missing", str(target)]), 1)
+
+    def test_cli_invalid_file(self):
+        source = self.directory / "invalid.jsonl"
+        source.write_text('{"question": "q", "answer": null}\n', encoding="utf-8")
+        self.assertEqual(run(["--db", self.db_path, "import", str(source), "--deck", "Cli"]), 1)
+
+
+    def test_cli_missing_file(self):
+        missing = self.directory / "missing.csv"
+        self.assertEqual(run(["--db", self.db_path, "import", str(missing), "--deck", "Cli"]), 1)
+
+    def test_cli_malformed_csv(self):
+        source = self.directory / "malformed.csv"
+        # longer than the field limit of the csv module
+        source.write_text("question,answer\nq," + "a" * 200_000 + "\n", encoding="utf-8")
+        with self.assertRaisesRegex(ValueError, "malformed.csv: invalid csv after line 1"):
+            list(read_cards(source))
+        self.assertEqual(run(["--db", self.db_path, "import", str(source), "--deck", "Cli"]), 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,192 @@
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from anki_scroll.caching_service import CachingDeckService
+from anki_scroll.services import Card
+from anki_scroll.simple_services import SimpleDeck, SimpleDeckService
+from anki_scroll.sql_service import SqlConfig, SqlDeck, SqlDeckService
+from deck_service_contract import DeckServiceContract
+
+
+class TestCachingDeckService(unittest.TestCase):
+    def setUp(self):
+        self.inner = SimpleDeckService()
+        self.service = CachingDeckService(self.inner, shared=False)
+
+    def test_iter_hits_cache(self):
+        deck = self.service.create_deck("cached")
+        card = Card(question="q", answer="a")
+        deck.add(card)
+        self.assertEqual(list(deck), [card])
+        misses = self.service.cache_stats().misses
+        self.assertEqual(list(deck), [card])
+        stats = self.service.cache_stats()
+        self.assertEqual(stats.misses, misses)
+        self.assertGreaterEqual(stats.hits, 1)
+
+    def test_add_invalidates(self):
+        deck = self.service.create_deck("writes")
+        card_a = Card(question="a", answer="1")
+        card_b = Card(question="b", answer="2")
+        deck.add(card_a)
+        self.assertEqual(list(deck), [card_a])
+        self.assertEqual(deck.stats().count, 1)
+        deck.add(card_b)
+        self.assertEqual(list(deck), [card_a, card_b])
+        self.assertEqual(deck.stats().count, 2)
+        deck.remove(card_a)
+        self.assertEqual(list(deck), [card_b])
+        self.assertEqual(deck.stats().count, 1)
+
+    def test_get_deck_cached(self):
+        deck = self.service.create_deck("lookup")
+        self.assertIs(self.service.get_deck(deck.id()), deck)
+        self.assertIsNone(self.service.get_deck("missing"))
+
+    def test_decks_listing_invalidated(self):
+        first = self.service.create_deck("first")
+        self.assertEqual([deck.id() for deck in self.service.decks()], [first.id()])
+        second = self.service.create_deck("second")
+        ids = {deck.id() for deck in self.service.decks()}
+        self.assertEqual(ids, {first.id(), second.id()})
+        self.service.remove_deck(first.id())
+        self.assertEqual([deck.id() for deck in self.service.decks()], [second.id()])
+        self.assertIsNone(self.service.get_deck(first.id()))
+
+    def test_add_deck(self):
+        donor = SimpleDeck("donor")
+        card = Card(question="q", answer="a")
+        donor.add(card)
+        self.service.add_deck(donor)
+        self.assertEqual(list(self.service.get_deck(donor.id())), [card])
+        self.assertIn(donor.id(), [deck.id() for deck in self.service.decks()])
+
+    def test_size_limit(self):
+        service = CachingDeckService(self.inner, max_cards=2, shared=False)
+        deck_a = service.create_deck("a")
+        deck_b = service.create_deck("b")
+        for i in range(2):
+            deck_a.add(Card(question=f"a{i}", answer="a"))
+            deck_b.add(Card(question=f"b{i}", answer="b"))
+        list(deck_a)
+        list(deck_b)
+        self.assertEqual(service.cache_stats().evictions, 1)
+        misses = service.cache_stats().misses
+        list(deck_a)
+        self.assertEqual(service.cache_stats().misses, misses + 1)
+
+
+class TestCachingDeckContract(DeckServiceContract, unittest.TestCase):
+    removed_deck_raises = False
+
+    def setUp(self):
+        self.service = CachingDeckService(SimpleDeckService(), shared=False)
+
+
+class TestSharedCachingDeckContract(DeckServiceContract, unittest.TestCase):
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tempdir.cleanup)
+        config = SqlConfig(database=str(Path(self._tempdir.name) / "test.sqlite"))
+        self.service = CachingDeckService(SqlDeckService(config=config))
+
+
+class TestCachingSqlDeckService(unittest.TestCase):
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self.config = SqlConfig(database=str(Path(self._tempdir.name) / "test.sqlite"))
+        self.service = CachingDeckService(SqlDeckService(config=self.config))
+
+    def tearDown(self):
+        self._tempdir.cleanup()
+
+    def test_round_trip(self):
+        deck = self.service.create_deck("sql")
+        card = Card(question="q", answer="a")
+        deck.add(card)
+        self.assertEqual(list(self.service.get_deck(deck.id())), [card])
+        self.assertEqual(deck.stats().count, 1)
+        deck.remove(card)
+        self.assertEqual(list(deck), [])
+        self.service.remove_deck(deck.id())
+        self.assertIsNone(self.service.get_deck(deck.id()))
+
+
+    def test_writes_of_other_processes(self):
+        # a second service on the same database stands for another worker
+        other = CachingDeckService(SqlDeckService(config=self.config))
+        deck = self.service.create_deck("shared")
+        first = Card(question="first", answer="1")
+        deck.add(first)
+        self.assertEqual(list(deck), [first])
+        hits = self.service.cache_stats().hits
+        self.assertEqual(list(deck), [first])
+        self.assertEqual(self.service.cache_stats().hits, hits + 1)
+
+        second = Card(question="second", answer="2")
+        other.get_deck(deck.id()).add(second)
+        self.assertEqual(list(deck), [first, second])
+        self.assertEqual(deck.stats().count, 2)
+        self.assertEqual(len(list(self.service.decks())), 1)
+
+        other.remove_deck(deck.id())
+        self.assertIsNone(self.service.get_deck(deck.id()))
+        self.assertEqual(list(self.service.decks()), [])
+        recreated = other.create_deck("shared")
+        recreated.add(second)
+        self.assertEqual(list(self.service.get_deck(deck.id())), [second])
+
+
+class TestMaxStaleness(unittest.TestCase):
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tempdir.cleanup)
+        self.config = SqlConfig(database=str(Path(self._tempdir.name) / "test.sqlite"))
+        self.service = CachingDeckService(SqlDeckService(config=self.config), max_staleness=60)
+
+    def test_reads_within_the_window_skip_the_database(self):
+        deck = self.service.create_deck("fresh")
+        card = Card(question="q", answer="a")
+        deck.add(card)
+        self.assertEqual(list(self.service.get_deck(deck.id())), [card])
+        list(self.service.decks())
+        with mock.patch.object(SqlDeck, "stats", autospec=True, side_effect=SqlDeck.stats) as stats, \
+                mock.patch.object(SqlDeckService, "get_deck", autospec=True) as get_deck, \
+                mock.patch.object(SqlDeckService, "decks", autospec=True) as decks:
+            for _ in range(3):
+                cached = self.service.get_deck(deck.id())
+                self.assertEqual(list(cached), [card])
+                self.assertEqual(cached.stats().count, 1)
+                self.assertEqual([d.id() for d in self.service.decks()], [deck.id()])
+            self.assertEqual((stats.call_count, get_deck.call_count, decks.call_count), (0, 0, 0))
+            # a local write is seen at once, with a single query of the stats
+            second = Card(question="q2", answer="a2")
+            deck.add(second)
+            self.assertEqual(list(deck), [card, second])
+            self.assertEqual(deck.stats().count, 2)
+            self.assertEqual(stats.call_count, 1)
+
+    def test_other_processes_seen_after_the_window(self):
+        self.service = CachingDeckService(SqlDeckService(config=self.config), max_staleness=0.05)
+        other = CachingDeckService(SqlDeckService(config=self.config))
+        deck = self.service.create_deck("stale")
+        first = Card(question="first", answer="1")
+        deck.add(first)
+        self.assertEqual(list(deck), [first])
+        second = Card(question="second", answer="2")
+        other.get_deck(deck.id()).add(second)
+        # within the window the cache may answer with the old cards
+        self.assertEqual(list(deck), [first])
+        time.sleep(0.06)
+        self.assertEqual(list(deck), [first, second])
+        other.remove_deck(deck.id())
+        time.sleep(0.06)
+        self.assertIsNone(self.service.get_deck(deck.id()))
+        self.assertEqual(list(self.service.decks()), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+from anki_scroll.lm_scheduler import (
+    LMScheduler,
+    Priority,
+    SchedulerConfig,
+    get_scheduler,
+    lm_priority,
+    set_scheduler,
+)
+from anki_scroll.service import card_generation
+from anki_scroll.service.card_generation import LLMCardGeneration
+from anki_scroll.services import Card
+
+
+class CountingBatches:
+    """stands for the llm, slow enough for the callers to overlap"""
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, theme, instructions, n):
+        with self._lock:
+            self.calls += 1
+            batch = self.calls
+        time.sleep(self.delay)
+        return [Card(question=f"{theme} {batch}.{i}", answer="answer") for i in range(n)]
+
+
+class ConcurrentGenerationTests(unittest.TestCase):
+    def setUp(self):
+        self.batches = CountingBatches()
+        patcher = mock.patch.object(card_generation, "_generate_cards", self.batches)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.generator = LLMCardGeneration(batch_size=4)
+
+    def _run(self, targets):
+        results = []
+        errors = []
+
+        def run(target):
+            try:
+                results.append(target())
+            except Exception as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=run, args=(target,)) for target in targets]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        return results
+
+    def test_single_batch_for_concurrent_calls(self):
+        cards = self._run([lambda: self.generator.create_card("History", "")] * 4)
+        self.assertEqual(self.batches.calls, 1)
+        self.assertEqual(len(set(cards)), 4)
+
+    def test_batch_per_spec(self):
+        self._run([
+            lambda: self.generator.create_card("History", ""),
+            lambda: self.generator.create_card("Geology", ""),
+        ])
+        self.assertEqual(self.batches.calls, 2)
+
+    def test_more_calls_than_a_batch(self):
+        cards = self._run([lambda: self.generator.create_card("History", "")] * 10)
+        self.assertEqual(self.batches.calls, 3)
+        self.assertEqual(len(set(cards)), 10)
+
+    def test_warm_ups_share_the_batch(self):
+        self._run([lambda: self.generator.warm_up("History", "")] * 3)
+        self.assertEqual(self.batches.calls, 1)
+        self.generator.create_card("History", "")
+        self.assertEqual(self.batches.calls, 1)
+
+
+class ScheduledBatches:
+    """stands for the llm, each batch takes a slot of the scheduler"""
+
+    def __init__(self):
+        self.priorities = []
+
+    def __call__(self, theme, instructions, n):
+        with get_scheduler().slot() as slot:
+            self.priorities.append(slot.priority)
+        return [Card(question=f"{theme} {i}", answer="answer") for i in range(n)]
+
+
+class WarmUpPriorityTests(unittest.TestCase):
+    def setUp(self):
+        previous = get_scheduler()
+        # a single slot for background calls
+        self.scheduler = LMScheduler(SchedulerConfig(max_concurrency=2, interactive_reserve=1))
+        set_scheduler(self.scheduler)
+        self.addCleanup(set_scheduler, previous)
+        self.batches = ScheduledBatches()
+        patcher = mock.patch.object(card_generation, "_generate_cards", self.batches)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.generator = LLMCardGeneration(batch_size=4)
+
+    def test_interactive_call_not_delayed_by_queued_warm_up(self):
+        # other background work holds the background slot, the warm-up queues
+        busy = self.scheduler.acquire(priority=Priority.BACKGROUND)
+
+        def warm_up():
+            with lm_priority(Priority.BACKGROUND):
+                self.generator.warm_up("History", "")
+
+        thread = threading.Thread(target=warm_up)
+        thread.start()
+        cards = []
+        user = threading.Thread(target=lambda: cards.append(self.generator.create_card("History", "")))
+        try:
+            time.sleep(0.05)
+            user.start()
+            user.join(1.0)
+            self.assertEqual(len(cards), 1, "the user waited behind the warm-up")
+            self.assertEqual(self.batches.priorities, [Priority.INTERACTIVE])
+            self.assertTrue(thread.is_alive())
+        finally:
+            self.scheduler.release(busy)
+            thread.join(5)
+            user.join(5)
+        # the warm-up batch is buffered once it could run
+        self.assertEqual(self.batches.priorities, [Priority.INTERACTIVE, Priority.BACKGROUND])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+
+from anki_scroll.service.dedup import MinHasher, MinHashIndex, NearDuplicateFilter, similarity
+from anki_scroll.services import Card
+
+
+class TestMinHash(unittest.TestCase):
+    def test_similarity(self):
+        hasher = MinHasher()
+        first = hasher.signature("What is the powerhouse of the cell?")
+        self.assertEqual(similarity(first, hasher.signature("what is the POWERHOUSE of the cell")), 1.0)
+        self.assertLess(similarity(first, hasher.signature("Who painted the Mona Lisa?")), 0.3)
+
+    def test_index(self):
+        hasher = MinHasher()
+        index = MinHashIndex(bands=16, threshold=0.7)
+        index.add("cell", hasher.signature("What is the powerhouse of the cell?"))
+        self.assertEqual(index.find(hasher.signature("What is the powerhouse of the cell")), "cell")
+        self.assertIsNone(index.find(hasher.signature("Who painted the Mona Lisa?")))
+        index.remove("cell")
+        self.assertEqual(len(index), 0)
+        self.assertIsNone(index.find(hasher.signature("What is the powerhouse of the cell?")))
+
+
+class TestNearDuplicateFilter(unittest.TestCase):
+    def setUp(self):
+        self.filter = NearDuplicateFilter()
+        self.card = Card(question="What is the powerhouse of the cell?", answer="Mitochondria")
+
+    def test_deck_cards(self):
+        self.filter.sync("deck", 1, [self.card])
+        self.assertTrue(self.filter.is_duplicate("deck", Card("what is the powerhouse of the cell", "?")))
+        self.assertFalse(self.filter.is_duplicate("deck", Card("Biology concept 2", "?")))
+        self.assertFalse(self.filter.is_duplicate("other", self.card))
+
+    def test_numbered_questions_are_distinct(self):
+        self.filter.sync("deck", 1, [Card("Biology concept 1", "A")])
+        self.assertFalse(self.filter.is_duplicate("deck", Card("Biology concept 2", "A")))
+
+    def test_added_keeps_version(self):
+        self.filter.sync("deck", 3, [])
+        other = Card("Who painted the Mona Lisa?", "Leonardo")
+        # a batch bumps the version once
+        self.filter.added("deck", [self.card, other], 4)
+        self.assertFalse(self.filter.needs_sync("deck", 4))
+        self.assertTrue(self.filter.needs_sync("deck", 5))
+        self.assertTrue(self.filter.is_duplicate("deck", self.card))
+        self.assertTrue(self.filter.is_duplicate("deck", other))
+
+    def test_added_to_unknown_deck(self):
+        self.filter.added("deck", [self.card], 1)
+        self.assertTrue(self.filter.needs_sync("deck", 1))
+        self.assertFalse(self.filter.is_duplicate("deck", self.card))
+
+    def test_served_is_bounded(self):
+        duplicate_filter = NearDuplicateFilter(served_limit=2)
+        duplicate_filter.served("deck", self.card)
+        self.assertTrue(duplicate_filter.is_duplicate("deck", self.card))
+        duplicate_filter.served("deck", Card("Who painted the Mona Lisa?", "Leonardo"))
+        duplicate_filter.served("deck", Card("When did the Roman empire fall?", "476"))
+        self.assertFalse(duplicate_filter.is_duplicate("deck", self.card))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,208 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+import dspy
+import httpx
+
+from anki_scroll.lm_scheduler import (
+    LMScheduler,
+    Priority,
+    SchedulerConfig,
+    SchedulerOverloaded,
+    current_priority,
+    get_scheduler,
+    lm_priority,
+    set_scheduler,
+)
+from anki_scroll.service.scheduled_lm import ScheduledLM
+from anki_scroll.services import Card, CardGenerator
+from anki_scroll.simple_services import SimpleDeckService
+from anki_scroll.webapp import WebState, build_app
+
+
+def _wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not reached")
+        time.sleep(0.005)
+
+
+class SchedulerTests(unittest.TestCase):
+    def _start(self, scheduler, priority, admitted, hold=None):
+        """acquire a slot in a thread, record the priority once admitted"""
+
+        def run():
+            slot = scheduler.acquire(priority=priority)
+            admitted.append(priority)
+            if hold is not None:
+                hold.wait(2)
+            scheduler.release(slot)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        return thread
+
+    def test_concurrency_cap(self):
+        scheduler = LMScheduler(SchedulerConfig(max_concurrency=2, interactive_reserve=0))
+        running = []
+        peak = []
+        lock = threading.Lock()
+
+        def call():
+            with scheduler.slot():
+                with lock:
+                    running.append(1)
+                    peak.append(len(running))
+                time.sleep(0.02)
+                with lock:
+                    running.pop()
+
+        threads = [threading.Thread(target=call) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(peak), 6)
+        self.assertLessEqual(max(peak), 2)
+
+    def test_interactive_admitted_before_background(self):
+        scheduler = LMScheduler(SchedulerConfig(max_concurrency=1, interactive_reserve=0))
+        held = scheduler.acquire(priority=Priority.BACKGROUND)
+        admitted = []
+        background = self._start(scheduler, Priority.BACKGROUND, admitted)
+        _wait_until(lambda: scheduler._queued[Priority.BACKGROUND] == 1)
+        interactive = self._start(scheduler, Priority.INTERACTIVE, admitted)
+        _wait_until(lambda: scheduler._queued[Priority.INTERACTIVE] == 1)
+        scheduler.release(held)
+        background.join()
+        interactive.join()
+        self.assertEqual(admitted, [Priority.INTERACTIVE, Priority.BACKGROUND])
+
+    def test_reserved_slot_for_interactive(self):
+        scheduler = LMScheduler(
+            SchedulerConfig(max_concurrency=2, interactive_reserve=1, background_timeout=0.05)
+        )
+        background = scheduler.acquire(priority=Priority.BACKGROUND)
+        with self.assertRaises(SchedulerOverloaded):
+            scheduler.acquire(priority=Priority.BACKGROUND)
+        interactive = scheduler.acquire(priority=Priority.INTERACTIVE)
+        scheduler.release(interactive)
+        scheduler.release(background)
+
+    def test_full_queue_rejected_immediately(self):
+        scheduler = LMScheduler(
+            SchedulerConfig(max_concurrency=2, interactive_reserve=1, max_background_queue=0)
+        )
+        # admitted right away, the queue limit only applies to waiting calls
+        held = scheduler.acquire(priority=Priority.BACKGROUND)
+        start = time.monotonic()
+        with self.assertRaises(SchedulerOverloaded):
+            scheduler.acquire(priority=Priority.BACKGROUND)
+        self.assertLess(time.monotonic() - start, 0.5)
+        scheduler.release(held)
+        scheduler.release(scheduler.acquire(priority=Priority.BACKGROUND))
+
+    def test_token_rate(self):
+        scheduler = LMScheduler(
+            SchedulerConfig(tokens_per_minute=600, interactive_timeout=0.05)
+        )
+        # the bucket starts full
+        scheduler.release(scheduler.acquire(tokens=600))
+        with self.assertRaises(SchedulerOverloaded):
+            scheduler.acquire(tokens=100)
+        # 10 tokens per second
+        scheduler.release(scheduler.acquire(tokens=1))
+
+    def test_reported_usage_is_charged(self):
+        scheduler = LMScheduler(
+            SchedulerConfig(tokens_per_minute=600, interactive_timeout=0.05)
+        )
+        with scheduler.slot(tokens=10) as slot:
+            slot.used = 600
+        with self.assertRaises(SchedulerOverloaded):
+            scheduler.acquire(tokens=10)
+
+    def test_priority_of_context(self):
+        scheduler = LMScheduler()
+        self.assertEqual(current_priority(), Priority.INTERACTIVE)
+        with lm_priority(Priority.BACKGROUND):
+            slot = scheduler.acquire()
+        self.assertEqual(slot.priority, Priority.BACKGROUND)
+        scheduler.release(slot)
+        self.assertEqual(current_priority(), Priority.INTERACTIVE)
+
+    def test_invalid_config(self):
+        with self.assertRaises(ValueError):
+            SchedulerConfig(max_concurrency=1, interactive_reserve=1)
+
+
+class RecordingScheduler(LMScheduler):
+    def __init__(self):
+        super().__init__()
+        self.used = []
+
+    def release(self, slot):
+        self.used.append(slot.used)
+        super().release(slot)
+
+
+class ScheduledLMTests(unittest.TestCase):
+    def setUp(self):
+        previous = get_scheduler()
+        self.scheduler = RecordingScheduler()
+        set_scheduler(self.scheduler)
+        self.addCleanup(set_scheduler, previous)
+
+    def test_usage_of_each_call(self):
+        lm = ScheduledLM("openai/test")
+        recorded = threading.Event()
+        other_done = threading.Event()
+
+        def call(self, prompt=None, *, messages=None, **kwargs):
+            tokens = int(prompt)
+            dspy.settings.usage_tracker.add_usage(self.model, {"total_tokens": tokens})
+            self.history.append({"usage": {"total_tokens": tokens}})
+            if tokens == 10:
+                # the other call ends after this one recorded its usage
+                recorded.set()
+                other_done.wait(2)
+            return [str(tokens)]
+
+        def other():
+            recorded.wait(2)
+            lm("20")
+            other_done.set()
+
+        with mock.patch.object(dspy.LM, "__call__", call):
+            threads = [threading.Thread(target=lm, args=("10",)), threading.Thread(target=other)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(self.scheduler.used, [20, 10])
+
+
+class OverloadedGenerator(CardGenerator):
+    def create_card(self, theme: str, instructions: str) -> Card:
+        raise SchedulerOverloaded("too many interactive model calls waiting")
+
+
+class OverloadedRouteTests(unittest.IsolatedAsyncioTestCase):
+    async def test_service_unavailable(self):
+        state = WebState(deck_service=SimpleDeckService(), card_generator=OverloadedGenerator())
+        transport = httpx.ASGITransport(app=build_app(state))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            deck_id = (await client.get("/api/v1/decks")).json()[0]["id"]
+            spec = await client.post(f"/api/v1/decks/{deck_id}/specs", json={"theme": "t"})
+            response = await client.get(
+                f"/api/v1/decks/{deck_id}/specs/{spec.json()['id']}/candidates"
+            )
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("retry-after", response.headers)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,215 @@
+import os
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from anki_scroll.log_service import LogConfig, LogDeckService
+from anki_scroll.services import Card
+from deck_service_contract import DeckServiceContract
+
+
+class LogServiceTestCase(unittest.TestCase):
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self.log_path = Path(self._tempdir.name) / "test.log"
+        self.config = LogConfig(path=str(self.log_path), background_compaction=False)
+        self.service = LogDeckService(config=self.config)
+
+    def tearDown(self):
+        self.service.close()
+        self._tempdir.cleanup()
+
+    def reopen(self) -> LogDeckService:
+        self.service.close()
+        self.service = LogDeckService(config=self.config)
+        return self.service
+
+
+class TestLogDeckContract(DeckServiceContract, LogServiceTestCase):
+    pass
+
+
+class TestLogPersistence(LogServiceTestCase):
+    def test_reopen(self):
+        deck = self.service.create_deck("Persistent")
+        card_a = Card(question="a", answer="1")
+        card_b = Card(question="b", answer="2")
+        deck.add_many([card_a, card_b, card_a])
+        deck.remove(card_a)
+        removed = self.service.create_deck("Removed")
+        removed.add(card_a)
+        self.service.remove_deck(removed.id())
+        stats = deck.stats()
+
+        service = self.reopen()
+        reopened = service.get_deck(deck.id())
+        self.assertEqual(list(reopened), [card_b, card_a])
+        self.assertEqual(reopened.stats(), stats)
+        self.assertIsNone(service.get_deck(removed.id()))
+
+    def test_reopen_loads_saved_index(self):
+        deck = self.service.create_deck("Indexed")
+        cards = [Card(question=f"q{i}", answer="a") for i in range(5)]
+        deck.add_many(cards)
+        deck.remove(cards[0])
+        stats = deck.stats()
+        dead = self.service._dead_records()
+        self.service.close()
+        with mock.patch.object(LogDeckService, "_replay") as replay:
+            self.service = LogDeckService(config=self.config)
+        replay.assert_not_called()
+        reopened = self.service.get_deck(deck.id())
+        self.assertEqual(list(reopened), cards[1:])
+        self.assertEqual(reopened.stats(), stats)
+        self.assertEqual(self.service._dead_records(), dead)
+        reopened.remove(cards[1])
+        self.assertEqual(list(reopened), cards[2:])
+
+    def test_stale_index_is_ignored(self):
+        deck = self.service.create_deck("Stale")
+        deck.add(Card(question="q", answer="a"))
+        self.service.close()
+        index_path = self.log_path.with_name(self.log_path.name + ".index")
+        saved = index_path.read_bytes()
+        self.service = LogDeckService(config=self.config)
+        self.assertFalse(index_path.exists())
+        self.service.get_deck(deck.id()).add(Card(question="q2", answer="a2"))
+        self.service.close()
+        index_path.write_bytes(saved)
+        service = LogDeckService(config=self.config)
+        self.service = service
+        self.assertEqual(len(list(service.get_deck(deck.id()))), 2)
+        self.service.close()
+        index_path.write_bytes(index_path.read_bytes()[:-4])
+        self.service = LogDeckService(config=self.config)
+        self.assertEqual(len(list(self.service.get_deck(deck.id()))), 2)
+
+    def test_truncated_record_is_dropped(self):
+        deck = self.service.create_deck("Torn")
+        card = Card(question="kept", answer="1")
+        deck.add(card)
+        deck.add(Card(question="torn", answer="2"))
+        self.service.close()
+        size = self.log_path.stat().st_size
+        with open(self.log_path, "r+b") as file:
+            file.truncate(size - 3)
+        self.service = LogDeckService(config=self.config)
+        reopened = self.service.get_deck(deck.id())
+        self.assertEqual(list(reopened), [card])
+        reopened.add(Card(question="after", answer="3"))
+        service = self.reopen()
+        self.assertEqual(len(list(service.get_deck(deck.id()))), 2)
+
+    def test_compaction(self):
+        deck = self.service.create_deck("Compacted")
+        cards = [Card(question=f"q{i}", answer=f"a{i}") for i in range(100)]
+        deck.add_many(cards)
+        for card in cards[:90]:
+            deck.remove(card)
+        stats = deck.stats()
+        size = self.log_path.stat().st_size
+        iterator = iter(deck)
+        self.service.compact()
+        self.assertLess(self.log_path.stat().st_size, size)
+        self.assertEqual(list(iterator), cards[90:])
+        self.assertEqual(list(deck), cards[90:])
+        deck.remove(cards[95])
+        deck.add(cards[0])
+        expected = cards[90:95] + cards[96:] + cards[:1]
+        self.assertEqual(list(deck), expected)
+        self.assertGreater(deck.stats().version, stats.version)
+
+        service = self.reopen()
+        reopened = service.get_deck(deck.id())
+        self.assertEqual(list(reopened), expected)
+        self.assertGreater(reopened.stats().version, stats.version)
+        self.assertEqual(reopened.stats().incarnation, stats.incarnation)
+
+    def test_writes_during_compaction(self):
+        deck = self.service.create_deck("Busy")
+        cards = [Card(question=f"q{i}", answer=f"a{i}") for i in range(20)]
+        deck.add_many(cards)
+        deck.remove(cards[0])
+        gone = self.service.create_deck("Gone")
+        gone.add(cards[0])
+        fsync = os.fsync
+        writers = []
+
+        def write():
+            # removes cards copied by the compaction and cards appended after it
+            deck.add(cards[0])
+            deck.remove(cards[1])
+            deck.remove(cards[0])
+            self.service.create_deck("New").add(cards[2])
+            self.service.remove_deck(gone.id())
+
+        def fsync_copy(fd):
+            # the live records are written, the log must still be writable
+            if not writers:
+                writer = threading.Thread(target=write)
+                writers.append(writer)
+                writer.start()
+                writer.join(timeout=5)
+                self.assertFalse(writer.is_alive(), "compaction holds the lock while copying")
+            fsync(fd)
+
+        with mock.patch("anki_scroll.log_service.os.fsync", fsync_copy):
+            self.service.compact()
+        expected = cards[2:]
+        self.assertEqual(list(deck), expected)
+        stats = deck.stats()
+        dead = self.service._dead_records()
+
+        service = self.reopen()
+        self.assertEqual(list(service.get_deck(deck.id())), expected)
+        self.assertEqual(service.get_deck(deck.id()).stats(), stats)
+        self.assertIsNone(service.get_deck(gone.id()))
+        new = next(d for d in service.decks() if d.name() == "New")
+        self.assertEqual(list(new), [cards[2]])
+        self.assertEqual(service._dead_records(), dead)
+
+    def test_dead_records_match_replay(self):
+        deck = self.service.create_deck("Counted")
+        cards = [Card(question=f"q{i}", answer="a") for i in range(5)]
+        deck.add_many(cards)
+        deck.remove(cards[0])
+        removed = self.service.create_deck("Removed")
+        removed.add_many(cards)
+        self.service.remove_deck(removed.id())
+        # 1 card and its tombstone, the removed deck with its cards and the drop record
+        self.assertEqual(self.service._dead_records(), 2 + 1 + 5 + 1)
+        self.assertEqual(self.reopen()._dead_records(), 2 + 1 + 5 + 1)
+        self.service.compact()
+        self.assertEqual(self.service._dead_records(), 0)
+        self.service.remove_deck(deck.id())
+        dead = self.service._dead_records()
+        self.assertEqual(self.reopen()._dead_records(), dead)
+
+    def test_automatic_compaction(self):
+        config = LogConfig(
+            path=str(Path(self._tempdir.name) / "auto.log"),
+            min_dead_records=10,
+            background_compaction=False,
+        )
+        service = LogDeckService(config=config)
+        try:
+            deck = service.create_deck("Auto")
+            cards = [Card(question=f"q{i}", answer="a") for i in range(20)]
+            deck.add_many(cards)
+            size = Path(config.path).stat().st_size
+            for card in cards:
+                deck.remove(card)
+            self.assertEqual(list(deck), [])
+            self.assertLess(Path(config.path).stat().st_size, size)
+        finally:
+            service.close()
+
+    def test_single_process(self):
+        with self.assertRaises(RuntimeError):
+            LogDeckService(config=self.config)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+
+from anki_scroll.metrics import Registry
+
+
+class TestRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter(self):
+        counter = self.registry.counter("requests_total", "Requests.", ("route",))
+        counter.labels("/a").inc()
+        counter.labels("/a").inc(2)
+        counter.labels('quote"d').inc()
+        text = self.registry.render()
+        self.assertIn("# TYPE requests_total counter", text)
+        self.assertIn('requests_total{route="/a"} 3.0', text)
+        self.assertIn('requests_total{route="quote\\"d"} 1.0', text)
+        with self.assertRaises(ValueError):
+            counter.labels("/a").inc(-1)
+
+    def test_gauge(self):
+        gauge = self.registry.gauge("in_progress", "In progress.")
+        gauge.inc()
+        gauge.inc()
+        gauge.dec()
+        self.assertIn("in_progress 1.0", self.registry.render())
+
+    def test_histogram(self):
+        histogram = self.registry.histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0))
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+        text = self.registry.render()
+        self.assertIn('latency_seconds_bucket{le="0.1"} 1', text)
+        self.assertIn('latency_seconds_bucket{le="1.0"} 2', text)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 3', text)
+        self.assertIn("latency_seconds_sum 5.55", text)
+        self.assertIn("latency_seconds_count 3", text)
+
+    def test_wrong_labels(self):
+        counter = self.registry.counter("labelled_total", "Labelled.", ("route",))
+        with self.assertRaises(ValueError):
+            counter.inc()
+        with self.assertRaises(ValueError):
+            counter.labels("a", "b")
+
+    def test_duplicate_name(self):
+        self.registry.counter("twice_total", "Twice.")
+        with self.assertRaises(ValueError):
+            self.registry.counter("twice_total", "Twice.")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+import pstats
+import tempfile
+import unittest
+from pathlib import Path
+
+import httpx
+
+from anki_scroll.simple_services import SimpleDeckService
+from anki_scroll.webapp import WebState, build_app
+from anki_scroll.webapp.profiling import ProfilingConfig
+
+
+class ProfilingTestCase(unittest.IsolatedAsyncioTestCase):
+    config = ProfilingConfig()
+
+    async def asyncSetUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self.directory = Path(self._tempdir.name)
+        state = WebState(deck_service=SimpleDeckService())
+        transport = httpx.ASGITransport(app=build_app(state, profiling=self.profiling_config()))
+        self.client = httpx.AsyncClient(transport=transport, base_url="http://test")
+
+    def profiling_config(self):
+        return ProfilingConfig()
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+        self._tempdir.cleanup()
+
+
+class TestProfilingDisabled(ProfilingTestCase):
+    async def test_no_profile(self):
+        response = await self.client.get("/home/", params={"profile": "1"})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("x-profile-dump", response.headers)
+
+    async def test_no_admin_routes(self):
+        response = await self.client.post("/admin/tracemalloc/snapshot")
+        self.assertEqual(response.status_code, 404)
+
+
+class TestProfilingEnabled(ProfilingTestCase):
+    def profiling_config(self):
+        return ProfilingConfig(directory=str(self.directory))
+
+    async def test_profile_request(self):
+        response = await self.client.get("/home/", headers={"X-Profile": "1"})
+        self.assertEqual(response.status_code, 200)
+        dump = self.directory / response.headers["x-profile-dump"]
+        self.assertTrue(dump.exists())
+        self.assertGreater(pstats.Stats(str(dump)).total_calls, 0)
+
+    async def test_not_requested(self):
+        response = await self.client.get("/home/")
+        self.assertNotIn("x-profile-dump", response.headers)
+        self.assertEqual(list(self.directory.iterdir()), [])
+
+    async def test_tracemalloc_diff(self):
+        try:
+            first = (await self.client.post("/admin/tracemalloc/snapshot")).json()
+            self.assertFalse(first["compared_to_previous"])
+            grown = [bytearray(1000) for _ in range(1000)]
+            second = (await self.client.post("/admin/tracemalloc/snapshot", params={"limit": 5})).json()
+            self.assertTrue(second["compared_to_previous"])
+            self.assertLessEqual(len(second["statistics"]), 5)
+            self.assertGreater(second["statistics"][0]["size_diff"], 900_000)
+            self.assertTrue((self.directory / second["dump"]).exists())
+            del grown
+        finally:
+            await self.client.post("/admin/tracemalloc/stop")
+
+
+class TestProfilingToken(ProfilingTestCase):
+    def profiling_config(self):
+        return ProfilingConfig(directory=str(self.directory), token="secret")
+
+    async def test_token_required(self):
+        response = await self.client.get("/home/", params={"profile": "1"})
+        self.assertNotIn("x-profile-dump", response.headers)
+        response = await self.client.post("/admin/tracemalloc/snapshot")
+        self.assertEqual(response.status_code, 403)
+        response = await self.client.get(
+            "/home/", params={"profile": "1"}, headers={"X-Profile-Token": "secret"}
+        )
+        self.assertIn("x-profile-dump", response.headers)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,256 @@
+import sqlite3
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from anki_scroll.caching_service import CachingDeckService
+from anki_scroll.scheduling import AGAIN, GOOD, SECONDS_PER_DAY, sm2
+from anki_scroll.services import Card, ReviewState
+from anki_scroll.simple_services import SimpleDeck, SimpleDeckService, SimpleReviewService
+from anki_scroll.sql_service import SqlConfig, SqlDeckService
+
+NOW = 1_700_000_000.0
+
+
+class TestSm2(unittest.TestCase):
+    def test_intervals(self):
+        state = ReviewState(card_id=0, card=Card("Q", "A"), due=NOW)
+        state = sm2(state, GOOD, NOW)
+        self.assertEqual(state.interval, 1.0)
+        state = sm2(state, GOOD, NOW)
+        self.assertEqual(state.interval, 6.0)
+        state = sm2(state, GOOD, NOW)
+        self.assertEqual(state.interval, round(6.0 * state.ease))
+        self.assertEqual(state.due, NOW + state.interval * SECONDS_PER_DAY)
+        self.assertEqual(state.repetitions, 3)
+
+    def test_forgotten(self):
+        state = ReviewState(card_id=0, card=Card("Q", "A"), due=NOW, interval=20, repetitions=4)
+        state = sm2(state, AGAIN, NOW)
+        self.assertEqual(state.repetitions, 0)
+        self.assertEqual(state.interval, 1.0)
+        self.assertLess(state.ease, 2.5)
+
+    def test_ease_floor(self):
+        state = ReviewState(card_id=0, card=Card("Q", "A"), due=NOW, ease=1.3)
+        self.assertEqual(sm2(state, 0, NOW).ease, 1.3)
+
+    def test_invalid_grade(self):
+        state = ReviewState(card_id=0, card=Card("Q", "A"), due=NOW)
+        with self.assertRaises(ValueError):
+            sm2(state, 6, NOW)
+
+
+class ReviewServiceTests:
+    """Behaviour shared by all the review services, mixed into TestCase subclasses."""
+
+    def test_new_cards_are_due(self):
+        deck = self.deck_service.create_deck("Review")
+        deck.add(Card("Q1", "A1"))
+        deck.add(Card("Q2", "A2"))
+        state = self.review_service.next_due(deck.id(), now=self.now + 10)
+        self.assertEqual(state.card, Card("Q1", "A1"))
+        self.assertIsNone(self.review_service.next_due(deck.id(), now=self.now - 3600))
+
+    def test_grade_reschedules(self):
+        deck = self.deck_service.create_deck("Grade")
+        deck.add(Card("Q1", "A1"))
+        deck.add(Card("Q2", "A2"))
+        first = self.review_service.next_due(deck.id(), now=self.now + 10)
+        graded = self.review_service.grade(deck.id(), first.card_id, GOOD, now=self.now + 10)
+        self.assertEqual(graded.due, self.now + 10 + SECONDS_PER_DAY)
+        second = self.review_service.next_due(deck.id(), now=self.now + 10)
+        self.assertEqual(second.card, Card("Q2", "A2"))
+        self.review_service.grade(deck.id(), second.card_id, AGAIN, now=self.now + 10)
+        self.assertIsNone(self.review_service.next_due(deck.id(), now=self.now + 20))
+        later = self.review_service.next_due(deck.id(), now=self.now + 2 * SECONDS_PER_DAY)
+        self.assertEqual(later.card, Card("Q1", "A1"))
+
+    def test_removed_card(self):
+        deck = self.deck_service.create_deck("Removed")
+        deck.add(Card("Q1", "A1"))
+        state = self.review_service.next_due(deck.id(), now=self.now + 10)
+        deck.remove(Card("Q1", "A1"))
+        self.assertIsNone(self.review_service.next_due(deck.id(), now=self.now + 10))
+        with self.assertRaises(LookupError):
+            self.review_service.grade(deck.id(), state.card_id, GOOD, now=self.now + 10)
+
+    def test_unknown_card(self):
+        deck = self.deck_service.create_deck("Unknown")
+        with self.assertRaises(LookupError):
+            self.review_service.grade(deck.id(), 12345, GOOD, now=self.now)
+
+
+class TestSimpleReviewService(ReviewServiceTests, unittest.TestCase):
+    def setUp(self):
+        self.deck_service = SimpleDeckService()
+        self.now = time.time() + 60
+        self.review_service = SimpleReviewService(self.deck_service)
+
+    def test_duplicate_cards_keep_their_state(self):
+        deck = self.deck_service.create_deck("Duplicates")
+        deck.add(Card("Q", "A"))
+        deck.add(Card("Q", "A"))
+        first = self.review_service.next_due(deck.id(), now=NOW)
+        self.review_service.grade(deck.id(), first.card_id, GOOD, now=NOW)
+        deck.add(Card("Other", "A"))
+        second = self.review_service.next_due(deck.id(), now=NOW)
+        self.assertNotEqual(second.card_id, first.card_id)
+        self.assertEqual(second.card, Card("Q", "A"))
+
+    def test_changes_without_scanning_the_deck(self):
+        deck = self.deck_service.create_deck("Incremental")
+        deck.add_many([Card("Q1", "A1"), Card("Q2", "A2")])
+        with mock.patch.object(SimpleDeck, "__iter__", side_effect=AssertionError("deck scanned")):
+            first = self.review_service.next_due(deck.id(), now=NOW)
+            self.review_service.grade(deck.id(), first.card_id, GOOD, now=NOW)
+            deck.remove(Card("Q2", "A2"))
+            deck.add(Card("Q3", "A3"))
+            self.assertEqual(self.review_service.next_due(deck.id(), now=NOW).card, Card("Q3", "A3"))
+            deck.remove(Card("Q1", "A1"))
+            with self.assertRaises(LookupError):
+                self.review_service.grade(deck.id(), first.card_id, GOOD, now=NOW)
+
+    def test_removed_states_are_pruned(self):
+        deck = self.deck_service.create_deck("Pruned")
+        cards = [Card(f"Q{i}", "A") for i in range(200)]
+        deck.add_many(cards)
+        self.review_service.next_due(deck.id(), now=NOW)
+        deck.remove_many(cards[:190])
+        deck.add(Card("new", "A"))
+        self.review_service.next_due(deck.id(), now=NOW)
+        self.assertEqual(len(self.review_service._queues[deck.id()].states), 11)
+
+    def test_recreated_deck(self):
+        deck = self.deck_service.create_deck("Recreated")
+        deck.add(Card("old", "A"))
+        self.review_service.next_due(deck.id(), now=NOW)
+        self.deck_service.remove_deck(deck.id())
+        recreated = self.deck_service.create_deck("Recreated")
+        recreated.add(Card("new", "A"))
+        self.assertEqual(self.review_service.next_due(recreated.id(), now=NOW).card, Card("new", "A"))
+
+
+class TestSimpleReviewServiceOtherDecks(ReviewServiceTests, unittest.TestCase):
+    """Decks other than SimpleDeck are reconciled by a pass over their cards."""
+
+    def setUp(self):
+        self.deck_service = CachingDeckService(SimpleDeckService(), shared=False)
+        self.now = time.time() + 60
+        self.review_service = SimpleReviewService(self.deck_service)
+
+
+class TestSqlReviewService(ReviewServiceTests, unittest.TestCase):
+    def setUp(self):
+        self._tempdir = tempfile.TemporaryDirectory()
+        self.db_path = Path(self._tempdir.name) / "test.sqlite"
+        self.deck_service = SqlDeckService(config=SqlConfig(database=str(self.db_path)))
+        self.review_service = self.deck_service.review_service()
+        # cards are due from their insertion time
+        self.now = time.time() + 60
+
+    def tearDown(self):
+        self._tempdir.cleanup()
+
+    def test_next_due_uses_index(self):
+        with sqlite3.connect(str(self.db_path)) as conn:
+            plan = conn.execute(
+                "EXPLAIN QUERY PLAN SELECT card_id FROM reviews WHERE deck_id = ? AND due <= ? ORDER BY due LIMIT 1",
+                ("deck", NOW),
+            ).fetchall()
+        self.assertIn("reviews_by_due", " ".join(row[-1] for row in plan))
+
+    def test_reviews_removed_with_deck(self):
+        deck = self.deck_service.create_deck("Dropped")
+        deck.add_many([Card("Q1", "A1"), Card("Q2", "A2")])
+        self.deck_service.remove_deck(deck.id())
+        with sqlite3.connect(str(self.db_path)) as conn:
+            count = conn.execute("SELECT COUNT(*) FROM reviews").fetchone()[0]
+        self.assertEqual(count, 0)
+
+    def test_card_ids_survive_vacuum(self):
+        deck = self.deck_service.create_deck("Vacuumed")
+        deck.add_many([Card("Q1", "A1"), Card("Q2", "A2"), Card("Q3", "A3")])
+        deck.remove(Card("Q1", "A1"))
+        second = self.review_service.next_due(deck.id(), now=self.now)
+        self.review_service.grade(deck.id(), second.card_id, GOOD, now=self.now)
+        third = self.review_service.next_due(deck.id(), now=self.now)
+        with sqlite3.connect(str(self.db_path)) as conn:
+            conn.execute("VACUUM")
+        self.assertEqual(self.review_service.next_due(deck.id(), now=self.now), third)
+        graded = self.review_service.grade(deck.id(), second.card_id, GOOD, now=self.now)
+        self.assertEqual(graded.card, Card("Q2", "A2"))
+        self.assertEqual(graded.repetitions, 2)
+
+    def test_card_ids_not_reused(self):
+        deck = self.deck_service.create_deck("Reused")
+        deck.add(Card("Q1", "A1"))
+        first = self.review_service.next_due(deck.id(), now=self.now)
+        deck.remove(Card("Q1", "A1"))
+        deck.add(Card("Q2", "A2"))
+        with self.assertRaises(LookupError):
+            self.review_service.grade(deck.id(), first.card_id, GOOD, now=self.now)
+
+    def test_card_id_migration(self):
+        legacy_path = Path(self._tempdir.name) / "legacy.sqlite"
+        with sqlite3.connect(str(legacy_path)) as conn:
+            conn.executescript(
+                """
+                CREATE TABLE decks (id TEXT PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+                CREATE TABLE cards (
+                    deck_id TEXT NOT NULL,
+                    question TEXT NOT NULL,
+                    answer TEXT NOT NULL,
+                    FOREIGN KEY(deck_id) REFERENCES decks(id) ON DELETE CASCADE
+                );
+                CREATE TABLE deck_stats (
+                    deck_id TEXT PRIMARY KEY,
+                    count INTEGER NOT NULL DEFAULT 0,
+                    modified_at REAL NOT NULL,
+                    version INTEGER NOT NULL DEFAULT 0,
+                    incarnation INTEGER NOT NULL DEFAULT 0,
+                    FOREIGN KEY(deck_id) REFERENCES decks(id) ON DELETE CASCADE
+                );
+                CREATE TABLE reviews (
+                    card_id INTEGER PRIMARY KEY,
+                    deck_id TEXT NOT NULL,
+                    due REAL NOT NULL,
+                    interval REAL NOT NULL DEFAULT 0,
+                    ease REAL NOT NULL DEFAULT 2.5,
+                    repetitions INTEGER NOT NULL DEFAULT 0,
+                    FOREIGN KEY(deck_id) REFERENCES decks(id) ON DELETE CASCADE
+                );
+                CREATE TRIGGER reviews_on_card_delete AFTER DELETE ON cards
+                BEGIN
+                    DELETE FROM reviews WHERE card_id = OLD.rowid;
+                END;
+                INSERT INTO decks VALUES ('legacy', 'Legacy');
+                INSERT INTO cards (rowid, deck_id, question, answer) VALUES
+                    (1, 'legacy', 'Q1', 'A1'), (5, 'legacy', 'Q2', 'A2');
+                INSERT INTO deck_stats VALUES ('legacy', 2, 0, 7, 42);
+                INSERT INTO reviews (card_id, deck_id, due, repetitions) VALUES
+                    (1, 'legacy', 9e9, 3), (5, 'legacy', 0, 0);
+                """
+            )
+        deck_service = SqlDeckService(config=SqlConfig(database=str(legacy_path)))
+        review_service = deck_service.review_service()
+        deck = deck_service.get_deck("legacy")
+        self.assertEqual(deck.stats().count, 2)
+        self.assertEqual(deck.stats().version, 7)
+        due = review_service.next_due("legacy", now=self.now)
+        self.assertEqual((due.card_id, due.card), (5, Card("Q2", "A2")))
+        graded = review_service.grade("legacy", 1, GOOD, now=self.now)
+        self.assertEqual((graded.card, graded.repetitions), (Card("Q1", "A1"), 4))
+        # the triggers are back
+        deck.add(Card("Q3", "A3"))
+        self.assertEqual(deck.stats().count, 3)
+        deck.remove(Card("Q2", "A2"))
+        self.assertEqual(review_service.next_due("legacy", now=self.now).card, Card("Q3", "A3"))
+        # the migration runs once
+        SqlDeckService(config=SqlConfig(database=str(legacy_path)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,6 +2,7 @@ import unittest
 
 from anki_scroll.services import Card
 from anki_scroll.simple_services import SimpleDeck, SimpleDeckService
+from deck_service_contract import DeckServiceContract
 
 
 class TestSimpleDeck(unittest.TestCase):
@@ -29,6 +30,37 @@ class TestSimpleDeck(unittest.TestCase):
         deck.remove(card)
         self.assertNotIn(card, list(deck))
 
+    def test_remove_many(self):
+        deck = SimpleDeck("batch")
+        first, second = Card(question="q1", answer="a1"), Card(question="q2", answer="a2")
+        deck.add_many([first, second, first])
+        version = deck.stats().version
+        removed = deck.remove_many([first, Card(question="missing", answer="a")])
+        self.assertEqual(removed, 1)
+        self.assertEqual(list(deck), [second, first])
+        self.assertEqual(deck.stats().version, version + 1)
+
+    def test_remove_duplicates(self):
+        deck = SimpleDeck("duplicates")
+        card_a = Card(question="a", answer="1")
+        card_b = Card(question="b", answer="2")
+        deck.add_many([card_a, card_b, card_a])
+        deck.remove(card_a)
+        self.assertEqual(list(deck), [card_b, card_a])
+        deck.remove(card_a)
+        deck.remove(card_a)
+        self.assertEqual(list(deck), [card_b])
+        deck.add(card_a)
+        self.assertEqual(list(deck), [card_b, card_a])
+
+    def test_iter_snapshot(self):
+        deck = SimpleDeck("snapshot")
+        card_a = Card(question="a", answer="1")
+        deck.add(card_a)
+        iterator = iter(deck)
+        deck.add(Card(question="b", answer="2"))
+        self.assertEqual(list(iterator), [card_a])
+
     def test_iter(self):
         deck = SimpleDeck("art")
         card_a = Card(question="a", answer="1")
@@ -37,6 +69,41 @@ class TestSimpleDeck(unittest.TestCase):
         deck.add(card_b)
         self.assertEqual(list(deck), [card_a, card_b])
 
+    def test_added_since(self):
+        deck = SimpleDeck("sequences")
+        cards = [Card(question=f"q{i}", answer="a") for i in range(3)]
+        deck.add_many(cards)
+        self.assertEqual(deck.added_since(-1), (2, list(enumerate(cards))))
+        deck.remove(cards[1])
+        self.assertFalse(deck.has_sequence(1))
+        self.assertTrue(deck.has_sequence(2))
+        self.assertEqual(deck.added_since(0), (2, [(2, cards[2])]))
+        deck.add(cards[1])
+        self.assertEqual(deck.added_since(2), (3, [(3, cards[1])]))
+        self.assertEqual(deck.added_since(3), (3, []))
+
+    def test_stats(self):
+        deck = SimpleDeck("stats")
+        card = Card(question="q", answer="a")
+        initial = deck.stats()
+        self.assertEqual(initial.count, 0)
+        deck.add(card)
+        added = deck.stats()
+        self.assertEqual(added.count, 1)
+        self.assertGreater(added.version, initial.version)
+        deck.remove(Card(question="missing", answer="missing"))
+        self.assertEqual(deck.stats(), added)
+        deck.remove(card)
+        self.assertEqual(deck.stats().count, 0)
+        self.assertGreater(deck.stats().version, added.version)
+
+
+class TestSimpleDeckContract(DeckServiceContract, unittest.TestCase):
+    removed_deck_raises = False
+
+    def setUp(self):
+        self.service = SimpleDeckService()
+
 
 class TestSimpleDeckService(unittest.TestCase):
     def test_decks(self):
@@ -1,12 +1,18 @@
+import multiprocessing
+import os
 import sqlite3
 import tempfile
+import threading
 import unittest
+import zlib
 from hashlib import sha256
 from pathlib import Path
+from unittest import mock
 
 from anki_scroll.services import Card
 from anki_scroll.simple_services import SimpleDeck
-from anki_scroll.sql_service import SqlConfig, SqlDeckService
+from anki_scroll.sql_service import AnswerCodec, SqlConfig, SqlDeckService, train_dictionary
+from deck_service_contract import DeckServiceContract
 
 
 class SqlServiceTestCase(unittest.TestCase):
@@ -25,83 +31,257 @@ class SqlServiceTestCase(unittest.TestCase):
         return conn
 
 
-class TestSqlDeck(SqlServiceTestCase):
-    def test_name(self):
-        deck = self.service.create_deck("History")
-        self.assertIsNotNone(deck)
-        self.assertEqual(deck.name(), "History")
+class TestSqlDeckContract(DeckServiceContract, SqlServiceTestCase):
+    pass
 
-    def test_id(self):
-        deck = self.service.create_deck("Science")
-        self.assertIsNotNone(deck)
-        expected = sha256("Science".encode("utf-8")).hexdigest()
-        self.assertEqual(deck.id(), expected)
 
-    def test_add(self):
-        deck = self.service.create_deck("Add Deck")
+class TestSqlDeckService(SqlServiceTestCase):
+    def test_incarnation_migration(self):
+        legacy_path = Path(self._tempdir.name) / "legacy.sqlite"
+        conn = sqlite3.connect(str(legacy_path))
+        conn.executescript(
+            """
+            CREATE TABLE decks (id TEXT PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+            CREATE TABLE deck_stats (
+                deck_id TEXT PRIMARY KEY,
+                count INTEGER NOT NULL DEFAULT 0,
+                modified_at REAL NOT NULL,
+                version INTEGER NOT NULL DEFAULT 0,
+                FOREIGN KEY(deck_id) REFERENCES decks(id) ON DELETE CASCADE
+            );
+            CREATE TRIGGER deck_stats_on_deck_insert AFTER INSERT ON decks
+            BEGIN
+                INSERT OR IGNORE INTO deck_stats (deck_id, count, modified_at, version)
+                VALUES (NEW.id, 0, 0, 0);
+            END;
+            INSERT INTO decks (id, name) VALUES ('legacy', 'Legacy');
+            """
+        )
+        conn.close()
+        service = SqlDeckService(config=SqlConfig(database=str(legacy_path)))
+        self.assertEqual(service.get_deck("legacy").stats().count, 0)
+        first = service.create_deck("New").stats().incarnation
+        service.remove_deck(sha256(b"New").hexdigest())
+        self.assertNotEqual(service.create_deck("New").stats().incarnation, first)
+        # the migration runs once
+        SqlDeckService(config=SqlConfig(database=str(legacy_path)))
+
+    def test_add_deck_stats(self):
+        donor = SimpleDeck("Donor Stats")
+        donor.add(Card(question="1", answer="1"))
+        donor.add(Card(question="2", answer="2"))
+        self.service.add_deck(donor)
+        retrieved = self.service.get_deck(donor.id())
+        self.assertEqual(retrieved.stats().count, 2)
+
+    def test_stats_backfill_existing_database(self):
+        legacy_path = Path(self._tempdir.name) / "legacy.sqlite"
+        conn = sqlite3.connect(str(legacy_path))
+        conn.executescript(
+            """
+            CREATE TABLE decks (id TEXT PRIMARY KEY, name TEXT NOT NULL UNIQUE);
+            CREATE TABLE cards (deck_id TEXT NOT NULL, question TEXT NOT NULL, answer TEXT NOT NULL);
+            INSERT INTO decks (id, name) VALUES ('legacy', 'Legacy');
+            INSERT INTO cards (deck_id, question, answer) VALUES ('legacy', 'Q', 'A');
+            """
+        )
+        conn.close()
+        service = SqlDeckService(config=SqlConfig(database=str(legacy_path)))
+        deck = service.get_deck("legacy")
+        self.assertEqual(deck.stats().count, 1)
+        deck.add(Card(question="Q2", answer="A2"))
+        self.assertEqual(deck.stats().count, 2)
+
+def _add_cards(database: str, deck_id: str, worker: int, single_writer: bool):
+    service = SqlDeckService(
+        config=SqlConfig(database=database, single_writer=single_writer)
+    )
+    deck = service.get_deck(deck_id)
+    for i in range(50):
+        deck.add(Card(question=f"{worker}-{i}", answer="A"))
+
+
+class TestSqlConcurrency(SqlServiceTestCase):
+    def test_wal_enabled(self):
+        with self._connect() as conn:
+            mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+        self.assertEqual(mode, "wal")
+
+    def test_retry_until_lock_released(self):
+        config = SqlConfig(
+            database=str(self.db_path), busy_timeout=0.01, max_retries=8, retry_backoff=0.02
+        )
+        service = SqlDeckService(config=config)
+        blocker = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        blocker.execute("BEGIN IMMEDIATE")
+        timer = threading.Timer(0.1, blocker.rollback)
+        timer.start()
+        try:
+            deck = service.create_deck("Contended")
+        finally:
+            timer.join()
+            blocker.close()
         self.assertIsNotNone(deck)
-        card = Card(question="Q", answer="A")
+
+    def test_retry_gives_up(self):
+        config = SqlConfig(
+            database=str(self.db_path), busy_timeout=0.01, max_retries=1, retry_backoff=0.01
+        )
+        service = SqlDeckService(config=config)
+        blocker = self._connect()
+        blocker.execute("BEGIN IMMEDIATE")
+        try:
+            with self.assertRaises(sqlite3.OperationalError):
+                service.create_deck("Never")
+        finally:
+            blocker.rollback()
+            blocker.close()
+
+    def test_concurrent_processes(self):
+        for single_writer in (False, True):
+            with self.subTest(single_writer=single_writer):
+                deck = self.service.create_deck(f"Shared {single_writer}")
+                workers = [
+                    multiprocessing.get_context("spawn").Process(
+                        target=_add_cards,
+                        args=(str(self.db_path), deck.id(), worker, single_writer),
+                    )
+                    for worker in range(4)
+                ]
+                for worker in workers:
+                    worker.start()
+                for worker in workers:
+                    worker.join()
+                self.assertTrue(all(worker.exitcode == 0 for worker in workers))
+                self.assertEqual(deck.stats().count, 200)
+
+    def test_checkpoint(self):
+        deck = self.service.create_deck("Checkpoint")
+        deck.add(Card(question="Q", answer="A"))
+        busy, _, _ = self.service.checkpoint("TRUNCATE")
+        self.assertEqual(busy, 0)
+
+    def test_pragma_keywords_validated(self):
+        self.assertEqual(SqlConfig(database="db", journal_mode="truncate").journal_mode, "TRUNCATE")
+        with self.assertRaises(ValueError):
+            SqlConfig(database="db", journal_mode="wal; DROP TABLE decks")
+        with mock.patch.dict(os.environ, {"ANKI_SCROLL_DB_JOURNAL_MODE": "wal2"}):
+            with self.assertRaises(ValueError):
+                SqlConfig.load()
+        with self.assertRaises(ValueError):
+            self.service.checkpoint("PASSIVE); DELETE FROM cards; --")
+
+
+LONG_ANSWER = "Spaced repetition schedules reviews at increasing intervals. " * 20
+
+
+class TestSqlCompression(SqlServiceTestCase):
+    def setUp(self):
+        super().setUp()
+        self.config.compress_threshold = 256
+        self.service = SqlDeckService(config=self.config)
+
+    def _stored_types(self):
+        with self._connect() as conn:
+            rows = conn.execute("SELECT typeof(answer) FROM cards ORDER BY id").fetchall()
+        return [row[0] for row in rows]
+
+    def test_long_answers_are_compressed(self):
+        deck = self.service.create_deck("Compressed")
+        deck.add(Card(question="Q1", answer=LONG_ANSWER))
+        deck.add(Card(question="Q2", answer="short"))
+        deck.add_many([Card(question="Q3", answer=LONG_ANSWER)])
+        self.assertEqual(self._stored_types(), ["blob", "text", "blob"])
+        self.assertEqual(
+            list(deck),
+            [
+                Card(question="Q1", answer=LONG_ANSWER),
+                Card(question="Q2", answer="short"),
+                Card(question="Q3", answer=LONG_ANSWER),
+            ],
+        )
+
+    def test_remove_compressed(self):
+        deck = self.service.create_deck("Remove Compressed")
+        card = Card(question="Q", answer=LONG_ANSWER)
         deck.add(card)
-        
-        cards = list(deck)
-        self.assertEqual(len(cards), 1)
-        self.assertEqual(cards[0].question, "Q")
-        self.assertEqual(cards[0].answer, "A")
-
-    def test_remove(self):
-        deck = self.service.create_deck("Remove Deck")
-        self.assertIsNotNone(deck)
-        card = Card(question="Q", answer="A")
         deck.add(card)
         deck.remove(card)
-        cards = list(deck)
-        self.assertEqual(len(cards), 0)
+        self.assertEqual(list(deck), [card])
 
-    def test_iter(self):
-        deck = self.service.create_deck("Iter Deck")
-        self.assertIsNotNone(deck)
-        card_a = Card(question="A?", answer="1")
-        card_b = Card(question="B?", answer="2")
-        deck.add(card_a)
-        deck.add(card_b)
-        cards = list(deck)
-        self.assertEqual(cards, [card_a, card_b])
+    def test_remove_compares_compressed_answers(self):
+        deck = self.service.create_deck("Same Question")
+        cards = [Card(question="Q", answer="!" * i + LONG_ANSWER) for i in range(5)]
+        deck.add_many(cards)
+        decode = AnswerCodec.decode
+        with mock.patch.object(AnswerCodec, "decode", autospec=True, side_effect=decode) as spy:
+            deck.remove(cards[3])
+        # only the copy with the size of the answer is decompressed
+        self.assertEqual(spy.call_count, 1)
+        self.assertEqual(list(deck), cards[:3] + cards[4:])
+
+    def test_remove_compressed_with_other_settings(self):
+        deck = self.service.create_deck("Other Settings")
+        card = Card(question="Q", answer=LONG_ANSWER)
+        deck.add(card)
+        self.config.compression_level = 1
+        other = SqlDeckService(config=self.config).get_deck(deck.id())
+        other.remove(card)
+        self.assertEqual(list(deck), [])
 
+    def test_zlib_format_readable(self):
+        # answers written before raw deflate are zlib streams in format 1
+        deck = self.service.create_deck("Legacy")
+        deck.add(Card(question="Q", answer="placeholder"))
+        data = LONG_ANSWER.encode("utf-8")
+        blob = bytes([1]) + (0).to_bytes(4, "little") + len(data).to_bytes(4, "little") + zlib.compress(data)
+        with self._connect() as conn:
+            conn.execute("UPDATE cards SET answer = ?", (blob,))
+        card = Card(question="Q", answer=LONG_ANSWER)
+        self.assertEqual(list(deck), [card])
+        deck.remove(card)
+        self.assertEqual(list(deck), [])
 
-class TestSqlDeckService(SqlServiceTestCase):
-    def test_decks(self):
-        deck = self.service.create_deck("Deck List")
-        self.assertIsNotNone(deck)
-        decks = list(self.service.decks())
-        self.assertTrue(any(candidate.id() == deck.id() for candidate in decks))
+    def test_readable_without_compression(self):
+        deck = self.service.create_deck("Mixed")
+        deck.add(Card(question="Q", answer=LONG_ANSWER))
+        plain = SqlDeckService(config=SqlConfig(database=str(self.db_path)))
+        plain_deck = plain.get_deck(deck.id())
+        plain_deck.add(Card(question="Q2", answer=LONG_ANSWER))
+        self.assertEqual(self._stored_types(), ["blob", "text"])
+        self.assertEqual([card.answer for card in plain_deck], [LONG_ANSWER, LONG_ANSWER])
 
-    def test_get_deck(self):
-        deck = self.service.create_deck("Lookup Deck")
-        self.assertIsNotNone(deck)
-        fetched = self.service.get_deck(deck.id())
-        self.assertIsNotNone(fetched)
-        self.assertEqual(fetched.id(), deck.id())
-
-    def test_add_deck(self):
-        donor_service = SimpleDeck("Donor")
-        donor_card = Card(question="Origin", answer="Deck")
-        donor_service.add(donor_card)
-        self.service.add_deck(donor_service)
-        retrieved = self.service.get_deck(donor_service.id())
-        self.assertIsNotNone(retrieved)
-        self.assertEqual(list(retrieved), [donor_card])
-
-    def test_create_deck(self):
-        deck = self.service.create_deck("Factory Deck")
-        self.assertIsNotNone(deck)
-        duplicate = self.service.create_deck("Factory Deck")
-        self.assertIsNone(duplicate)
+    def test_dictionary(self):
+        deck = self.service.create_deck("Dictionary")
+        deck.add_many(
+            Card(question=f"Q{i}", answer=f"{i}: {LONG_ANSWER}") for i in range(20)
+        )
+        dictionary_id = self.service.train_compression_dictionary()
+        self.assertIsNotNone(dictionary_id)
+        deck.add(Card(question="new", answer=LONG_ANSWER))
+        with self._connect() as conn:
+            blob = conn.execute("SELECT answer FROM cards ORDER BY id DESC LIMIT 1").fetchone()[0]
+        self.assertEqual(int.from_bytes(blob[1:5], "little"), dictionary_id)
+        # a new service loads the dictionary from the database
+        reopened = SqlDeckService(config=SqlConfig(database=str(self.db_path)))
+        answers = [card.answer for card in reopened.get_deck(deck.id())]
+        self.assertEqual(answers[-1], LONG_ANSWER)
+        self.assertEqual(len(answers), 21)
 
-    def test_remove_deck(self):
-        deck = self.service.create_deck("Disposable")
-        self.assertIsNotNone(deck)
-        self.service.remove_deck(deck.id())
-        self.assertIsNone(self.service.get_deck(deck.id()))
+    def test_train_dictionary_keeps_shared_sequences(self):
+        dictionary = train_dictionary(["alpha beta unique1", "alpha beta unique2"])
+        self.assertIn(b"alpha beta", dictionary)
+        self.assertNotIn(b"unique1", dictionary)
+
+    def test_compression_report(self):
+        deck = self.service.create_deck("Report")
+        deck.add(Card(question="Q1", answer=LONG_ANSWER))
+        deck.add(Card(question="Q2", answer="short"))
+        report = self.service.compression_report()
+        self.assertEqual(report.answers, 2)
+        self.assertEqual(report.compressed_answers, 1)
+        self.assertEqual(report.plain_bytes, len(LONG_ANSWER) + len("short"))
+        self.assertGreater(report.ratio, 5)
 
 
 if __name__ == "__main__":
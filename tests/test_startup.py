@@ -0,0 +1,31 @@
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+from anki_scroll import LAZY_MODULES
+
+
+class TestLazyStartup(unittest.TestCase):
+    def test_import_does_no_work(self):
+        code = (
+            "import sys\n"
+            "from anki_scroll.webapp.app import app\n"
+            "import anki_scroll.llms\n"
+            f"print(','.join(name for name in {LAZY_MODULES!r} if name in sys.modules))\n"
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            completed = subprocess.run(
+                [sys.executable, "-c", code],
+                cwd=directory,
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+            self.assertEqual(list(Path(directory).iterdir()), [])
+        self.assertEqual(completed.stdout.strip(), "")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,201 @@
+import asyncio
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from fastapi.testclient import TestClient
+
+from anki_scroll.lm_scheduler import Priority, current_priority
+from anki_scroll.services import Card, CardGenerator
+from anki_scroll.simple_services import SimpleDeckService
+from anki_scroll.warmup import SpecUsage, WarmupConfig, warm_up
+from anki_scroll.webapp import WebState, build_app
+
+DAY = 24 * 3600.0
+
+
+class WarmingGenerator(CardGenerator):
+    def __init__(self, delay=0.0, failing=()):
+        self.delay = delay
+        self.failing = set(failing)
+        self.warmed = []
+        self.priorities = []
+        self.running = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def create_card(self, theme: str, instructions: str) -> Card:
+        return Card(question=f"{theme} question", answer=f"{instructions} answer")
+
+    def warm_up(self, theme: str, instructions: str) -> None:
+        with self._lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+            self.priorities.append(current_priority())
+        try:
+            time.sleep(self.delay)
+            if theme in self.failing:
+                raise RuntimeError("generation failed")
+            self.warmed.append((theme, instructions))
+        finally:
+            with self._lock:
+                self.running -= 1
+
+
+class SpecUsageTests(unittest.TestCase):
+    def test_frequent_and_recent_first(self):
+        usage = SpecUsage(half_life=DAY)
+        now = 100 * DAY
+        for _ in range(3):
+            usage.record("often", "", now=now - 1)
+        usage.record("once", "", now=now)
+        # used a lot, but long ago
+        for _ in range(10):
+            usage.record("stale", "", now=now - 10 * DAY)
+        self.assertEqual(usage.top(3, now=now), [("often", ""), ("once", ""), ("stale", "")])
+        self.assertEqual(usage.top(1, now=now), [("often", "")])
+
+    def test_forget_least_used(self):
+        usage = SpecUsage(max_tracked=2)
+        usage.record("a", "", now=10)
+        usage.record("a", "", now=10)
+        usage.record("b", "", now=10)
+        usage.record("c", "", now=11)
+        self.assertEqual(len(usage), 2)
+        self.assertEqual(set(usage.top(2, now=11)), {("a", ""), ("c", "")})
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "usage" / "specs.json"
+            usage = SpecUsage()
+            self.assertFalse(usage.save(path))
+            usage.record("theme", "instructions", now=10)
+            usage.record("other", "", now=5)
+            self.assertTrue(usage.save(path))
+            # nothing changed since
+            self.assertFalse(usage.save(path))
+            loaded = SpecUsage.load(path)
+            self.assertEqual(loaded.top(2, now=10), usage.top(2, now=10))
+
+    def test_failed_save_stays_unsaved(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "specs.json"
+            usage = SpecUsage()
+            usage.record("theme", "", now=10)
+            with mock.patch("anki_scroll.warmup.os.replace", side_effect=OSError("disk full")):
+                with self.assertRaises(OSError):
+                    usage.save(path)
+            # no temporary file left behind
+            self.assertEqual(list(Path(directory).iterdir()), [])
+            self.assertTrue(usage.save(path))
+            self.assertEqual(SpecUsage.load(path).top(1, now=10), [("theme", "")])
+
+    def test_load_missing_or_corrupt(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "specs.json"
+            self.assertEqual(len(SpecUsage.load(path)), 0)
+            path.write_text("{not json")
+            self.assertEqual(len(SpecUsage.load(path)), 0)
+
+
+class WarmUpTests(unittest.IsolatedAsyncioTestCase):
+    def _usage(self, themes):
+        usage = SpecUsage()
+        for count, theme in enumerate(themes):
+            for _ in range(len(themes) - count):
+                usage.record(theme, "instructions")
+        return usage
+
+    async def test_budget(self):
+        generator = WarmingGenerator(delay=0.02)
+        usage = self._usage(["a", "b", "c", "d", "e"])
+        config = WarmupConfig(max_specs=4, max_concurrency=2)
+        warmed = await warm_up(generator, usage, config)
+        self.assertEqual(warmed, 4)
+        self.assertEqual(sorted(theme for theme, _ in generator.warmed), ["a", "b", "c", "d"])
+        self.assertLessEqual(generator.peak, 2)
+        self.assertEqual(set(generator.priorities), {Priority.BACKGROUND})
+
+    async def test_failures_skipped(self):
+        generator = WarmingGenerator(failing={"b"})
+        warmed = await warm_up(generator, self._usage(["a", "b", "c"]), WarmupConfig())
+        self.assertEqual(warmed, 2)
+
+    async def test_timeout(self):
+        generator = WarmingGenerator(delay=0.3)
+        config = WarmupConfig(max_concurrency=1, timeout=0.1)
+        warmed = await warm_up(generator, self._usage(["a", "b"]), config)
+        self.assertEqual(warmed, 0)
+
+    async def test_nothing_to_warm(self):
+        self.assertEqual(await warm_up(WarmingGenerator(), SpecUsage(), WarmupConfig()), 0)
+
+
+class StartupWarmUpTests(unittest.TestCase):
+    def test_warm_up_and_save(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "specs.json"
+            usage = SpecUsage()
+            usage.record("History", "dates")
+            usage.save(path)
+
+            generator = WarmingGenerator()
+            state = WebState(
+                deck_service=SimpleDeckService(),
+                card_generator=generator,
+                warmup_config=WarmupConfig(path=str(path)),
+            )
+            with TestClient(build_app(state)) as client:
+                deck_id = client.get("/api/v1/decks").json()[0]["id"]
+                spec = client.post(
+                    f"/api/v1/decks/{deck_id}/specs", json={"theme": "Geology", "instructions": ""}
+                ).json()
+                response = client.get(f"/api/v1/decks/{deck_id}/specs/{spec['id']}/candidates")
+                self.assertEqual(response.status_code, 200)
+                deadline = time.monotonic() + 2
+                while not generator.warmed and time.monotonic() < deadline:
+                    time.sleep(0.01)
+            self.assertEqual(generator.warmed, [("History", "dates")])
+            # saved on shutdown
+            self.assertIn(("Geology", ""), SpecUsage.load(path).top(2))
+
+    def test_periodic_save_survives_errors(self):
+        with tempfile.TemporaryDirectory() as directory:
+            state = WebState(
+                deck_service=SimpleDeckService(),
+                card_generator=WarmingGenerator(),
+                warmup_config=WarmupConfig(path=str(Path(directory) / "specs.json"), save_interval=0.01),
+            )
+            calls = []
+
+            def save():
+                calls.append(None)
+                if len(calls) == 1:
+                    raise OSError("disk full")
+
+            async def run():
+                task = asyncio.create_task(state.save_spec_usage_periodically())
+                while len(calls) < 2 and not task.done():
+                    await asyncio.sleep(0.01)
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+
+            with mock.patch.object(state, "save_spec_usage", save):
+                with self.assertLogs("anki_scroll.webapp.app", "ERROR"):
+                    asyncio.run(run())
+            self.assertEqual(len(calls), 2)
+
+    def test_disabled_by_default(self):
+        generator = WarmingGenerator()
+        state = WebState(deck_service=SimpleDeckService(), card_generator=generator)
+        self.assertFalse(state.warmup_config.enabled)
+        with TestClient(build_app(state)):
+            pass
+        self.assertEqual(generator.warmed, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
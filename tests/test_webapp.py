@@ -1,8 +1,17 @@
+import asyncio
 import unittest
+from unittest import mock
+from uuid import uuid4
 
 import httpx
+from starlette.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
 
+from anki_scroll.services import Card, CardGenerator
+from anki_scroll.async_service import ThreadedDeckService
+from anki_scroll.simple_services import SimpleCardGenerator, SimpleDeckService
 from anki_scroll.webapp import DEFAULT_DECK_NAME, WebState, build_app
+from anki_scroll.webapp.feed import CardFeed
 
 
 class WebAppTests(unittest.IsolatedAsyncioTestCase):
@@ -45,6 +54,81 @@ class WebAppTests(unittest.IsolatedAsyncioTestCase):
         )
         self.assertEqual(response.status_code, 303)
 
+    async def test_deck_view_not_modified(self):
+        first = await self.client.get(f"/deck/{self.default_deck_id}")
+        etag = first.headers.get("etag")
+        self.assertTrue(etag)
+        self.assertIn("last-modified", first.headers)
+        second = await self.client.get(
+            f"/deck/{self.default_deck_id}", headers={"If-None-Match": etag}
+        )
+        self.assertEqual(second.status_code, 304)
+        self.assertEqual(second.content, b"")
+
+    async def test_deck_view_etag_changes_after_delete(self):
+        first = await self.client.get(f"/deck/{self.default_deck_id}")
+        etag = first.headers["etag"]
+        card = Card(question=f"Temporary {uuid4()}", answer="Temporary answer")
+        deck = self.app.state.web_state.deck_service.get_deck(self.default_deck_id)
+        deck.add(card)
+        added = await self.client.get(
+            f"/deck/{self.default_deck_id}", headers={"If-None-Match": etag}
+        )
+        self.assertEqual(added.status_code, 200)
+        self.assertIn(card.question, added.text)
+        etag = added.headers["etag"]
+        await self.client.post(
+            f"/deck/{self.default_deck_id}/cards/delete",
+            data={"question": card.question, "answer": card.answer},
+            follow_redirects=False,
+        )
+        second = await self.client.get(
+            f"/deck/{self.default_deck_id}", headers={"If-None-Match": etag}
+        )
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second.headers["etag"], etag)
+        self.assertNotIn(card.question, second.text)
+
+    async def test_home_not_modified(self):
+        first = await self.client.get("/home/")
+        etag = first.headers["etag"]
+        second = await self.client.get("/home/", headers={"If-None-Match": etag})
+        self.assertEqual(second.status_code, 304)
+        name = f"Geology {uuid4()}"
+        await self.client.post("/home/new-deck", data={"name": name})
+        third = await self.client.get("/home/", headers={"If-None-Match": etag})
+        self.assertEqual(third.status_code, 200)
+        self.assertIn(name, third.text)
+
+    async def test_recreated_deck_not_served_from_cache(self):
+        service = SimpleDeckService()
+        state = WebState(deck_service=service, card_generator=RepeatingGenerator([]))
+        transport = httpx.ASGITransport(app=build_app(state))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            deck = service.create_deck("Recreated")
+            deck.add(Card(question="old question", answer="old answer"))
+            old = await client.get(f"/deck/{deck.id()}")
+            self.assertIn("old question", old.text)
+
+            # removed behind the back of the web state, only the incarnation changes
+            service.remove_deck(deck.id())
+            deck = service.create_deck("Recreated")
+            deck.add(Card(question="new question", answer="new answer"))
+            conditional = await client.get(
+                f"/deck/{deck.id()}", headers={"If-None-Match": old.headers["etag"]}
+            )
+            self.assertEqual(conditional.status_code, 200)
+            plain = await client.get(f"/deck/{deck.id()}")
+            self.assertIn("new question", plain.text)
+            self.assertNotIn("old question", plain.text)
+
+            removed = await client.delete(f"/api/v1/decks/{deck.id()}")
+            self.assertEqual(removed.status_code, 204)
+            self.assertFalse(
+                any(key[:2] == ("deck", deck.id()) for key in state.render_cache._entries)
+            )
+            self.assertEqual((await client.get(f"/deck/{deck.id()}")).status_code, 404)
+
     async def test_create_spec_page(self):
         response = await self.client.get(f"/create_card/{self.default_deck_id}/")
         self.assertEqual(response.status_code, 200)
@@ -87,5 +171,222 @@ class WebAppTests(unittest.IsolatedAsyncioTestCase):
         return location.rsplit("/", 1)[-1] if location else None
 
 
+class LifespanTests(unittest.TestCase):
+    def test_shutdown_stops_deck_threads(self):
+        state = WebState(deck_service=SimpleDeckService(), card_generator=SimpleCardGenerator())
+        with TestClient(build_app(state)) as client:
+            self.assertEqual(client.get("/home/").status_code, 200)
+            threaded = state.async_deck_service
+        self.assertTrue(threaded._writer._shutdown)
+        self.assertTrue(threaded._readers._shutdown)
+        # a new one is created if the state is used again
+        self.assertIsNot(state.async_deck_service, threaded)
+
+    def test_given_service_left_open(self):
+        threaded = ThreadedDeckService(SimpleDeckService())
+        self.addCleanup(threaded.close)
+        state = WebState(
+            deck_service=threaded.service,
+            async_deck_service=threaded,
+            card_generator=SimpleCardGenerator(),
+        )
+        with TestClient(build_app(state)):
+            pass
+        self.assertFalse(threaded._writer._shutdown)
+
+
+class RepeatingGenerator(CardGenerator):
+    """Replay the given cards in order, like an llm repeating itself."""
+
+    def __init__(self, cards):
+        self._cards = list(cards)
+
+    def create_card(self, theme: str, instructions: str) -> Card:
+        return self._cards.pop(0)
+
+
+class DuplicateFilterTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.generator = RepeatingGenerator(
+            [
+                Card(question="why use flashcards", answer="copy of a deck card"),
+                Card(question="What is a comet?", answer="An icy body."),
+                Card(question="What is a comet", answer="served before"),
+                Card(question="What is a nebula?", answer="A cloud of gas."),
+            ]
+        )
+        state = WebState(deck_service=SimpleDeckService(), card_generator=self.generator)
+        self.app = build_app(state)
+        transport = httpx.ASGITransport(app=self.app)
+        self.client = httpx.AsyncClient(transport=transport, base_url="http://test")
+        self.deck_id = next(iter(state.deck_service.decks())).id()
+        response = await self.client.post(
+            f"/create_card/{self.deck_id}/",
+            data={"theme": "Astronomy", "instructions": ""},
+            follow_redirects=False,
+        )
+        self.spec_id = response.headers["location"].rsplit("/", 1)[-1]
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+
+    async def test_near_duplicates_are_skipped(self):
+        first = await self.client.get(f"/select/{self.deck_id}/{self.spec_id}")
+        self.assertIn("What is a comet?", first.text)
+        second = await self.client.get(f"/select/{self.deck_id}/{self.spec_id}")
+        self.assertIn("What is a nebula?", second.text)
+        self.assertEqual(self.generator._cards, [])
+
+    async def test_select_keeps_filter_in_sync(self):
+        state = self.app.state.web_state
+        deck = await state.async_deck_service.get_deck(self.deck_id)
+        await state.sync_duplicate_filter(deck)
+        cards = [
+            Card(question="What is a pulsar?", answer="A neutron star."),
+            Card(question="What is a quasar?", answer="An active galactic nucleus."),
+        ]
+        await state.select(deck, cards)
+        stats = await deck.stats()
+        self.assertFalse(state.duplicate_filter.needs_sync(self.deck_id, stats.version))
+        self.assertTrue(state.duplicate_filter.is_duplicate(self.deck_id, cards[1]))
+
+
+class ReviewRouteTests(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        state = WebState(deck_service=SimpleDeckService(), card_generator=RepeatingGenerator([]))
+        self.app = build_app(state)
+        transport = httpx.ASGITransport(app=self.app)
+        self.client = httpx.AsyncClient(transport=transport, base_url="http://test")
+        self.deck_id = next(iter(state.deck_service.decks())).id()
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+
+    async def test_review_until_nothing_is_due(self):
+        first = await self.client.get(f"/review/{self.deck_id}")
+        self.assertEqual(first.status_code, 200)
+        self.assertIn("What is spaced repetition?", first.text)
+        state = self.app.state.web_state.review_service.next_due(self.deck_id)
+        graded = await self.client.post(
+            f"/review/{self.deck_id}/{state.card_id}", data={"grade": 4}, follow_redirects=False
+        )
+        self.assertEqual(graded.status_code, 303)
+        second = await self.client.get(f"/review/{self.deck_id}")
+        self.assertIn("Why use flashcards?", second.text)
+        state = self.app.state.web_state.review_service.next_due(self.deck_id)
+        await self.client.post(f"/review/{self.deck_id}/{state.card_id}", data={"grade": 5})
+        done = await self.client.get(f"/review/{self.deck_id}")
+        self.assertIn("No card is due", done.text)
+
+    async def test_grade_unknown_card(self):
+        response = await self.client.post(f"/review/{self.deck_id}/999", data={"grade": 4})
+        self.assertEqual(response.status_code, 404)
+
+    async def test_grade_invalid(self):
+        state = self.app.state.web_state.review_service.next_due(self.deck_id)
+        response = await self.client.post(
+            f"/review/{self.deck_id}/{state.card_id}", data={"grade": 9}
+        )
+        self.assertEqual(response.status_code, 422)
+
+
+class CardFeedTests(unittest.TestCase):
+    def setUp(self):
+        self.generator = RepeatingGenerator(
+            [Card(question=f"Feed question {i}", answer=f"Answer {i}") for i in range(10)]
+        )
+        self.state = WebState(deck_service=SimpleDeckService(), card_generator=self.generator)
+        self.client = TestClient(build_app(self.state))
+        self.deck = next(iter(self.state.deck_service.decks()))
+        self.spec = self.state.save_spec(self.deck.id(), "Astronomy", "")
+        self.url = f"/feed/{self.deck.id()}/{self.spec.id}"
+
+    def tearDown(self):
+        self.client.close()
+
+    def test_feed_page(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("/ws", response.text)
+
+    def test_prefetch_select_and_skip(self):
+        with self.client.websocket_connect(f"{self.url}/ws") as websocket:
+            cards = [websocket.receive_json() for _ in range(3)]
+            self.assertEqual([card["question"] for card in cards], [f"Feed question {i}" for i in range(3)])
+            # nothing more is generated until the user answers
+            self.assertEqual(len(self.generator._cards), 7)
+            websocket.send_json({"action": "select", "id": cards[0]["id"]})
+            self.assertEqual(websocket.receive_json()["question"], "Feed question 3")
+            websocket.send_json({"action": "skip", "id": cards[1]["id"]})
+            self.assertEqual(websocket.receive_json()["question"], "Feed question 4")
+        questions = [card.question for card in self.deck]
+        self.assertIn("Feed question 0", questions)
+        self.assertNotIn("Feed question 1", questions)
+
+    def test_malformed_messages(self):
+        with self.client.websocket_connect(f"{self.url}/ws") as websocket:
+            cards = [websocket.receive_json() for _ in range(3)]
+            websocket.send_text("not json")
+            self.assertEqual(websocket.receive_json()["type"], "error")
+            for message in (
+                [cards[0]["id"]],
+                {"action": "select", "id": str(cards[0]["id"])},
+                {"action": "select", "id": [cards[0]["id"]]},
+                {"action": "select", "id": True},
+                {"action": "keep", "id": cards[0]["id"]},
+            ):
+                websocket.send_json(message)
+                self.assertEqual(websocket.receive_json()["type"], "error")
+            # the feed goes on
+            websocket.send_json({"action": "select", "id": cards[0]["id"]})
+            self.assertEqual(websocket.receive_json()["question"], "Feed question 3")
+
+    def test_select_failure_closes_the_feed(self):
+        with mock.patch.object(self.state, "select", side_effect=LookupError("deck was removed")):
+            with self.client.websocket_connect(f"{self.url}/ws") as websocket:
+                cards = [websocket.receive_json() for _ in range(3)]
+                websocket.send_json({"action": "select", "id": cards[0]["id"]})
+                self.assertEqual(
+                    websocket.receive_json(), {"type": "error", "detail": "deck was removed"}
+                )
+                with self.assertRaises(WebSocketDisconnect) as closed:
+                    websocket.receive_json()
+        self.assertEqual(closed.exception.code, 1011)
+
+    def test_unknown_spec(self):
+        with self.assertRaises(WebSocketDisconnect):
+            with self.client.websocket_connect(f"/feed/{self.deck.id()}/missing/ws") as websocket:
+                websocket.receive_json()
+
+
+class GoneWebSocket:
+    """a client that disconnected while the feed was generating a card"""
+
+    def __init__(self):
+        self.gone = asyncio.Event()
+
+    async def receive_json(self):
+        await self.gone.wait()
+        raise WebSocketDisconnect(1001)
+
+    async def send_json(self, message):
+        self.gone.set()
+        raise RuntimeError('Cannot call "send" once a close message has been sent.')
+
+
+class CardFeedDisconnectTests(unittest.IsolatedAsyncioTestCase):
+    async def test_disconnect_during_prefetch(self):
+        async def next_card():
+            await asyncio.sleep(0.01)
+            return Card(question="q", answer="a")
+
+        async def select(card):
+            pass
+
+        feed = CardFeed(GoneWebSocket(), next_card, select)
+        # ends quietly, the card generated for nobody is dropped
+        await asyncio.wait_for(feed.run(), timeout=2)
+
+
 if __name__ == "__main__":
     unittest.main()